@@ -19,7 +19,7 @@ except ImportError:
     )
 
 logger = SDKLogger("Interpreter Adapter")
-send_request, _ = useSysCall()
+send_request, SysCallWrapper = useSysCall()
 
 @add_framework_adapter("Open-Interpreter")
 def prepare_interpreter():
@@ -55,8 +55,11 @@ def adapter_aios_completions(**params):
     """
 
     if params.get("stream", False) is True:
-        # TODO: AIOS not supprt stream mode
-        logger.log("AIOS does not support stream mode currently."
+        if not params.get("tools"):
+            return stream_aios_completions(**params)
+
+        # tool calls are parsed from the full response, so they cannot stream
+        logger.log("AIOS does not support stream mode with tools."
                    "The stream mode has been automatically set to False.", level="warn")
         params["stream"] = False
 
@@ -66,13 +69,13 @@ def adapter_aios_completions(**params):
 
     for attempt in range(attempts):
         try:
-            response, _, _, _, _ = send_request(
+            response = send_request(
                 agent_name="Open-Interpreter",
                 query=LLMQuery(
                     messages=params['messages'],
                     tools=(params["tools"] if "tools" in params else None)
                 )
-            )
+            )["response"]
 
             # format similar to completion in interpreter
             comletion = {'choices':
@@ -99,6 +102,18 @@ def adapter_aios_completions(**params):
         raise first_error
 
 
+def stream_aios_completions(**params):
+    """yield completion chunks in the format of streaming litellm completions
+    """
+    syscall = SysCallWrapper.llm_stream(
+        agent_name="Open-Interpreter",
+        query=LLMQuery(messages=params['messages'])
+    )
+
+    for chunk in syscall:
+        yield {'choices': [{'delta': {'content': chunk}}]}
+
+
 def format_tool_calls_to_interpreter(tool_calls):
     name = tool_calls[0]["name"]
     arguments = tool_calls[0]["parameters"]
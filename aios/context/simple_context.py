@@ -28,7 +28,7 @@ class SimpleContextManager(BaseContextManager):
     def clear_restoration(self, pid):
         # print(f"Process {pid} has been deleted.")
         # os.remove(os.path.join(self.context_dir, f"process-{pid}.pt"))
-        self.context_dict.pop(pid)
+        self.context_dict.pop(str(pid))
         return
 
     def stop(self):
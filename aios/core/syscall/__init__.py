@@ -1,22 +1,33 @@
 
-from threading import Event, Thread
+from concurrent.futures import Future
+from itertools import count
+
+import asyncio
+import time
 
 from cerebrum.llm.communication import Request
 
+# process ids handed out to syscalls, which do not own a thread
+_syscall_ids = count(1)
+
 
-class Syscall(Thread):
+class Syscall:
     def __init__(self, agent_name, query: Request):
-        super().__init__()
         self.agent_name = agent_name
         self.query = query
-        self.event = Event()
-        self.pid: int = None
+        # completed by the scheduler once the syscall has been addressed
+        self.future: Future = Future()
+        self.pid: int = next(_syscall_ids)
         self.status = None
         self.response = None
+        self.priority = None
         self.time_limit = None
         self.created_time = None
         self.start_time = None
         self.end_time = None
+        # time spent waiting for a resource after the syscall was started,
+        # e.g. for a turn to run a tool
+        self.resource_waiting_time = 0.0
 
     def set_created_time(self, time):
         self.created_time = time
@@ -36,6 +47,12 @@ class Syscall(Thread):
     def get_end_time(self):
         return self.end_time
 
+    def add_resource_waiting_time(self, seconds):
+        self.resource_waiting_time += seconds
+
+    def get_resource_waiting_time(self):
+        return self.resource_waiting_time
+
     def set_priority(self, priority):
         self.priority = priority
 
@@ -72,6 +89,27 @@ class Syscall(Thread):
     def set_time_limit(self, time_limit):
         self.time_limit = time_limit
 
-    def run(self):
-        self.set_pid(self.native_id)
-        self.event.wait()
+    def set_result(self, response):
+        """Complete the syscall with its response and wake the caller."""
+        if self.future.done():
+            return
+        self.set_response(response)
+        self.set_status("done")
+        self.set_end_time(time.time())
+        self.future.set_result(response)
+
+    def set_exception(self, exception):
+        """Complete the syscall with an error, which wait() re-raises."""
+        if self.future.done():
+            return
+        self.set_status("done")
+        self.set_end_time(time.time())
+        self.future.set_exception(exception)
+
+    def wait(self, timeout=None):
+        """Block until the syscall is completed and return its response."""
+        return self.future.result(timeout=timeout)
+
+    def __await__(self):
+        """Allow a coroutine to await the syscall's response."""
+        return asyncio.wrap_future(self.future).__await__()
@@ -1,4 +1,93 @@
 from aios.core.syscall import Syscall
 
+from threading import Condition, Lock
+
+import asyncio
+
 class LLMSyscall(Syscall):
-    pass
+    """
+    Syscall to the LLM. With stream=True the generated text is also delivered
+    in chunks while the syscall runs, by iterating over the syscall with
+    `for` or `async for`. The completed Response still holds the full text.
+    """
+    def __init__(self, agent_name, query, stream: bool = False):
+        super().__init__(agent_name, query)
+        self.stream = stream
+        self.chunks: list[str] = []
+        self.chunk_signal = Condition(Lock())
+        # (loop, asyncio.Event) of each async iterator waiting for chunks
+        self.chunk_waiters = []
+        # estimate of the prompt's tokens for the rate limits, see
+        # AdmissionController.prompt_tokens
+        self.prompt_tokens: int | None = None
+
+    def add_chunk(self, chunk: str):
+        """Deliver a chunk of generated text to the iterators."""
+        if not chunk:
+            return
+        with self.chunk_signal:
+            self.chunks.append(chunk)
+        self.notify_chunks()
+
+    def notify_chunks(self):
+        with self.chunk_signal:
+            self.chunk_signal.notify_all()
+            waiters = list(self.chunk_waiters)
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def set_result(self, response):
+        super().set_result(response)
+        self.notify_chunks()
+
+    def set_exception(self, exception):
+        super().set_exception(exception)
+        self.notify_chunks()
+
+    def __iter__(self):
+        """Yield chunks as they are generated, until the syscall completes."""
+        idx = 0
+        while True:
+            with self.chunk_signal:
+                while idx >= len(self.chunks) and not self.future.done():
+                    self.chunk_signal.wait()
+                chunks = self.chunks[idx:]
+                done = self.future.done()
+
+            idx += len(chunks)
+            yield from chunks
+
+            if done and idx >= len(self.chunks):
+                break
+
+        # re-raise the error the syscall failed with
+        self.future.result()
+
+    async def __aiter__(self):
+        """Yield chunks as they are generated without blocking the loop."""
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self.chunk_signal:
+            self.chunk_waiters.append(waiter)
+
+        try:
+            idx = 0
+            while True:
+                event.clear()
+                with self.chunk_signal:
+                    chunks = self.chunks[idx:]
+                    done = self.future.done()
+
+                idx += len(chunks)
+                for chunk in chunks:
+                    yield chunk
+
+                if done and idx >= len(self.chunks):
+                    break
+                if not chunks:
+                    await event.wait()
+        finally:
+            with self.chunk_signal:
+                self.chunk_waiters.remove(waiter)
+
+        self.future.result()
@@ -32,8 +32,8 @@ def useMemoryRequestQueue() -> (
     QueueStore.REQUEST_QUEUE[r_str] = _
 
     # Function to get messages from the queue
-    def getMessage():
-        return QueueStore.getMessage(_)
+    def getMessage(block: bool = True, timeout: float | None = None):
+        return QueueStore.getMessage(_, block=block, timeout=timeout)
 
     # Function to add messages to the queue
     def addMessage(message: str):
@@ -6,6 +6,8 @@ from aios.hooks.types.scheduler import (
     # FactoryParams,
     # LLMParams,
     SchedulerParams,
+    PrioritySchedulerParams,
+    RRSchedulerParams,
     # LLMRequestQueue,
     # QueueGetMessage,
     # QueueAddMessage,
@@ -17,20 +19,20 @@ from contextlib import contextmanager
 from aios.hooks.utils.validate import validate
 from aios.hooks.stores import queue as QueueStore, processes as ProcessStore
 from aios.scheduler.fifo_scheduler import FIFOScheduler
+from aios.scheduler.priority_scheduler import PriorityScheduler
+from aios.scheduler.rr_scheduler import RRScheduler
 
 
-@validate(SchedulerParams)
-def useFIFOScheduler(
-    params: SchedulerParams,
-) -> Tuple[Callable[[], None], Callable[[], None]]:
+def build_scheduler(scheduler_class, params: SchedulerParams):
     """
-    Initialize and return a scheduler with start and stop functions.
+    Create a scheduler of the given class from its parameters, reading the
+    syscalls from the global queues unless other getters are given.
 
     Args:
-        params (SchedulerParams): Parameters required for the scheduler.
-
-    Returns:
-        Tuple: A tuple containing the start and stop functions for the scheduler.
+        scheduler_class (type): FIFOScheduler, PriorityScheduler or
+            RRScheduler.
+        params (SchedulerParams): The parameters for the scheduler, including
+            those only its class takes.
     """
     if params.get_llm_syscall is None:
         from aios.hooks.stores._global import global_llm_req_queue_get_message
@@ -48,7 +50,23 @@ def useFIFOScheduler(
         from aios.hooks.stores._global import global_tool_req_queue_get_message
         params.get_tool_syscall = global_tool_req_queue_get_message
 
-    scheduler = FIFOScheduler(**params.model_dump())
+    return scheduler_class(**params.model_dump())
+
+
+@validate(SchedulerParams)
+def useFIFOScheduler(
+    params: SchedulerParams,
+) -> Tuple[Callable[[], None], Callable[[], None]]:
+    """
+    Initialize and return a scheduler with start and stop functions.
+
+    Args:
+        params (SchedulerParams): Parameters required for the scheduler.
+
+    Returns:
+        Tuple: A tuple containing the start and stop functions for the scheduler.
+    """
+    scheduler = build_scheduler(FIFOScheduler, params)
 
     # Function to start the scheduler
     def startScheduler():
@@ -70,23 +88,7 @@ def fifo_scheduler(params: SchedulerParams):
     Args:
         params (SchedulerParams): The parameters for the scheduler.
     """
-    if params.get_llm_syscall is None:
-        from aios.hooks.stores._global import global_llm_req_queue_get_message
-        params.get_llm_syscall = global_llm_req_queue_get_message
-
-    if params.get_memory_syscall is None:
-        from aios.hooks.stores._global import global_memory_req_queue_get_message
-        params.get_memory_syscall = global_memory_req_queue_get_message
-
-    if params.get_storage_syscall is None:
-        from aios.hooks.stores._global import global_storage_req_queue_get_message
-        params.get_storage_syscall = global_storage_req_queue_get_message
-
-    if params.get_tool_syscall is None:
-        from aios.hooks.stores._global import global_tool_req_queue_get_message
-        params.get_tool_syscall = global_tool_req_queue_get_message
-
-    scheduler = FIFOScheduler(**params.model_dump())
+    scheduler = build_scheduler(FIFOScheduler, params)
 
     scheduler.start()
     yield
@@ -100,22 +102,24 @@ def fifo_scheduler_nonblock(params: SchedulerParams):
     Args:
         params (SchedulerParams): The parameters for the scheduler.
     """
-    if params.get_llm_syscall is None:
-        from aios.hooks.stores._global import global_llm_req_queue_get_message
-        params.get_llm_syscall = global_llm_req_queue_get_message
+    return build_scheduler(FIFOScheduler, params)
 
-    if params.get_memory_syscall is None:
-        from aios.hooks.stores._global import global_memory_req_queue_get_message
-        params.get_memory_syscall = global_memory_req_queue_get_message
-
-    if params.get_storage_syscall is None:
-        from aios.hooks.stores._global import global_storage_req_queue_get_message
-        params.get_storage_syscall = global_storage_req_queue_get_message
+@validate(PrioritySchedulerParams)
+def priority_scheduler_nonblock(params: PrioritySchedulerParams):
+    """
+    Create a priority and deadline aware scheduler without starting it.
 
-    if params.get_tool_syscall is None:
-        from aios.hooks.stores._global import global_tool_req_queue_get_message
-        params.get_tool_syscall = global_tool_req_queue_get_message
+    Args:
+        params (PrioritySchedulerParams): The parameters for the scheduler.
+    """
+    return build_scheduler(PriorityScheduler, params)
 
-    scheduler = FIFOScheduler(**params.model_dump())
+@validate(RRSchedulerParams)
+def rr_scheduler_nonblock(params: RRSchedulerParams):
+    """
+    Create a round robin scheduler without starting it.
 
-    return scheduler
+    Args:
+        params (RRSchedulerParams): The parameters for the scheduler.
+    """
+    return build_scheduler(RRScheduler, params)
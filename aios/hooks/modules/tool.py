@@ -4,6 +4,7 @@ from typing import Tuple
 
 from aios.tool.manager import ToolManager
 from aios.hooks.types.tool import (
+    ToolManagerParams,
     ToolRequestQueue,
     ToolRequestQueueAddMessage,
     ToolRequestQueueCheckEmpty,
@@ -12,8 +13,8 @@ from aios.hooks.types.tool import (
 from aios.hooks.utils.validate import validate
 from aios.hooks.stores import queue as QueueStore, processes as ProcessStore
 
-# @validate(ToolManagerParams)
-def useToolManager() -> ToolManager:
+@validate(ToolManagerParams)
+def useToolManager(params: ToolManagerParams) -> ToolManager:
     """
     Initialize and return a tool manager instance.
 
@@ -23,7 +24,7 @@ def useToolManager() -> ToolManager:
     Returns:
         Tool Manager: An instance of the initialized Tool Manager.
     """
-    return ToolManager()
+    return ToolManager(**params.model_dump())
 
 def useToolRequestQueue() -> (
     Tuple[ToolRequestQueue, ToolRequestQueueGetMessage, ToolRequestQueueAddMessage, ToolRequestQueueCheckEmpty]
@@ -44,8 +45,8 @@ def useToolRequestQueue() -> (
     QueueStore.REQUEST_QUEUE[r_str] = _
 
     # Function to get messages from the queue
-    def getMessage():
-        return QueueStore.getMessage(_)
+    def getMessage(block: bool = True, timeout: float | None = None):
+        return QueueStore.getMessage(_, block=block, timeout=timeout)
 
     # Function to add messages to the queue
     def addMessage(message: str):
@@ -1,14 +1,36 @@
 from queue import Queue
+from threading import Condition
+
+import asyncio
 
 REQUEST_QUEUE: dict[str, Queue] = {}
 
-def getMessage(q: Queue):
-    return q.get(block=True, timeout=0.1)
+# Notified whenever a message is added to any request queue, so that a single
+# dispatcher can sleep until there is work instead of polling every queue.
+REQUEST_SIGNAL = Condition()
+
+# Put on a queue to tell the thread blocked on it to exit.
+STOP_SIGNAL = object()
+
+def getMessage(q: Queue, block: bool = True, timeout: float | None = None):
+    return q.get(block=block, timeout=timeout)
 
 def addMessage(q: Queue, message: str):
     q.put(message)
 
+    with REQUEST_SIGNAL:
+        REQUEST_SIGNAL.notify_all()
+
     return None
 
 def isEmpty(q: Queue):
     return q.empty()
+
+def addAsyncMessage(q: asyncio.Queue, message, loop: asyncio.AbstractEventLoop):
+    """Put a message on an asyncio queue from a thread outside its loop."""
+    loop.call_soon_threadsafe(q.put_nowait, message)
+
+    return None
+
+async def getAsyncMessage(q: asyncio.Queue):
+    return await q.get()
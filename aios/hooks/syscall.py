@@ -1,7 +1,7 @@
 import time
 
-from aios.core.syscall import Syscall
 from aios.core.syscall.llm import LLMSyscall
+from aios.core.syscall.memory import MemorySyscall
 from aios.core.syscall.storage import StorageSyscall
 from aios.core.syscall.tool import ToolSyscall
 from aios.hooks.stores._global import (
@@ -16,215 +16,162 @@ from cerebrum.memory.communication import MemoryQuery
 from cerebrum.storage.communication import StorageQuery
 from cerebrum.tool.communication import ToolQuery
 
+# syscall class and scheduler queue of each kind of syscall
+SYSCALL_KINDS = {
+    "llm": (LLMSyscall, global_llm_req_queue_add_message),
+    "storage": (StorageSyscall, global_storage_req_queue_add_message),
+    "memory": (MemorySyscall, global_memory_req_queue_add_message),
+    "tool": (ToolSyscall, global_tool_req_queue_add_message),
+}
+
+def submit_syscall(kind, agent_name, query, **options):
+    """Create a syscall of the given kind and queue it for the scheduler."""
+    syscall_class, add_message = SYSCALL_KINDS[kind]
+    syscall = syscall_class(agent_name, query, **options)
+    syscall.set_status("active")
+    syscall.set_created_time(time.time())
+    syscall.set_response(None)
+
+    add_message(syscall)
+
+    return syscall
+
+def syscall_result(syscall, completed_response):
+    """Return a completed syscall's response along with its timings."""
+    start_time = syscall.get_start_time()
+    end_time = syscall.get_end_time()
+    waiting_time = start_time - syscall.get_created_time() \
+        + syscall.get_resource_waiting_time()
+    turnaround_time = end_time - syscall.get_created_time()
+
+    return {
+        "response": completed_response,
+        "start_times": [start_time],
+        "end_times": [end_time],
+        "waiting_times": [waiting_time],
+        "turnaround_times": [turnaround_time],
+    }
+
+def llm_syscall_stream(agent_name, query):
+    """
+    Queues a streaming LLM syscall and returns it without waiting. Iterate
+    over the syscall, with `for` or `async for`, to receive the response in
+    chunks.
+    """
+    return submit_syscall("llm", agent_name, query, stream=True)
+
+def request_steps(query):
+    """
+    Generator of the syscalls a request is made of. It yields the kind and
+    query of each syscall in turn, is sent back its result, and returns the
+    result of the request.
+    """
+    if isinstance(query, LLMQuery):
+        action_type = query.action_type
+        if action_type not in ("chat", "tool_use", "operate_file"):
+            return None
+
+        result = yield "llm", query
+        if action_type == "tool_use":
+            result = yield "tool", result["response"].tool_calls
+        elif action_type == "operate_file":
+            result = yield "storage", result["response"]
+        return result
+
+    elif isinstance(query, ToolQuery):
+        return (yield "tool", query)
+
+    elif isinstance(query, MemoryQuery):
+        return (yield "memory", query)
+
+    elif isinstance(query, StorageQuery):
+        return (yield "storage", query)
+
 def useSysCall():
+    def syscall_exec(kind, agent_name, query):
+        """
+        Queues the syscall for the scheduler and blocks the calling agent until
+        the syscall is completed. No thread is created for the syscall itself.
+        """
+        syscall = submit_syscall(kind, agent_name, query)
+        return syscall_result(syscall, syscall.wait())
+
+
     def storage_syscall_exec(agent_name, query):
-        syscall = StorageSyscall(agent_name, query)
-        syscall.set_status("active")
-
-        completed_response, start_times, end_times, waiting_times, turnaround_times = (
-            "",
-            [],
-            [],
-            [],
-            [],
-        )
-        while syscall.get_status() != "done":
-            current_time = time.time()
-            syscall.set_created_time(current_time)
-            syscall.set_response(None)
-
-            global_storage_req_queue_add_message(syscall)
-
-            syscall.start()
-            syscall.join()
-
-            completed_response = syscall.get_response()
-
-            if syscall.get_status() != "done":
-                pass
-            start_time = syscall.get_start_time()
-            end_time = syscall.get_end_time()
-            waiting_time = start_time - syscall.get_created_time()
-            turnaround_time = end_time - syscall.get_created_time()
-
-            start_times.append(start_time)
-            end_times.append(end_time)
-            waiting_times.append(waiting_time)
-            turnaround_times.append(turnaround_time)
-
-        return {
-            "response": completed_response,
-            "start_times": start_times,
-            "end_times": end_times,
-            "waiting_times": waiting_times,
-            "turnaround_times": turnaround_times,
-        }
+        return syscall_exec("storage", agent_name, query)
 
 
     def mem_syscall_exec(agent_name, query):
-        syscall = Syscall(agent_name, query)
-        syscall.set_status("active")
-
-        completed_response, start_times, end_times, waiting_times, turnaround_times = (
-            "",
-            [],
-            [],
-            [],
-            [],
-        )
-        while syscall.get_status() != "done":
-            current_time = time.time()
-            syscall.set_created_time(current_time)
-            syscall.set_response(None)
-
-            global_memory_req_queue_add_message(syscall)
-
-            syscall.start()
-            syscall.join()
-
-            completed_response = syscall.get_response()
-
-            if syscall.get_status() != "done":
-                pass
-            start_time = syscall.get_start_time()
-            end_time = syscall.get_end_time()
-            waiting_time = start_time - syscall.get_created_time()
-            turnaround_time = end_time - syscall.get_created_time()
-
-            start_times.append(start_time)
-            end_times.append(end_time)
-            waiting_times.append(waiting_time)
-            turnaround_times.append(turnaround_time)
-
-        return {
-            "response": completed_response,
-            "start_times": start_times,
-            "end_times": end_times,
-            "waiting_times": waiting_times,
-            "turnaround_times": turnaround_times,
-        }
+        return syscall_exec("memory", agent_name, query)
 
 
     def tool_syscall_exec(agent_name, tool_calls):
-        syscall = ToolSyscall(agent_name, tool_calls)
-        syscall.set_status("active")
-
-        completed_response, start_times, end_times, waiting_times, turnaround_times = (
-            "",
-            [],
-            [],
-            [],
-            [],
-        )
-        while syscall.get_status() != "done":
-            current_time = time.time()
-            syscall.set_created_time(current_time)
-            syscall.set_response(None)
-
-            global_tool_req_queue_add_message(syscall)
-
-            syscall.start()
-            syscall.join()
-
-            completed_response = syscall.get_response()
-
-            if syscall.get_status() != "done":
-                pass
-            start_time = syscall.get_start_time()
-            end_time = syscall.get_end_time()
-            waiting_time = start_time - syscall.get_created_time()
-            turnaround_time = end_time - syscall.get_created_time()
-
-            start_times.append(start_time)
-            end_times.append(end_time)
-            waiting_times.append(waiting_time)
-            turnaround_times.append(turnaround_time)
-
-        return {
-            "response": completed_response,
-            "start_times": start_times,
-            "end_times": end_times,
-            "waiting_times": waiting_times,
-            "turnaround_times": turnaround_times,
-        }
+        return syscall_exec("tool", agent_name, tool_calls)
 
 
     def llm_syscall_exec(agent_name, query):
-        syscall = LLMSyscall(agent_name=agent_name, query=query)
-
-        syscall.set_status("active")
+        return syscall_exec("llm", agent_name, query)
 
-        completed_response, start_times, end_times, waiting_times, turnaround_times = (
-            "",
-            [],
-            [],
-            [],
-            [],
-        )
 
-        while syscall.get_status() != "done":
-            current_time = time.time()
-            syscall.set_created_time(current_time)
-            syscall.set_response(None)
+    def send_request(agent_name, query):
+        steps = request_steps(query)
+        try:
+            kind, step_query = next(steps)
+            while True:
+                kind, step_query = steps.send(syscall_exec(kind, agent_name, step_query))
+        except StopIteration as done:
+            return done.value
 
-            global_llm_req_queue_add_message(syscall)
+    class SysCallWrapper:
+        llm = llm_syscall_exec
+        llm_stream = llm_syscall_stream
+        storage = storage_syscall_exec
+        memory = mem_syscall_exec
+        tool = tool_syscall_exec
 
-            syscall.start()
-            syscall.join()
+    return send_request, SysCallWrapper
 
-            completed_response = syscall.get_response()
+def useAsyncSysCall():
+    async def syscall_exec(kind, agent_name, query):
+        """
+        Queues the syscall for the scheduler and awaits its completion, so
+        the event loop stays free while the syscall is waiting or running.
+        """
+        syscall = submit_syscall(kind, agent_name, query)
+        return syscall_result(syscall, await syscall)
 
-            if syscall.get_status() != "done":
-                pass
-            start_time = syscall.get_start_time()
-            end_time = syscall.get_end_time()
-            waiting_time = start_time - syscall.get_created_time()
-            turnaround_time = end_time - syscall.get_created_time()
 
-            start_times.append(start_time)
-            end_times.append(end_time)
-            waiting_times.append(waiting_time)
-            turnaround_times.append(turnaround_time)
+    async def storage_syscall_exec(agent_name, query):
+        return await syscall_exec("storage", agent_name, query)
 
-        return {
-            "response": completed_response,
-            "start_times": start_times,
-            "end_times": end_times,
-            "waiting_times": waiting_times,
-            "turnaround_times": turnaround_times,
-        }
 
+    async def mem_syscall_exec(agent_name, query):
+        return await syscall_exec("memory", agent_name, query)
 
-    def send_request(agent_name, query):
-        if isinstance(query, LLMQuery):
-            action_type = query.action_type
-            # print(action_type)
-            if action_type == "chat":
-                return llm_syscall_exec(agent_name, query)
 
-            elif action_type == "tool_use":
-                response = llm_syscall_exec(agent_name, query)["response"]
-                # print(response)
-                tool_calls = response.tool_calls
-                # print(tool_calls)
-                return tool_syscall_exec(agent_name, tool_calls)
+    async def tool_syscall_exec(agent_name, tool_calls):
+        return await syscall_exec("tool", agent_name, tool_calls)
 
-            elif action_type == "operate_file":
-                return storage_syscall_exec(llm_syscall_exec(agent_name, query))
 
-        elif isinstance(query, ToolQuery):
-            return tool_syscall_exec(agent_name, query)
+    async def llm_syscall_exec(agent_name, query):
+        return await syscall_exec("llm", agent_name, query)
 
-        elif isinstance(query, MemoryQuery):
-            return mem_syscall_exec(agent_name, query)
 
-        elif isinstance(query, StorageQuery):
-            return storage_syscall_exec(agent_name, query)
+    async def async_send_request(agent_name, query):
+        steps = request_steps(query)
+        try:
+            kind, step_query = next(steps)
+            while True:
+                result = await syscall_exec(kind, agent_name, step_query)
+                kind, step_query = steps.send(result)
+        except StopIteration as done:
+            return done.value
 
-    class SysCallWrapper:
+    class AsyncSysCallWrapper:
         llm = llm_syscall_exec
+        llm_stream = llm_syscall_stream
         storage = storage_syscall_exec
-        memory = memoryview
+        memory = mem_syscall_exec
         tool = tool_syscall_exec
 
-    return send_request, SysCallWrapper
+    return async_send_request, AsyncSysCallWrapper
@@ -10,9 +10,28 @@ LLMRequestQueueCheckEmpty: TypeAlias = Callable[[], bool]
 
 
 class LLMParams(BaseModel):
-    llm_name: str
+    llm_name: str | list[str]
     max_gpu_memory: dict | None = (None,)
     eval_device: str | None = (None,)
     max_new_tokens: int = (256,)
     log_mode: str = ("console",)
-    llm_backend: str | None = None
+    llm_backend: str | list[str] | None = None
+    hostname: str | list[str] | None = None
+    max_concurrency: int | list[int | None] | None = None
+    strategy: str = "simple"
+    max_attempts: int = 3
+    hedge_after: float | None = None
+    request_timeout: float | None = None
+    failure_threshold: int = 5
+    cooldown: float = 30.0
+    pool_size: int = 100
+    pool_keepalive: int = 20
+    keepalive_expiry: float = 30.0
+    connect_timeout: float = 5.0
+    http2: bool = False
+    prefix_cache_mb: int = 0
+    use_cache: bool = False
+    cache_size: int = 1024
+    cache_ttl: float | None = None
+    cache_path: str | None = None
+    cache_disk_size: int = 100000
@@ -12,3 +12,5 @@ class MemoryManagerParams(BaseModel):
     memory_limit: int
     eviction_k: int
     storage_manager: Any
+    memory_backend: str = "single"
+    memory_path: str | None = None
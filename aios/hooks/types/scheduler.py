@@ -16,3 +16,16 @@ class SchedulerParams(BaseModel):
     get_memory_syscall: MemoryRequestQueueGetMessage | None
     get_storage_syscall: StorageRequestQueueGetMessage | None
     get_tool_syscall: ToolRequestQueueGetMessage | None
+    max_workers: int | dict[str, int] = 1
+    async_llm: bool = False
+    llm_batch_window: float = 0.0
+    llm_max_batch_size: int = 8
+    rate_limits: dict | None = None
+
+class PrioritySchedulerParams(SchedulerParams):
+    agent_priorities: dict[str, int] | None = None
+    aging_interval: float = 1.0
+
+
+class RRSchedulerParams(SchedulerParams):
+    time_limit: float = 0.5
@@ -11,3 +11,6 @@ StorageRequestQueueCheckEmpty: TypeAlias = Callable[[], bool]
 class StorageManagerParams(BaseModel):
     root_dir: str
     use_vector_db: bool = False
+    compaction_ratio: float = 0.5
+    min_compaction_size: int = 1048576
+    vector_db_config: dict[str, Any] | None = None
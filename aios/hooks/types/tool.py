@@ -9,5 +9,18 @@ ToolRequestQueueAddMessage: TypeAlias = Callable[[str], None]
 ToolRequestQueueCheckEmpty: TypeAlias = Callable[[], bool]
 
 class ToolManagerParams(BaseModel):
-    name: str
-    params: dict | None = (None,)
+    log_mode: str = "console"
+    max_workers: int = 8
+    timeout: float | None = None
+    tool_timeouts: dict[str, float] | None = None
+    max_instances: int = 4
+    idle_timeout: float | None = 600.0
+    max_parallel: int = 1
+    tool_max_parallel: dict[str, int] | None = None
+    process_tools: list[str] | None = None
+    process_workers: int = 2
+    cpu_limit: float | None = None
+    tool_cpu_limits: dict[str, float] | None = None
+    cacheable_tools: dict[str, bool | dict[str, Any]] | None = None
+    cache_size: int = 256
+    cache_ttl: float | None = None
@@ -1,11 +1,24 @@
 from aios.context.simple_context import SimpleContextManager
-from aios.llm_core.strategy import RouterStrategy, SimpleStrategy
-from aios.llm_core.local import HfLocalBackend, VLLMLocalBackend, OllamaBackend
+from aios.llm_core.cache import LLMResponseCache
+from aios.llm_core.strategy import RouterStrategy, STRATEGIES
+from aios.llm_core.local import HfLocalBackend, VLLMLocalBackend, OllamaBackend, stream_completion
 from aios.utils.id_generator import generator_tool_call_id
 from cerebrum.llm.communication import Response
-from litellm import completion
+from aios.llm_core.errors import (
+    LLMRouterError,
+    EndpointError,
+    EndpointTimeoutError,
+    NoHealthyEndpointError,
+    AllEndpointsFailedError,
+)
+from litellm import completion, acompletion
+from litellm.exceptions import BadRequestError, Timeout
+import asyncio
 import json
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import asynccontextmanager, nullcontext
+from threading import BoundedSemaphore
 from typing import Dict, Optional
 import time
 import re
@@ -33,6 +46,71 @@ class LLMAdapter:
         llm_backend (str, optional)     : Backend to use for speeding up
                                           open-source LLMs. Defaults to None.
                                           Choices are ["vllm", "ollama"]
+        hostname (str or List[str], optional)
+                                        : Server of "hflocal", "vllm" or
+                                          "ollama" models, either one for all
+                                          of them or a list following
+                                          llm_name. "hflocal" and "vllm"
+                                          models without one are loaded into
+                                          this process.
+        strategy (RouterStrategy or str, optional)
+                                        : How requests are spread over the
+                                          endpoints. One of "simple",
+                                          "least_outstanding", "latency",
+                                          "throughput" or "consistent_hash".
+                                          Defaults to "simple".
+        max_concurrency (int or List[int], optional)
+                                        : Maximum number of syscalls that may
+                                          run on each endpoint at once.
+                                          Defaults to no limit, except for
+                                          models loaded in this process.
+        use_cache (bool, optional)      : Whether to cache the responses of
+                                          syscalls with temperature 0, except
+                                          on models loaded by "hflocal",
+                                          which always sample.
+                                          Defaults to False.
+        cache_size (int, optional)      : Number of responses cached in memory.
+                                          Defaults to 1024.
+        cache_ttl (float, optional)     : Seconds a cached response stays
+                                          valid. Defaults to no expiry.
+        cache_path (str, optional)      : sqlite file that keeps cached
+                                          responses across restarts.
+        cache_disk_size (int, optional) : Number of responses kept in the
+                                          sqlite file. Defaults to 100000.
+        max_attempts (int, optional)    : Number of endpoints a syscall is
+                                          tried on before it fails with
+                                          AllEndpointsFailedError.
+                                          Defaults to 3.
+        hedge_after (float, optional)   : Seconds after which a request that
+                                          has not been answered is also sent
+                                          to another endpoint. Defaults to
+                                          no hedging.
+        request_timeout (float, optional)
+                                        : Timeout in seconds of requests to
+                                          litellm endpoints.
+        failure_threshold (int, optional)
+                                        : Failures in a row that take an
+                                          endpoint out of rotation.
+                                          Defaults to 5.
+        cooldown (float, optional)      : Seconds before a failing endpoint
+                                          is probed again. Defaults to 30.
+        pool_size (int, optional)       : Connections open at once to each
+                                          Ollama, vLLM or HF server.
+                                          Defaults to 100.
+        pool_keepalive (int, optional)  : Idle connections kept open to each
+                                          of those servers. Defaults to 20.
+        keepalive_expiry (float, optional)
+                                        : Seconds an idle connection is kept
+                                          open. Defaults to 30.
+        connect_timeout (float, optional)
+                                        : Seconds to wait for a new connection
+                                          to be opened. Defaults to 5.
+        http2 (bool, optional)          : Whether to speak HTTP/2 to those
+                                          servers. Defaults to False.
+        prefix_cache_mb (int, optional) : Memory budget in MB of the per-agent
+                                          prompt prefix (KV) cache of models
+                                          loaded by "hflocal". Defaults to 0,
+                                          which turns the cache off.
     """
 
     def __init__(
@@ -44,9 +122,26 @@ class LLMAdapter:
         log_mode: str = "console",
         llm_backend: Optional[str | list[str]] = None,
         use_context_manager: bool = False,
-        strategy: Optional[RouterStrategy] = RouterStrategy.SIMPLE,
+        strategy: Optional[RouterStrategy | str] = RouterStrategy.SIMPLE,
         hostname: Optional[str | list[str]] = None,
         api_key: str | list[str] | None = None,
+        max_concurrency: int | list[int | None] | None = None,
+        use_cache: bool = False,
+        cache_size: int = 1024,
+        cache_ttl: Optional[float] = None,
+        cache_path: Optional[str] = None,
+        cache_disk_size: int = 100000,
+        max_attempts: int = 3,
+        hedge_after: Optional[float] = None,
+        request_timeout: Optional[float] = None,
+        failure_threshold: int = 5,
+        cooldown: float = 30.0,
+        pool_size: int = 100,
+        pool_keepalive: int = 20,
+        keepalive_expiry: float = 30.0,
+        connect_timeout: float = 5.0,
+        http2: bool = False,
+        prefix_cache_mb: int = 0,
     ):
         """Initialize the LLM with the specified configuration.
 
@@ -59,6 +154,32 @@ class LLMAdapter:
             use_backend         : Specific backend to use (if None, inferred
                                   from model name)
             use_context_manager : Whether to use context manager
+            strategy            : Router strategy, a RouterStrategy or its
+                                  name, e.g. "least_outstanding"
+            max_concurrency     : Per-endpoint limit on concurrent syscalls,
+                                  either one value for all endpoints or a
+                                  list following llm_name
+            use_cache           : Whether to cache deterministic responses
+            cache_size          : Number of responses cached in memory
+            cache_ttl           : Seconds a cached response stays valid
+            cache_path          : sqlite file for the on-disk cache tier
+            cache_disk_size     : Number of responses kept on disk
+            max_attempts        : Endpoints a syscall is tried on before it
+                                  fails
+            hedge_after         : Seconds after which a slow request is
+                                  duplicated to a second endpoint
+            request_timeout     : Timeout of requests to litellm endpoints
+            failure_threshold   : Failures in a row that open the circuit of
+                                  an endpoint
+            cooldown            : Seconds an open circuit waits before it lets
+                                  a probe request through
+            pool_size           : Connections open at once to each LLM server
+            pool_keepalive      : Idle connections kept open to each server
+            keepalive_expiry    : Seconds an idle connection is kept open
+            connect_timeout     : Seconds to wait for a new connection
+            http2               : Whether to speak HTTP/2 to the servers
+            prefix_cache_mb     : Memory budget of the KV prefix cache of
+                                  models loaded by HfLocalBackend
             api_key             : DEPRECATED. This was originally used to store
                                   an API Key for the LLM, but LiteLLM uses keys
                                   directly from the process environment
@@ -66,7 +187,7 @@ class LLMAdapter:
         """
         if isinstance(llm_name, list) != isinstance(llm_backend, list):
             raise ValueError("llm_name and llm_backend do not be the same type")
-        elif isinstance(llm_backend, list) and len(llm_name) == len(llm_backend):
+        elif isinstance(llm_backend, list) and len(llm_name) != len(llm_backend):
             raise ValueError("llm_name and llm_backend do not have the same length")
 
         self.llm_name            = llm_name if isinstance(llm_name, list) else [llm_name]
@@ -76,6 +197,10 @@ class LLMAdapter:
         self.log_mode            = log_mode
         self.llm_backend         = llm_backend if isinstance(llm_backend, list) else [llm_backend]
         self.context_manager     = SimpleContextManager() if use_context_manager else None
+        self.cache               = LLMResponseCache(
+            max_entries=cache_size, ttl=cache_ttl, path=cache_path,
+            max_disk_entries=cache_disk_size,
+        ) if use_cache else None
 
 
         # Set all supported API keys
@@ -111,10 +236,22 @@ class LLMAdapter:
 
         # breakpoint()
 
+        # Backends addressing the same server share one connection pool
+        pool_options = {
+            "max_connections": pool_size,
+            "max_keepalive_connections": pool_keepalive,
+            "keepalive_expiry": keepalive_expiry,
+            "connect_timeout": connect_timeout,
+            "timeout": request_timeout if request_timeout is not None else 600.0,
+            "http2": http2,
+        }
+
         # Format model names to match backend or instantiate local backends
+        hostnames = hostname if isinstance(hostname, list) else [hostname] * len(self.llm_name)
         for idx in range(len(self.llm_name)):
             if self.llm_backend[idx] is None:
                 continue
+            hostname = hostnames[idx]
 
             match self.llm_backend[idx]:
                 case "hflocal":
@@ -124,18 +261,24 @@ class LLMAdapter:
                     self.llm_name[idx] = HfLocalBackend(
                         self.llm_name[idx],
                         max_gpu_memory=max_gpu_memory,
-                        hostname=hostname
+                        hostname=hostname,
+                        max_new_tokens=max_new_tokens,
+                        pool_options=pool_options,
+                        prefix_cache_mb=prefix_cache_mb
                     )
                 case "vllm":
                     self.llm_name[idx] = VLLMLocalBackend(
                         self.llm_name[idx],
                         max_gpu_memory=max_gpu_memory,
-                        hostname=hostname
+                        hostname=hostname,
+                        max_new_tokens=max_new_tokens,
+                        pool_options=pool_options
                     )
                 case "ollama":
                     self.llm_name[idx] = OllamaBackend(
                         self.llm_name[idx],
-                        hostname=hostname
+                        hostname=hostname,
+                        pool_options=pool_options
                     )
                 case None:
                     continue
@@ -155,8 +298,106 @@ class LLMAdapter:
                     if not is_formatted:
                         self.llm_name[idx] = prefix + self.llm_name[idx]
 
-        if strategy == RouterStrategy.SIMPLE:
-            self.strategy = SimpleStrategy(self.llm_name)
+        if isinstance(strategy, str):
+            strategy = RouterStrategy[strategy.upper()]
+        self.strategy = STRATEGIES[strategy](
+            self.llm_name, failure_threshold=failure_threshold, cooldown=cooldown
+        )
+
+        self.max_attempts    = max(1, max_attempts)
+        self.hedge_after     = hedge_after
+        self.request_timeout = request_timeout
+        self.hedge_pool      = None
+        self.size_hedge_pool(1)
+
+        self.endpoint_limits = self.setup_endpoint_limits(max_concurrency)
+
+        # rate limits of the scheduler's AdmissionController, which sets this
+        self.admission = None
+
+    def size_hedge_pool(self, llm_workers):
+        """
+        Size the pool that runs hedged requests for llm_workers syscalls
+        addressed at once, each with a request and its hedge in flight. The
+        scheduler calls this with its number of LLM processors.
+        """
+        if self.hedge_after is None:
+            return
+        previous, self.hedge_pool = self.hedge_pool, ThreadPoolExecutor(
+            max_workers=2 * max(1, llm_workers), thread_name_prefix="llm_hedge"
+        )
+        if previous is not None:
+            # requests still running on it finish on their own
+            previous.shutdown(wait=False)
+
+    def cleanup(self):
+        """
+        Release the hedge pool, the connections of the backends and the
+        response cache's sqlite file. Call it once the adapter is no longer
+        used, since syscalls it is still addressing may fail on the closed
+        connections.
+        """
+        if self.hedge_pool is not None:
+            self.hedge_pool.shutdown(wait=False)
+            self.hedge_pool = None
+        for model in self.llm_name:
+            if hasattr(model, "close"):
+                model.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def setup_endpoint_limits(self, max_concurrency) -> list:
+        """Create one semaphore per endpoint bounding its in-flight syscalls.
+
+        Endpoints without a limit get None. A model loaded into this process
+        by HfLocalBackend defaults to one syscall at a time.
+        """
+        if not isinstance(max_concurrency, list):
+            max_concurrency = [max_concurrency] * len(self.llm_name)
+        elif len(max_concurrency) != len(self.llm_name):
+            raise ValueError("max_concurrency and llm_name do not have the same length")
+
+        limits = []
+        for endpoint, limit in zip(self.llm_name, max_concurrency):
+            if limit is None and isinstance(endpoint, HfLocalBackend) \
+                    and endpoint.hostname is None:
+                limit = 1
+            limits.append(BoundedSemaphore(limit) if limit else None)
+        return limits
+
+    def get_endpoint_limit(self, model) -> BoundedSemaphore | None:
+        """Return the semaphore guarding the given endpoint, if any."""
+        for endpoint, limit in zip(self.llm_name, self.endpoint_limits):
+            if endpoint is model:
+                return limit
+        return None
+
+    def endpoint_limit(self, model):
+        limit = self.get_endpoint_limit(model)
+        return limit if limit is not None else nullcontext()
+
+    @asynccontextmanager
+    async def endpoint_limit_async(self, model):
+        """Hold the endpoint's semaphore without blocking the event loop."""
+        limit = self.get_endpoint_limit(model)
+        if limit is None:
+            yield
+            return
+
+        # only wait in a worker thread when the endpoint is saturated
+        if not limit.acquire(blocking=False):
+            waiter = asyncio.ensure_future(asyncio.to_thread(limit.acquire))
+            try:
+                await asyncio.shield(waiter)
+            except asyncio.CancelledError:
+                # the thread takes the permit anyway, e.g. for the loser of a
+                # hedged request, so hand it back as soon as it has it
+                waiter.add_done_callback(lambda _: limit.release())
+                raise
+        try:
+            yield
+        finally:
+            limit.release()
 
     def tool_calling_input_format(self, messages: list, tools: list) -> list:
         """Integrate tool information into the messages for open-sourced LLMs
@@ -248,26 +489,25 @@ class LLMAdapter:
                 tool["function"]["name"] = tool_name
         return tools
 
-    def address_syscall(
-        self,
-        llm_syscall,
-        temperature=0.0
-    ):
+    def prepare_syscall(self, llm_syscall) -> tuple[list, list, str, str | None]:
         """
-        Address request sent from the agent
+        Mark the syscall as executing and build the messages to send, with
+        tools folded into the prompt and any restored context appended.
 
-        Args:
-            llm_syscall (LLMSyscall)      : LLMSyscall object that contains
-                                            request sent from the agent
-            temperature (float, optional) : Parameter to control the randomness
-                                            of LLM output. Defaults to 0.0.
+        The query's own messages are copied, so a syscall that is preempted
+        and resumed is prepared from the same input every time.
+
+        Returns:
+            tuple: messages, tools, the requested message return type and
+                   the partial output restored from a snapshot, if any.
         """
-        messages = llm_syscall.query.messages
+        messages = [dict(message) for message in llm_syscall.query.messages]
         tools    = llm_syscall.query.tools
         ret_type = llm_syscall.query.message_return_type
 
         llm_syscall.set_status("executing")
-        llm_syscall.set_start_time(time.time())
+        if llm_syscall.get_start_time() is None:
+            llm_syscall.set_start_time(time.time())
 
         restored_context = None
 
@@ -276,39 +516,703 @@ class LLMAdapter:
             if self.context_manager.check_restoration(pid):
                 restored_context = self.context_manager.gen_recover(pid)
 
+        if tools:
+            tools = self.pre_process_tools(tools)
+            messages = self.tool_calling_input_format(messages, tools)
+
         if restored_context:
             messages += [{
                 "role": "assistant",
                 "content": "" + restored_context,
             }]
 
+        return messages, tools, ret_type, restored_context
+
+    def format_response(self, res: str, tools: list, ret_type: str) -> Response:
         if tools:
-            tools = self.pre_process_tools(tools)
-            messages = self.tool_calling_input_format(messages, tools)
+            if tool_calls := self.parse_tool_calls(res):
+                return Response(response_message=None,
+                                tool_calls=tool_calls,
+                                finished=True)
+
+        if ret_type == "json":
+            res = self.parse_json_format(res)
+
+        return Response(response_message=res, finished=True)
+
+    def get_cache_key(self, model, messages, tools, ret_type, temperature,
+                      restored_context) -> str | None:
+        """
+        Key of the syscall in the response cache, or None if its response must
+        not be cached: sampled outputs differ between calls, and a resumed
+        syscall depends on the output it was preempted with.
+        """
+        if self.cache is None or temperature != 0.0 or restored_context:
+            return None
+        if isinstance(model, HfLocalBackend) and model.hostname is None:
+            # models loaded by HfLocalBackend sample even at temperature 0
+            return None
+        return self.cache.make_key(model, messages, tools, ret_type)
+
+    def get_cached_response(self, cache_key) -> Response | None:
+        """
+        Look the syscall up in the response cache. Cached tool calls get
+        fresh ids, since every syscall that hits the entry makes calls of
+        its own.
+        """
+        return self.fresh_tool_call_ids(self.cache.get(cache_key))
+
+    async def get_cached_response_async(self, cache_key) -> Response | None:
+        """get_cached_response, without blocking the event loop on the disk."""
+        return self.fresh_tool_call_ids(await self.cache.get_async(cache_key))
+
+    def fresh_tool_call_ids(self, cached) -> Response | None:
+        if cached is not None and cached.tool_calls:
+            cached.tool_calls = [
+                {**tool_call, "id": generator_tool_call_id()}
+                for tool_call in cached.tool_calls
+            ]
+        return cached
+
+    def estimate_tokens(self, text) -> int:
+        """Rough token count of generated text, about four characters per
+        token, used to compare the throughput of endpoints."""
+        return len(text or "") // 4
+
+    def check_model(self, model):
+        if not isinstance(model, (str, HfLocalBackend, VLLMLocalBackend, OllamaBackend)):
+            raise RuntimeError(f"Unsupported model type: {type(model)}")
 
-        model = self.strategy()
+    def can_preempt(self, model) -> bool:
+        """
+        Whether generation on the endpoint can be stopped partway: litellm
+        endpoints and backends streaming from a server can, models generating
+        in this process cannot, as their generate call keeps running.
+        """
+        return isinstance(model, (str, OllamaBackend)) or model.hostname is not None
+
+    def generate_until(self, model, messages, temperature, deadline,
+                       on_chunk=None, **backend_options):
+        """
+        Stream the completion of an endpoint until it finishes or the deadline
+        passes. The deadline is checked as each chunk arrives. backend_options
+        are passed on to backend instances.
 
-        if isinstance(model, (str, HfLocalBackend, VLLMLocalBackend, OllamaBackend)):
-            res = model(
+        Backend instances only yield text, so one stopped right after its last
+        chunk is taken for unfinished, and finishes with an empty continuation
+        when it is resumed.
+
+        Returns:
+            tuple: the text generated so far and whether generation finished.
+        """
+        if isinstance(model, str):
+            stream = completion(
+                model=model,
                 messages=messages,
                 temperature=temperature,
-                # tools=tools,
-            ) if not isinstance(model, str) else completion(
+                stream=True,
+                **self.request_options(),
+            )
+            pieces = (
+                (chunk.choices[0].delta.content or "", chunk.choices[0].finish_reason is not None)
+                for chunk in stream
+            )
+        else:
+            stream = model(
+                messages=messages,
+                temperature=temperature,
+                stream=True,
+                **backend_options,
+            )
+            pieces = ((chunk, False) for chunk in stream)
+
+        chunks = []
+        try:
+            for text, last in pieces:
+                chunks.append(text)
+                if on_chunk is not None:
+                    on_chunk(text)
+                if not last and time.time() >= deadline:
+                    return "".join(chunks), False
+        finally:
+            # stops reading the response of a preempted backend request
+            if (close := getattr(stream, "close", None)) is not None:
+                close()
+
+        return "".join(chunks), True
+
+    def generate_stream(self, model, messages, temperature, on_chunk,
+                        **backend_options) -> str:
+        """
+        Generate with streaming, passing each chunk of text to on_chunk as it
+        arrives. backend_options are passed on to backend instances.
+
+        Returns:
+            str: the full generated text.
+        """
+        if isinstance(model, str):
+            stream = stream_completion(
                 model=model,
                 messages=messages,
                 temperature=temperature,
-                # tools=tools,
-            ).choices[0].message.content
+                **self.request_options(),
+            )
         else:
-            raise RuntimeError(f"Unsupported model type: {type(model)}")
+            stream = model(
+                messages=messages,
+                temperature=temperature,
+                stream=True,
+                **backend_options,
+            )
 
-        if tools:
-            if tool_calls := self.parse_tool_calls(res):
-                return Response(response_message=None,
-                                tool_calls=tool_calls,
-                                finished=True)
+        chunks = []
+        for chunk in stream:
+            chunks.append(chunk)
+            on_chunk(chunk)
 
-        if ret_type == "json":
-            res = self.parse_json_format(res)
+        return "".join(chunks)
 
-        return Response(response_message=res, finished=True)
+    def address_syscall(
+        self,
+        llm_syscall,
+        temperature=0.0,
+        time_limit=None,
+    ):
+        """
+        Address request sent from the agent
+
+        The syscall is sent to the endpoint chosen by the strategy. If that
+        endpoint fails, it is retried on the next healthy endpoint, up to
+        max_attempts endpoints. With hedge_after set, a second endpoint is
+        also tried once the first has not answered in time, and the first
+        response wins.
+
+        Args:
+            llm_syscall (LLMSyscall)      : LLMSyscall object that contains
+                                            request sent from the agent
+            temperature (float, optional) : Parameter to control the randomness
+                                            of LLM output. Defaults to 0.0.
+            time_limit (float, optional)  : Seconds the syscall may generate
+                                            for before it is preempted. The
+                                            partial output is saved to the
+                                            context manager and an unfinished
+                                            Response is returned, so the
+                                            syscall can be resumed later.
+                                            Needs a context manager and only
+                                            applies to endpoints that
+                                            can_preempt.
+
+        If the syscall streams, every chunk of generated text is passed on to
+        it as soon as the endpoint produces it.
+
+        Raises:
+            NoHealthyEndpointError  : Every endpoint has an open circuit.
+            AllEndpointsFailedError : Every attempt failed.
+        """
+        def attempt(model):
+            return self.address_syscall_on(model, llm_syscall, temperature, time_limit)
+
+        if self.can_hedge(llm_syscall, time_limit):
+            return self.route_hedged(llm_syscall, attempt)
+        return self.route(llm_syscall, attempt)
+
+    def can_hedge(self, llm_syscall, time_limit=None) -> bool:
+        """
+        Whether a syscall may run on two endpoints at once. Streaming,
+        preemptible and resumed syscalls have side effects on the syscall
+        that must happen once.
+        """
+        pid = llm_syscall.get_pid()
+        return (
+            self.hedge_after is not None
+            and len(self.llm_name) > 1
+            and time_limit is None
+            and not getattr(llm_syscall, "stream", False)
+            and not (self.context_manager and self.context_manager.check_restoration(pid))
+        )
+
+    def next_endpoint(self, llm_syscall, tried: list):
+        """The next endpoint to try, or None if no attempt is left."""
+        if len(tried) >= self.max_attempts:
+            return None
+        try:
+            throttled = self.throttled_endpoints(llm_syscall)
+            try:
+                model = self.strategy(llm_syscall, exclude=tried + throttled)
+            except NoHealthyEndpointError:
+                if not throttled:
+                    raise
+                # every endpoint left is over its rate limit, so the syscall
+                # waits for the budget of the one it is sent to
+                model = self.strategy(llm_syscall, exclude=tried)
+        except NoHealthyEndpointError:
+            return None
+        self.check_model(model)
+        tried.append(model)
+        return model
+
+    def routing_error(self, errors: list) -> LLMRouterError:
+        if not errors:
+            return NoHealthyEndpointError(
+                "no healthy LLM endpoint is left to address the syscall"
+            )
+        return AllEndpointsFailedError(errors)
+
+    def route(self, llm_syscall, attempt):
+        """Run attempt on one endpoint after another until one succeeds."""
+        tried, errors = [], []
+        while (model := self.next_endpoint(llm_syscall, tried)) is not None:
+            try:
+                return attempt(model)
+            except EndpointError as e:
+                errors.append(e)
+                if not e.retryable:
+                    break
+        raise self.routing_error(errors)
+
+    def route_hedged(self, llm_syscall, attempt):
+        """
+        Like route, but start a second endpoint if the first has not answered
+        within hedge_after seconds. The slower request is left to finish in the
+        background and its response is dropped.
+        """
+        tried, errors, running = [], [], {}
+
+        def launch():
+            if (model := self.next_endpoint(llm_syscall, tried)) is not None:
+                running[self.hedge_pool.submit(attempt, model)] = model
+
+        launch()
+        hedged = False
+        while running:
+            done, _ = wait(
+                running,
+                timeout=None if hedged else self.hedge_after,
+                return_when=FIRST_COMPLETED,
+            )
+            if not done:
+                hedged = True
+                launch()
+                continue
+
+            for future in done:
+                running.pop(future)
+                try:
+                    return future.result()
+                except EndpointError as e:
+                    errors.append(e)
+                    if not e.retryable:
+                        raise self.routing_error(errors)
+
+            if not running:
+                launch()
+
+        raise self.routing_error(errors)
+
+    def endpoint_error(self, model, llm_syscall, chunks_before, e) -> EndpointError:
+        """
+        Wrap an exception raised by an endpoint. Rejected requests do not
+        count against the endpoint, and a syscall that has already streamed
+        part of its output cannot be retried elsewhere.
+        """
+        if isinstance(e, EndpointError):
+            return e
+
+        retryable = len(getattr(llm_syscall, "chunks", ())) == chunks_before
+        if isinstance(e, (Timeout, asyncio.TimeoutError)):
+            return EndpointTimeoutError(model, e, retryable=retryable)
+        if isinstance(e, BadRequestError):
+            return EndpointError(model, e, retryable=retryable, endpoint_fault=False)
+        return EndpointError(model, e, retryable=retryable)
+
+    def request_options(self) -> dict:
+        """Extra arguments of litellm requests."""
+        return {} if self.request_timeout is None else {"timeout": self.request_timeout}
+
+    def limit_name(self, model) -> str:
+        """Name of the endpoint in the per-model rate limits."""
+        return model if isinstance(model, str) else model.model_name
+
+    def count_tokens(self, model, messages=None, text=None) -> int:
+        # only litellm endpoints have a tokenizer litellm can look up offline
+        return self.admission.count_tokens(
+            messages=messages, text=text,
+            model=model if isinstance(model, str) else None,
+        )
+
+    def throttled_endpoints(self, llm_syscall) -> list:
+        """Endpoints whose rate limit has no budget for the syscall now."""
+        if self.admission is None:
+            return []
+        tokens = self.admission.prompt_tokens(llm_syscall)
+        return [
+            endpoint for endpoint in self.llm_name
+            if self.admission.model_wait_time(self.limit_name(endpoint), tokens) > 0
+        ]
+
+    def wait_for_rate_limit(self, model, llm_syscalls, requests=1):
+        """
+        Block until the endpoint's rate limit has budget for the requests
+        with the prompts of llm_syscalls. A syscall resumed after preemption
+        sends its prompt again but is not a new request, so it passes
+        requests=0.
+        """
+        if self.admission is None:
+            return
+        tokens = sum(self.admission.prompt_tokens(llm_syscall) for llm_syscall in llm_syscalls)
+        while (wait := self.admission.acquire_model(
+            self.limit_name(model), tokens, requests
+        )) > 0:
+            time.sleep(wait)
+
+    async def wait_for_rate_limit_async(self, model, llm_syscalls, requests=1):
+        if self.admission is None:
+            return
+        tokens = sum(self.admission.prompt_tokens(llm_syscall) for llm_syscall in llm_syscalls)
+        while (wait := self.admission.acquire_model(
+            self.limit_name(model), tokens, requests
+        )) > 0:
+            await asyncio.sleep(wait)
+
+    def charge_rate_limit(self, model, llm_syscall, res):
+        """Charge the generated tokens to the rate limits of the syscall."""
+        if self.admission is None:
+            return
+        self.admission.charge(
+            llm_syscall.agent_name,
+            self.limit_name(model),
+            self.count_tokens(model, text=res or ""),
+        )
+
+    def backend_options(self, model, llm_syscall) -> dict:
+        """Extra arguments of calls to backend instances."""
+        if isinstance(model, HfLocalBackend):
+            # lets the backend find the agent's cached prompt prefix
+            return {"agent_name": llm_syscall.agent_name}
+        return {}
+
+    def address_syscall_on(
+        self,
+        model,
+        llm_syscall,
+        temperature=0.0,
+        time_limit=None,
+    ):
+        """Address the syscall on the given endpoint, see address_syscall."""
+        messages, tools, ret_type, restored_context = self.prepare_syscall(llm_syscall)
+
+        on_chunk = llm_syscall.add_chunk if getattr(llm_syscall, "stream", False) else None
+
+        cache_key = self.get_cache_key(
+            model, messages, tools, ret_type, temperature, restored_context
+        )
+        if cache_key is not None:
+            if (cached := self.get_cached_response(cache_key)) is not None:
+                if on_chunk is not None and cached.response_message:
+                    on_chunk(cached.response_message)
+                return cached
+
+        preemptible = (
+            time_limit is not None
+            and self.context_manager is not None
+            and self.can_preempt(model)
+        )
+
+        self.wait_for_rate_limit(
+            model, [llm_syscall], requests=0 if restored_context else 1
+        )
+
+        chunks_before = len(getattr(llm_syscall, "chunks", ()))
+        with self.strategy.track(model) as request, self.endpoint_limit(model):
+            try:
+                if preemptible:
+                    res, finished = self.generate_until(
+                        model, messages, temperature, time.time() + time_limit,
+                        on_chunk=on_chunk,
+                        **self.backend_options(model, llm_syscall),
+                    )
+                elif on_chunk is not None:
+                    res = self.generate_stream(
+                        model, messages, temperature, on_chunk,
+                        **self.backend_options(model, llm_syscall),
+                    )
+                    finished = True
+                else:
+                    res = model(
+                        messages=messages,
+                        temperature=temperature,
+                        # tools=tools,
+                        **self.backend_options(model, llm_syscall),
+                    ) if not isinstance(model, str) else completion(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        # tools=tools,
+                        **self.request_options(),
+                    ).choices[0].message.content
+                    finished = True
+            except Exception as e:
+                raise self.endpoint_error(model, llm_syscall, chunks_before, e) from e
+
+            request["tokens"] = self.estimate_tokens(res)
+
+        self.charge_rate_limit(model, llm_syscall, res)
+
+        if restored_context:
+            res = restored_context + res
+
+        if not finished:
+            self.context_manager.gen_snapshot(llm_syscall.get_pid(), res)
+            return Response(response_message=None, finished=False)
+
+        if restored_context:
+            self.context_manager.clear_restoration(llm_syscall.get_pid())
+
+        response = self.format_response(res, tools, ret_type)
+        if cache_key is not None:
+            self.cache.put(cache_key, response)
+
+        return response
+
+    def supports_batching(self, model=None) -> bool:
+        """
+        Whether the given endpoint, or any endpoint if none is given, is a
+        model loaded in this process that can generate for several syscalls
+        in one batch.
+        """
+        models = self.llm_name if model is None else [model]
+        return any(
+            isinstance(m, (HfLocalBackend, VLLMLocalBackend)) and m.hostname is None
+            for m in models
+        )
+
+    def address_syscall_batch(
+        self,
+        llm_syscalls,
+        temperature=0.0
+    ) -> list:
+        """
+        Address several requests with a single batched generate call.
+
+        All syscalls of the batch are sent to the same endpoint. Endpoints that
+        cannot batch address the syscalls one after another instead, and so
+        do the syscalls of a batch that failed, so that each is retried
+        through the router on its own.
+
+        Args:
+            llm_syscalls (list)           : LLMSyscall objects to address
+            temperature (float, optional) : Parameter to control the randomness
+                                            of LLM output. Defaults to 0.0.
+
+        Returns:
+            list: The Response of each syscall, or the exception raised while
+                  addressing it, in the order of llm_syscalls.
+        """
+        model = self.strategy(llm_syscalls[0])
+        self.check_model(model)
+
+        if not self.supports_batching(model):
+            results = []
+            for llm_syscall in llm_syscalls:
+                try:
+                    results.append(self.address_syscall(llm_syscall, temperature))
+                except Exception as e:
+                    results.append(e)
+            return results
+
+        results = [None] * len(llm_syscalls)
+        pending = []
+        for idx, llm_syscall in enumerate(llm_syscalls):
+            messages, tools, ret_type, restored_context = self.prepare_syscall(llm_syscall)
+            cache_key = self.get_cache_key(
+                model, messages, tools, ret_type, temperature, restored_context
+            )
+            if cache_key is not None:
+                if (cached := self.get_cached_response(cache_key)) is not None:
+                    if getattr(llm_syscall, "stream", False) and cached.response_message:
+                        llm_syscall.add_chunk(cached.response_message)
+                    results[idx] = cached
+                    continue
+            pending.append((idx, messages, tools, ret_type, restored_context, cache_key))
+
+        if not pending:
+            return results
+
+        # the batch waits for the budget of all its syscalls at once
+        self.wait_for_rate_limit(
+            model,
+            [llm_syscalls[idx] for idx, *_ in pending],
+            requests=sum(1 for *_, restored_context, _ in pending if not restored_context),
+        )
+
+        try:
+            with self.strategy.track(model) as request, self.endpoint_limit(model):
+                try:
+                    outputs = model.generate_batch(
+                        [messages for _, messages, _, _, _, _ in pending],
+                        temperature=temperature,
+                    )
+                except Exception as e:
+                    raise self.endpoint_error(model, None, 0, e) from e
+                request["tokens"] = sum(self.estimate_tokens(res) for res in outputs)
+
+        except EndpointError:
+            for idx, *_ in pending:
+                try:
+                    results[idx] = self.address_syscall(llm_syscalls[idx], temperature)
+                except Exception as e:
+                    results[idx] = e
+            return results
+
+        for (idx, _, tools, ret_type, restored_context, cache_key), res in zip(
+            pending, outputs
+        ):
+            try:
+                self.charge_rate_limit(model, llm_syscalls[idx], res)
+                if getattr(llm_syscalls[idx], "stream", False):
+                    llm_syscalls[idx].add_chunk(res)
+                if restored_context:
+                    res = restored_context + res
+                    self.context_manager.clear_restoration(llm_syscalls[idx].get_pid())
+                results[idx] = self.format_response(res, tools, ret_type)
+                if cache_key is not None:
+                    self.cache.put(cache_key, results[idx])
+            except Exception as e:
+                results[idx] = e
+
+        return results
+
+    async def address_syscall_async(
+        self,
+        llm_syscall,
+        temperature=0.0
+    ):
+        """
+        Address request sent from the agent without blocking the event loop.
+
+        litellm endpoints are awaited through acompletion, so a single thread
+        can keep many requests in flight. Backend objects are synchronous and
+        are run in a worker thread instead. Failover and hedging work as in
+        address_syscall, except that the slower hedged request is cancelled.
+
+        Args:
+            llm_syscall (LLMSyscall)      : LLMSyscall object that contains
+                                            request sent from the agent
+            temperature (float, optional) : Parameter to control the randomness
+                                            of LLM output. Defaults to 0.0.
+        """
+        tried, errors, running = [], [], {}
+
+        def launch():
+            if (model := self.next_endpoint(llm_syscall, tried)) is not None:
+                running[asyncio.ensure_future(
+                    self.address_syscall_on_async(model, llm_syscall, temperature)
+                )] = model
+
+        launch()
+        hedged = not self.can_hedge(llm_syscall)
+        try:
+            while running:
+                done, _ = await asyncio.wait(
+                    running,
+                    timeout=None if hedged else self.hedge_after,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    hedged = True
+                    launch()
+                    continue
+
+                for task in done:
+                    running.pop(task)
+                    try:
+                        return task.result()
+                    except EndpointError as e:
+                        errors.append(e)
+                        if not e.retryable:
+                            raise self.routing_error(errors)
+
+                if not running:
+                    launch()
+        finally:
+            for task in running:
+                task.cancel()
+
+        raise self.routing_error(errors)
+
+    async def address_syscall_on_async(
+        self,
+        model,
+        llm_syscall,
+        temperature=0.0
+    ):
+        """Address the syscall on the given endpoint, see address_syscall_async."""
+        messages, tools, ret_type, restored_context = self.prepare_syscall(llm_syscall)
+
+        on_chunk = llm_syscall.add_chunk if getattr(llm_syscall, "stream", False) else None
+
+        cache_key = self.get_cache_key(
+            model, messages, tools, ret_type, temperature, restored_context
+        )
+        if cache_key is not None:
+            if (cached := await self.get_cached_response_async(cache_key)) is not None:
+                if on_chunk is not None and cached.response_message:
+                    on_chunk(cached.response_message)
+                return cached
+
+        await self.wait_for_rate_limit_async(
+            model, [llm_syscall], requests=0 if restored_context else 1
+        )
+
+        chunks_before = len(getattr(llm_syscall, "chunks", ()))
+        with self.strategy.track(model) as request:
+            try:
+                async with self.endpoint_limit_async(model):
+                    if on_chunk is not None and isinstance(model, str):
+                        chunks = []
+                        async for chunk in await acompletion(
+                            model=model,
+                            messages=messages,
+                            temperature=temperature,
+                            stream=True,
+                            **self.request_options(),
+                        ):
+                            if content := chunk.choices[0].delta.content:
+                                chunks.append(content)
+                                on_chunk(content)
+                        res = "".join(chunks)
+                    elif on_chunk is not None:
+                        res = await asyncio.to_thread(
+                            self.generate_stream, model, messages, temperature, on_chunk,
+                            **self.backend_options(model, llm_syscall),
+                        )
+                    elif isinstance(model, str):
+                        res = (await acompletion(
+                            model=model,
+                            messages=messages,
+                            temperature=temperature,
+                            **self.request_options(),
+                        )).choices[0].message.content
+                    else:
+                        res = await asyncio.to_thread(
+                            model,
+                            messages=messages,
+                            temperature=temperature,
+                            **self.backend_options(model, llm_syscall),
+                        )
+            except Exception as e:
+                raise self.endpoint_error(model, llm_syscall, chunks_before, e) from e
+
+            request["tokens"] = self.estimate_tokens(res)
+
+        self.charge_rate_limit(model, llm_syscall, res)
+
+        if restored_context:
+            res = restored_context + res
+            self.context_manager.clear_restoration(llm_syscall.get_pid())
+
+        response = self.format_response(res, tools, ret_type)
+        if cache_key is not None:
+            await self.cache.put_async(cache_key, response)
+
+        return response
@@ -0,0 +1,206 @@
+# This caches the responses of deterministic LLM syscalls. Entries are keyed by
+# a hash of everything that decides the output: the model, the messages, the
+# tools and the message return type. Recently used entries are kept in memory,
+# and with a path the cache is also written to sqlite so it survives restarts.
+# The sqlite file keeps the max_disk_entries entries written last. The async
+# methods read and write it on a worker thread, off the event loop.
+
+from cerebrum.llm.communication import Response
+
+from collections import OrderedDict
+from threading import Lock
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+
+class LLMResponseCache:
+    """
+    Two-tier cache of LLM responses.
+
+    Args:
+        max_entries (int, optional) : Number of entries kept in memory, least
+                                      recently used first out. Defaults to 1024.
+        ttl (float, optional)       : Seconds an entry stays valid. Defaults
+                                      to no expiry.
+        path (str, optional)        : sqlite file backing the in-memory tier.
+                                      Defaults to keeping entries in memory only.
+        max_disk_entries (int, optional)
+                                    : Number of entries kept in the sqlite
+                                      file, the oldest written first out.
+                                      Defaults to 100000.
+    """
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float | None = None,
+        path: str | None = None,
+        max_disk_entries: int = 100000,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.max_disk_entries = max(1, max_disk_entries)
+        self.entries: OrderedDict[str, tuple[float | None, dict]] = OrderedDict()
+        self.lock = Lock()
+        # sqlite is not used by two threads at once, and is not used under
+        # the lock, so that memory hits never wait for the disk
+        self.db_lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+        self.db = None
+        if self.path is not None:
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, response TEXT, expires_at REAL)"
+            )
+            self.db.commit()
+
+    @staticmethod
+    def make_key(model, messages, tools, ret_type) -> str:
+        """Canonical hash of an LLM request."""
+        if not isinstance(model, str):
+            model = f"{type(model).__name__}:{model.model_name}"
+
+        request = {
+            "model": model,
+            "messages": messages,
+            "tools": tools,
+            "message_return_type": ret_type,
+        }
+        canonical = json.dumps(
+            request, sort_keys=True, separators=(",", ":"), default=str
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Response | None:
+        """Return the cached response for key, or None on a miss."""
+        now = time.time()
+        response = self.get_memory(key, now)
+        if response is None and self.db is not None:
+            response = self.get_disk(key, now)
+        return self.count_lookup(response)
+
+    async def get_async(self, key: str) -> Response | None:
+        """get, with the sqlite file read on a worker thread."""
+        now = time.time()
+        response = self.get_memory(key, now)
+        if response is None and self.db is not None:
+            response = await asyncio.to_thread(self.get_disk, key, now)
+        return self.count_lookup(response)
+
+    def put(self, key: str, response: Response):
+        """Cache a finished response."""
+        expires_at, response = self.put_memory(key, response)
+        if self.db is not None:
+            self.put_disk(key, expires_at, response)
+
+    async def put_async(self, key: str, response: Response):
+        """put, with the sqlite file written on a worker thread."""
+        expires_at, response = self.put_memory(key, response)
+        if self.db is not None:
+            await asyncio.to_thread(self.put_disk, key, expires_at, response)
+
+    def get_memory(self, key, now) -> dict | None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, response = entry
+            if expires_at is None or expires_at > now:
+                self.entries.move_to_end(key)
+                return response
+            del self.entries[key]
+            return None
+
+    def get_disk(self, key, now) -> dict | None:
+        with self.db_lock:
+            if self.db is None:
+                # closed
+                return None
+            row = self.db.execute(
+                "SELECT response, expires_at FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            response, expires_at = json.loads(row[0]), row[1]
+            if expires_at is not None and expires_at <= now:
+                self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.db.commit()
+                return None
+        with self.lock:
+            self.store(key, expires_at, response)
+            self.disk_hits += 1
+        return response
+
+    def count_lookup(self, response) -> Response | None:
+        with self.lock:
+            if response is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return Response(**response)
+
+    def put_memory(self, key, response) -> tuple[float | None, dict]:
+        expires_at = None if self.ttl is None else time.time() + self.ttl
+        response = response.model_dump()
+        with self.lock:
+            self.store(key, expires_at, response)
+        return expires_at, response
+
+    def put_disk(self, key, expires_at, response):
+        with self.db_lock:
+            if self.db is None:
+                return
+            cursor = self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                (key, json.dumps(response), expires_at),
+            )
+            # a replaced row is inserted again with the next rowid, so the
+            # rows below the last max_disk_entries rowids were written first
+            self.db.execute(
+                "DELETE FROM responses WHERE rowid <= ?",
+                (cursor.lastrowid - self.max_disk_entries,),
+            )
+            self.db.commit()
+
+    def store(self, key, expires_at, response):
+        """Put an entry in the memory tier. Call with the lock held."""
+        self.entries[key] = (expires_at, response)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        if self.db is not None:
+            with self.db_lock:
+                self.db.execute("DELETE FROM responses")
+                self.db.commit()
+
+    def close(self):
+        if self.db is not None:
+            with self.db_lock:
+                self.db.close()
+                self.db = None
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+                "evictions": self.evictions,
+            }
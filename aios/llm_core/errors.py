@@ -0,0 +1,47 @@
+# Errors raised by the LLM router. A syscall that cannot be addressed is
+# completed with one of these, so the agent waiting on it always wakes up with
+# either a response or an error that says what went wrong.
+
+class LLMRouterError(Exception):
+    """Base class of the errors raised while routing an LLM syscall."""
+
+class EndpointError(LLMRouterError):
+    """
+    One attempt on one endpoint failed.
+
+    Attributes:
+        endpoint       : The endpoint the attempt was sent to.
+        cause          : The exception raised by the endpoint.
+        retryable      : Whether the syscall may be sent to another endpoint.
+        endpoint_fault : Whether the failure counts against the health of the
+                         endpoint, as opposed to a request it rejected.
+    """
+    def __init__(self, endpoint, cause, retryable=True, endpoint_fault=True):
+        self.endpoint = endpoint
+        self.cause = cause
+        self.retryable = retryable
+        self.endpoint_fault = endpoint_fault
+        super().__init__(f"{endpoint_name(endpoint)}: {type(cause).__name__}: {cause}")
+
+class EndpointTimeoutError(EndpointError):
+    """The endpoint did not answer within the request timeout."""
+
+class NoHealthyEndpointError(LLMRouterError):
+    """Every endpoint that could take the syscall has an open circuit."""
+
+class AllEndpointsFailedError(LLMRouterError):
+    """
+    Every attempt to address the syscall failed.
+
+    Attributes:
+        errors : The EndpointError of each attempt, in order.
+    """
+    def __init__(self, errors: list[EndpointError]):
+        self.errors = errors
+        super().__init__(
+            "all attempts failed: " + "; ".join(str(error) for error in errors)
+        )
+
+def endpoint_name(endpoint) -> str:
+    return endpoint if isinstance(endpoint, str) else \
+        f"{type(endpoint).__name__}:{endpoint.model_name}"
@@ -1,12 +1,24 @@
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import AutoTokenizer, AutoModelForCausalLM, TextIteratorStreamer
 from litellm import completion
 
+from queue import Empty
+from threading import Thread
+
 import os
 
 from aios.config.config_manager import config
+from aios.llm_core.prefix_cache import PrefixCache
+from aios.llm_core.transport import get_transport, release_transport
+
+def stream_completion(**kwargs):
+    """Yield the text chunks of a litellm completion as they arrive."""
+    for chunk in completion(stream=True, **kwargs):
+        if content := chunk.choices[0].delta.content:
+            yield content
 
 class HfLocalBackend:
-    def __init__(self, model_name, device="auto", max_gpu_memory=None, hostname=None):
+    def __init__(self, model_name, device="auto", max_gpu_memory=None, hostname=None, max_new_tokens=None,
+                 pool_options=None, prefix_cache_mb=0, stream_timeout=300.0):
         print("\n=== HfLocalBackend Initialization ===")
         print(f"Model name: {model_name}")
         print(f"Checking HF API key:")
@@ -17,31 +29,59 @@ class HfLocalBackend:
         self.device = device
         self.max_gpu_memory = max_gpu_memory
         self.hostname = hostname
+        self.max_new_tokens = max_new_tokens
+        # seconds a stream may go without a chunk before it is given up on
+        self.stream_timeout = stream_timeout
+        # past_key_values of each agent's conversation, so that the next turn
+        # only prefills the tokens appended since
+        self.prefix_cache = PrefixCache(prefix_cache_mb * 1024 ** 2) \
+            if prefix_cache_mb and hostname is None else None
 
         # If a hostname is given, then this HF instance is hosted as a web server.
         # Therefore, do not start the AIOS-based HF instance.
         if self.hostname is not None:
+            self.transport = get_transport(self.hostname, **(pool_options or {}))
             return
 
         self.model = AutoModelForCausalLM.from_pretrained(
             model_name,
             device_map=device,
             max_memory=self.max_gpu_memory,
-            use_auth_token=os.environ["HUGGING_FACE_API_KEY"],
+            use_auth_token=os.environ.get("HUGGING_FACE_API_KEY"),
         )
         self.tokenizer = AutoTokenizer.from_pretrained(
             model_name,
             device_map=device,
-            use_auth_token=os.environ["HUGGING_FACE_API_KEY"]
+            use_auth_token=os.environ.get("HUGGING_FACE_API_KEY")
         )
+        # batched prompts are padded on the left, so that every prompt ends
+        # right where generation starts
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
         self.tokenizer.chat_template = "{% for message in messages %}{% if message['role'] == 'user' %}{{ ' ' }}{% endif %}{{ message['content'] }}{% if not loop.last %}{{ ' ' }}{% endif %}{% endfor %}{{ eos_token }}"
 
+    def close(self):
+        """Release the connections to the server the backend is hosted on."""
+        if self.hostname is not None:
+            release_transport(self.transport)
+
     def inference_online(self, messages, temperature, stream=False):
+        if stream:
+            return stream_completion(
+                model="huggingface/" + self.model_name,
+                messages=messages,
+                temperature=temperature,
+                api_base=self.hostname,
+                client=self.transport.handler,
+            )
+
         return completion(
             model="huggingface/" + self.model_name,
             messages=messages,
             temperature=temperature,
             api_base=self.hostname,
+            client=self.transport.handler,
         ).choices[0].message.content
 
     def __call__(
@@ -49,48 +89,161 @@ class HfLocalBackend:
         messages,
         temperature,
         stream=False,
+        agent_name=None,
     ):
         if self.hostname is not None:
             return self.inference_online(messages, temperature, stream=stream)
 
         if stream:
-            raise NotImplemented
+            return self.generate_stream(messages, temperature, agent_name)
+
+        if self.prefix_cache is not None and agent_name is not None:
+            return self.generate_single(messages, temperature, agent_name)
 
+        return self.generate_batch([messages], temperature)[0]
+
+    def generate_single(self, messages, temperature, agent_name=None, streamer=None):
+        """
+        Generate the response to one conversation. With the prefix cache on,
+        the agent's cached past_key_values are reused, so only the tokens
+        that were not prefilled before are run through the model, and the
+        extended cache is kept for the next turn. A single sequence is
+        needed for that, so it samples without beam search.
+        """
         inputs = self.tokenizer.apply_chat_template(messages,
                                                        tokenize=True,
                                                        add_generation_prompt=True,
                                                        return_dict=True,
                                                        return_tensors="pt")
+        use_cache = self.prefix_cache is not None and agent_name is not None
+        token_ids = inputs["input_ids"][0].tolist()
+        past_key_values = None
+        if use_cache:
+            past_key_values, _ = self.prefix_cache.take(agent_name, token_ids)
+
         inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
         temperature = temperature if temperature > 0.5 else 0.5
+        length_limit = {"max_length": 4096} if self.max_new_tokens is None \
+            else {"max_new_tokens": self.max_new_tokens}
+        output = self.model.generate(**inputs,
+                                     **length_limit,
+                                     temperature=temperature,
+                                     top_k=10,
+                                     do_sample=True,
+                                     num_return_sequences=1,
+                                     eos_token_id=self.tokenizer.eos_token_id,
+                                     pad_token_id=self.tokenizer.pad_token_id,
+                                     past_key_values=past_key_values,
+                                     return_dict_in_generate=True,
+                                     streamer=streamer)
+        sequence = output.sequences[0]
+        if use_cache:
+            self.prefix_cache.put(agent_name, sequence.tolist(), output.past_key_values)
+
+        return self.tokenizer.decode(sequence[len(token_ids):], skip_special_tokens=True)
+
+    def generate_stream(self, messages, temperature, agent_name=None):
+        """
+        Yield the response text in chunks while generate runs in a thread.
+        An exception raised by generate is raised here once the chunks
+        generated before it have been yielded.
+        """
+        streamer = TextIteratorStreamer(self.tokenizer,
+                                        skip_prompt=True,
+                                        skip_special_tokens=True,
+                                        timeout=self.stream_timeout)
+        errors = []
+
+        def generate():
+            try:
+                self.generate_single(messages, temperature, agent_name, streamer)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                # generate only ends the stream itself when it succeeds
+                streamer.end()
+
+        generation = Thread(target=generate)
+        generation.start()
+
+        try:
+            for chunk in streamer:
+                if chunk:
+                    yield chunk
+        except Empty:
+            raise TimeoutError(
+                f"{self.model_name} generated nothing for {self.stream_timeout}s"
+            )
+
+        generation.join()
+        if errors:
+            raise errors[0]
+
+    def generate_batch(self, messages_list, temperature):
+        """
+        Generate the responses to several conversations with one call to
+        generate, which keeps the model busy with all of them at once.
+
+        Args:
+            messages_list (list) : One list of messages per conversation.
+            temperature (float)  : Sampling temperature.
+
+        Returns:
+            list: The response text of each conversation, in order.
+        """
+        prompts = [
+            self.tokenizer.apply_chat_template(messages,
+                                               tokenize=False,
+                                               add_generation_prompt=True)
+            for messages in messages_list
+        ]
+        inputs = self.tokenizer(prompts,
+                                padding=True,
+                                add_special_tokens=False,
+                                return_tensors="pt")
+        inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
+        temperature = temperature if temperature > 0.5 else 0.5
+        length_limit = {"max_length": 4096} if self.max_new_tokens is None \
+            else {"max_new_tokens": self.max_new_tokens}
         response  = self.model.generate(**inputs,
+                                        **length_limit,
                                         temperature=temperature,
-                                        max_length=4096,
                                         top_k=10,
                                         num_beams=4,
                                         early_stopping=True,
                                         do_sample=True,
                                         num_return_sequences=1,
-                                        eos_token_id=self.tokenizer.eos_token_id)
+                                        eos_token_id=self.tokenizer.eos_token_id,
+                                        pad_token_id=self.tokenizer.pad_token_id)
         length    = inputs["input_ids"].shape[1]
-        result    = self.tokenizer.decode(response[0][length:])
+        results   = [
+            self.tokenizer.decode(output[length:], skip_special_tokens=True)
+            for output in response
+        ]
 
-        return result
+        return results
 
 class VLLMLocalBackend:
-    def __init__(self, model_name, device="auto", max_gpu_memory=None, hostname=None):
+    """
+    A vLLM model, served at hostname (e.g. "http://localhost:8001") if one is
+    given, and otherwise loaded into this process, where the syscalls of a
+    batch are generated together by generate_batch.
+    """
+    def __init__(self, model_name, device="auto", max_gpu_memory=None, hostname=None,
+                 max_new_tokens=None, pool_options=None):
         print("\n=== VLLMLocalBackend Initialization ===")
         print(f"Model name: {model_name}")
 
         self.model_name = model_name
         self.device = device
         self.max_gpu_memory = max_gpu_memory
-        # self.hostname = hostname
-        self.hostname = "http://localhost:8001"
+        self.hostname = hostname
+        self.max_new_tokens = max_new_tokens
 
         # If a hostname is given, then this vLLM instance is hosted as a web server.
         # Therefore, do not start the AIOS-based vLLM instance.
         if self.hostname is not None:
+            self.transport = get_transport(self.hostname, **(pool_options or {}))
             return
 
         try:
@@ -101,7 +254,8 @@ class VLLMLocalBackend:
                 tensor_parallel_size=1 if max_gpu_memory is None else len(max_gpu_memory)
             )
             self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-            self.sampling_params = vllm.SamplingParams(temperature=temperature)
+            # sampling parameters are built per call, with its temperature
+            self.sampling_params = vllm.SamplingParams
 
         except ImportError:
             raise ImportError("Could not import vllm Python package"
@@ -109,13 +263,27 @@ class VLLMLocalBackend:
         except Exception as err:
             print("Error loading vllm model:", err)
 
+    def close(self):
+        """Release the connections to the server the backend is hosted on."""
+        if self.hostname is not None:
+            release_transport(self.transport)
+
     def inference_online(self, messages, temperature, stream=False):
-        breakpoint()
+        if stream:
+            return stream_completion(
+                model="hosted_vllm/" + self.model_name,
+                messages=messages,
+                temperature=temperature,
+                api_base=self.hostname,
+                client=self.transport.handler,
+            )
+
         return completion(
             model="hosted_vllm/" + self.model_name,
             messages=messages,
             temperature=temperature,
             api_base=self.hostname,
+            client=self.transport.handler,
         ).choices[0].message.content
 
     def __call__(
@@ -131,24 +299,52 @@ class VLLMLocalBackend:
         assert self.sampling_params
         # breakpoint()
         if stream:
-            raise NotImplemented
+            # vllm.LLM has no incremental output, so the response is
+            # delivered as a single chunk
+            return iter([self.generate_batch([messages], temperature)[0]])
+
+        return self.generate_batch([messages], temperature)[0]
+
+    def generate_batch(self, messages_list, temperature):
+        """
+        Generate the responses to several conversations with one call to
+        generate, so that vLLM can schedule them together.
 
-        # parameters = vllm.SamplingParams(temperature=temperature)
-        prompt     = self.tokenizer.apply_chat_template(messages,
-                                                        tokenize=False)
-        response   = self.model.generate(prompt, self.sampling_params)
-        result     = response[0].outputs[0].text
+        Args:
+            messages_list (list) : One list of messages per conversation.
+            temperature (float)  : Sampling temperature.
 
-        return result
+        Returns:
+            list: The response text of each conversation, in order.
+        """
+        length_limit = {} if self.max_new_tokens is None \
+            else {"max_tokens": self.max_new_tokens}
+        parameters = self.sampling_params(temperature=temperature, **length_limit)
+        prompts    = [
+            self.tokenizer.apply_chat_template(messages,
+                                               tokenize=False,
+                                               add_generation_prompt=True)
+            for messages in messages_list
+        ]
+        response   = self.model.generate(prompts, parameters)
+        results    = [output.outputs[0].text for output in response]
+
+        return results
 
 class OllamaBackend:
-    def __init__(self, model_name, device="auto", max_gpu_memory=None, hostname=None):
+    def __init__(self, model_name, device="auto", max_gpu_memory=None, hostname=None, pool_options=None):
         print("\n=== OllamaBackend Initialization ===")
         print(f"Model name: {model_name}")
         print(f"Hostname: {hostname or 'http://localhost:11434'}")
 
         self.model_name = model_name
         self.hostname = hostname or "http://localhost:11434"
+        # syscalls to the same Ollama server share its keep-alive connections
+        self.transport = get_transport(self.hostname, **(pool_options or {}))
+
+    def close(self):
+        """Release the connections to the Ollama server."""
+        release_transport(self.transport)
 
     def __call__(
         self,
@@ -157,12 +353,22 @@ class OllamaBackend:
         # tools=None,
         stream=False,
     ):
+        if stream:
+            return stream_completion(
+                model="ollama/" + self.model_name,
+                messages=messages,
+                temperature=temperature,
+                api_base=self.hostname,
+                client=self.transport.handler,
+            )
+
         res = completion(
             model="ollama/" + self.model_name,
             messages=messages,
             temperature=temperature,
             # tools=tools,
-            api_base=self.hostname
+            api_base=self.hostname,
+            client=self.transport.handler,
         ).choices[0].message.content
         # breakpoint()
         return res
@@ -0,0 +1,167 @@
+# This keeps the attention key/value cache of the conversations run on a model
+# loaded by HfLocalBackend. Agent conversations grow by appending turns, so the
+# next prompt of an agent starts with tokens the model has already prefilled.
+# Reusing their past_key_values leaves only the new suffix to be prefilled.
+#
+# Entries are found through the hashes of their prefixes at every block_size
+# tokens, each chained from the one before, so a lookup hashes the prompt once
+# and finds the entries sharing its longest block-aligned prefix without
+# comparing it to every entry.
+
+from array import array
+from collections import OrderedDict
+from threading import Lock
+
+import hashlib
+
+class PrefixCache:
+    """
+    Per-agent cache of past_key_values, keyed by a hash of the tokens they
+    cover. Least recently used entries are evicted to stay within max_bytes.
+
+    An entry is taken out of the cache while a generation extends it, since
+    generate grows the cache in place, and put back with the longer prefix
+    afterwards. So a conversation costs its memory only once.
+
+    A prompt reuses an entry only if they share at least block_size tokens.
+
+    Args:
+        max_bytes (int)            : Memory budget of the cached keys and
+                                     values.
+        block_size (int, optional) : Tokens per block of the prefix index.
+                                     Defaults to 16.
+    """
+    def __init__(self, max_bytes: int, block_size: int = 16):
+        self.max_bytes = max_bytes
+        self.block_size = max(1, block_size)
+        # key -> (agent_name, token ids, cache, size in bytes, block hashes)
+        self.entries: OrderedDict[bytes, tuple] = OrderedDict()
+        # block hash -> keys of the entries starting with that prefix
+        self.index: dict[bytes, set[bytes]] = dict()
+        self.lock = Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+        self.evictions = 0
+
+    def block_hashes(self, agent_name: str, token_ids: list[int]) -> list[bytes]:
+        """Chained hashes of the agent's prefixes of token_ids, one per
+        block_size tokens, and one of all of them if the last block is
+        partial."""
+        digest = hashlib.sha256(agent_name.encode()).digest()
+        hashes = []
+        for start in range(0, len(token_ids), self.block_size):
+            block = array("I", token_ids[start:start + self.block_size]).tobytes()
+            digest = hashlib.sha256(digest + block).digest()
+            hashes.append(digest)
+        return hashes
+
+    @staticmethod
+    def size_of(cache) -> int:
+        if hasattr(cache, "layers"):
+            tensors = [
+                tensor for layer in cache.layers
+                for tensor in (layer.keys, layer.values) if tensor is not None
+            ]
+        else:
+            tensors = list(cache.key_cache) + list(cache.value_cache)
+        return sum(tensor.nelement() * tensor.element_size() for tensor in tensors)
+
+    @staticmethod
+    def common_prefix(a: list[int], b: list[int]) -> int:
+        length = 0
+        for x, y in zip(a, b):
+            if x != y:
+                break
+            length += 1
+        return length
+
+    def take(self, agent_name: str, token_ids: list[int]):
+        """
+        Take the cache of the agent sharing the longest prefix with
+        token_ids, cropped to that prefix. At least the last token is left
+        to be prefilled, since generation starts from its logits.
+
+        Returns:
+            tuple: the cache, or None on a miss, and the number of tokens
+                   it covers.
+        """
+        hashes = self.block_hashes(agent_name, token_ids)
+        # only whole blocks are in the index
+        hashes = hashes[:len(token_ids) // self.block_size]
+
+        with self.lock:
+            candidates = ()
+            for digest in hashes:
+                if digest not in self.index:
+                    break
+                candidates = self.index[digest]
+
+            best, length = None, 0
+            for key in candidates:
+                ids = self.entries[key][1]
+                common = min(self.common_prefix(ids, token_ids), len(token_ids) - 1)
+                if common > length:
+                    best, length = key, common
+
+            if best is None:
+                self.misses += 1
+                return None, 0
+
+            cache = self.remove(best)[2]
+            self.hits += 1
+            self.reused_tokens += length
+
+        cache.crop(length)
+        return cache, length
+
+    def put(self, agent_name: str, token_ids: list[int], cache):
+        """Cache the keys and values of the tokens the cache covers."""
+        token_ids = token_ids[:cache.get_seq_length()]
+        nbytes = self.size_of(cache)
+        if nbytes > self.max_bytes or not token_ids:
+            return
+        hashes = self.block_hashes(agent_name, token_ids)
+        key = hashes[-1]
+
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (agent_name, token_ids, cache, nbytes, hashes)
+            for digest in hashes[:len(token_ids) // self.block_size]:
+                self.index.setdefault(digest, set()).add(key)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def remove(self, key) -> tuple:
+        """Remove an entry and its blocks from the index, and return it.
+        Call with the lock held."""
+        entry = self.entries.pop(key)
+        for digest in entry[4]:
+            keys = self.index.get(digest)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.index[digest]
+        self.nbytes -= entry[3]
+        return entry
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.index.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "reused_tokens": self.reused_tokens,
+                "entries": len(self.entries),
+                "bytes": self.nbytes,
+                "evictions": self.evictions,
+            }
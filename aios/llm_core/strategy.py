@@ -1,31 +1,301 @@
+from aios.llm_core.errors import NoHealthyEndpointError, endpoint_name
+
+from contextlib import contextmanager
 from enum import Enum
+from threading import Lock
+
+import bisect
+import hashlib
+import math
+import random
+import time
 
 """
 Load balancing strategies. Each class represents a strategy which returns the
 next endpoint that the router should use.
 
 Each strategy must implement the following:
-    __init__(self, llm_name: list[str])
-    __call__(self)
+    __init__(self, llm_name: list[str], **health_options)
+    choose(self, candidates: list[int], llm_syscall) -> int
 
 The llm_name list contains all the endpoints that the router was initialized
-with. It is the strategy's job to then calculate which endpoint should be
-used whenever the strategy is called in __call__, and then return the name of
-the specific LLM endpoint.
+with. When the strategy is called, it narrows them down to the healthy
+endpoints that were not excluded, and choose picks the index of the one that
+should be used among those candidates. choose is called with the lock held.
+
+The router reports every request it sends through track(endpoint), which
+keeps live statistics of each endpoint that load-aware strategies use, and
+the circuit breaker that takes failing endpoints out of rotation.
 """
 
 class RouterStrategy(Enum):
     SIMPLE = 0,
+    LEAST_OUTSTANDING = 1,
+    LATENCY = 2,
+    THROUGHPUT = 3,
+    CONSISTENT_HASH = 4,
+
+class EndpointStats:
+    """
+    Live statistics and circuit breaker of one endpoint. Latency, throughput
+    and error rate are exponentially weighted moving averages, so they follow
+    changes in endpoint behaviour.
+
+    The circuit opens after failure_threshold failures in a row, or when more
+    than half of the recent requests failed. After cooldown seconds it lets a
+    single probe request through, which closes the circuit if it succeeds.
+    """
+    def __init__(self, alpha: float = 0.3, failure_threshold: int = 5,
+                 cooldown: float = 30.0):
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.outstanding = 0
+        self.completed = 0
+        self.errors = 0
+        self.latency = None
+        self.tokens_per_second = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.state = "closed"
+        self.opened_at = None
+        self.probing = False
+
+    def available(self, now) -> bool:
+        if self.state == "open" and now - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+            self.probing = False
+        if self.state == "half_open":
+            return not self.probing
+        return self.state == "closed"
+
+    def begin(self):
+        self.outstanding += 1
+        if self.state == "half_open":
+            self.probing = True
+
+    def abandon(self):
+        """The request was cancelled, which says nothing about the endpoint."""
+        self.outstanding -= 1
+        self.probing = False
+
+    def end(self, latency, tokens, failed=False):
+        self.outstanding -= 1
+        self.probing = False
+        self.error_rate += self.alpha * ((1.0 if failed else 0.0) - self.error_rate)
 
-class SimpleStrategy:
-    def __init__(self, llm_name: list[str]):
+        if failed:
+            self.errors += 1
+            self.consecutive_failures += 1
+            if self.state == "half_open" \
+                    or self.consecutive_failures >= self.failure_threshold \
+                    or (self.error_rate > 0.5 and self.errors + self.completed >= 10):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            return
+
+        self.completed += 1
+        self.consecutive_failures = 0
+        self.state = "closed"
+        throughput = tokens / latency if latency > 0 else 0.0
+        if self.latency is None:
+            self.latency = latency
+            self.tokens_per_second = throughput
+        else:
+            self.latency += self.alpha * (latency - self.latency)
+            self.tokens_per_second += self.alpha * (throughput - self.tokens_per_second)
+
+    def to_dict(self):
+        return {
+            "state": self.state,
+            "outstanding": self.outstanding,
+            "completed": self.completed,
+            "errors": self.errors,
+            "error_rate": self.error_rate,
+            "latency": self.latency,
+            "tokens_per_second": self.tokens_per_second,
+        }
+
+class BaseStrategy:
+    def __init__(self, llm_name: list[str], failure_threshold: int = 5,
+                 cooldown: float = 30.0):
         self.endpoints = llm_name
+        self.stats = [
+            EndpointStats(failure_threshold=failure_threshold, cooldown=cooldown)
+            for _ in self.endpoints
+        ]
+        # syscalls are addressed from several processor threads at once
+        self.lock = Lock()
+
+    def __call__(self, llm_syscall=None, exclude=()):
+        return self.get(llm_syscall, exclude)
+
+    def get(self, llm_syscall=None, exclude=()):
+        """
+        Return the endpoint for the syscall, skipping the excluded endpoints
+        and those with an open circuit.
+        """
+        now = time.monotonic()
+        with self.lock:
+            candidates = [
+                idx for idx, endpoint in enumerate(self.endpoints)
+                if not any(endpoint is excluded for excluded in exclude)
+                and self.stats[idx].available(now)
+            ]
+            if not candidates:
+                raise NoHealthyEndpointError(
+                    "no healthy LLM endpoint is left to address the syscall"
+                )
+            return self.endpoints[self.choose(candidates, llm_syscall)]
+
+    def choose(self, candidates: list[int], llm_syscall) -> int:
+        raise NotImplementedError
+
+    def index_of(self, endpoint) -> int:
+        for idx, candidate in enumerate(self.endpoints):
+            if candidate is endpoint:
+                return idx
+        return self.endpoints.index(endpoint)
+
+    @contextmanager
+    def track(self, endpoint):
+        """
+        Record a request to the endpoint. Set "tokens" in the yielded dict to
+        the number of tokens generated, for the throughput statistics.
+        Exceptions with endpoint_fault set to False, like a request the
+        endpoint rejected, do not count against its health.
+        """
+        stats = self.stats[self.index_of(endpoint)]
+        with self.lock:
+            stats.begin()
+
+        request = {"tokens": 0}
+        started = time.monotonic()
+        try:
+            yield request
+        except Exception as e:
+            with self.lock:
+                stats.end(
+                    time.monotonic() - started, 0,
+                    failed=getattr(e, "endpoint_fault", True),
+                )
+            raise
+        except BaseException:
+            with self.lock:
+                stats.abandon()
+            raise
+
+        with self.lock:
+            stats.end(time.monotonic() - started, request["tokens"])
+
+    def get_stats(self) -> list[dict]:
+        with self.lock:
+            return [
+                {"endpoint": endpoint_name(endpoint), **stats.to_dict()}
+                for endpoint, stats in zip(self.endpoints, self.stats)
+            ]
+
+class SimpleStrategy(BaseStrategy):
+    def __init__(self, llm_name: list[str], **health_options):
+        super().__init__(llm_name, **health_options)
         self.idx = 0
 
-    def __call__(self):
-        return self.get()
+    def choose(self, candidates, llm_syscall):
+        # the next candidate at or after the current position
+        current  = min(candidates, key=lambda idx: (idx - self.idx) % len(self.endpoints))
+        self.idx = (current + 1) % len(self.endpoints)
+        return current
 
-    def get(self):
-        current  = self.endpoints[self.idx]
+class LeastOutstandingStrategy(BaseStrategy):
+    """
+    Sends each request to the endpoint with the fewest requests in flight.
+    Ties are broken round robin.
+    """
+    def __init__(self, llm_name: list[str], **health_options):
+        super().__init__(llm_name, **health_options)
+        self.idx = 0
+
+    def choose(self, candidates, llm_syscall):
+        best = min(candidates, key=lambda idx: (
+            self.stats[idx].outstanding, (idx - self.idx) % len(self.endpoints)
+        ))
         self.idx = (self.idx + 1) % len(self.endpoints)
-        return current
+        return best
+
+class WeightedStrategy(BaseStrategy):
+    """
+    Picks endpoints at random, weighted by their expected speed divided by the
+    requests already in flight on them. Endpoints without measurements are
+    tried first, so every endpoint gets measured.
+    """
+    def speed(self, stats: EndpointStats) -> float:
+        raise NotImplementedError
+
+    def choose(self, candidates, llm_syscall):
+        unmeasured = [idx for idx in candidates if self.stats[idx].completed == 0]
+        if unmeasured:
+            return min(unmeasured, key=lambda idx: self.stats[idx].outstanding)
+
+        weights = [
+            max(self.speed(self.stats[idx]), 1e-9) / (self.stats[idx].outstanding + 1)
+            for idx in candidates
+        ]
+        return random.choices(candidates, weights=weights)[0]
+
+class LatencyStrategy(WeightedStrategy):
+    """Weights endpoints by the inverse of their latency EWMA."""
+    def speed(self, stats):
+        return 1.0 / max(stats.latency, 1e-6)
+
+class ThroughputStrategy(WeightedStrategy):
+    """Weights endpoints by their EWMA of generated tokens per second."""
+    def speed(self, stats):
+        return stats.tokens_per_second
+
+class ConsistentHashStrategy(BaseStrategy):
+    """
+    Maps each agent to an endpoint on a hash ring, so the requests of an agent
+    keep hitting the same endpoint and its prefix cache. An endpoint that has
+    more than load_factor times the average load in flight is skipped for the
+    next one on the ring, so a hot agent does not block the others.
+    """
+    def __init__(self, llm_name: list[str], replicas: int = 64,
+                 load_factor: float = 1.25, **health_options):
+        super().__init__(llm_name, **health_options)
+        self.load_factor = load_factor
+        self.ring = sorted(
+            (self.hash(f"{endpoint_name(endpoint)}#{idx}#{replica}"), idx)
+            for idx, endpoint in enumerate(self.endpoints)
+            for replica in range(replicas)
+        )
+        self.ring_keys = [key for key, _ in self.ring]
+
+    @staticmethod
+    def hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    def choose(self, candidates, llm_syscall):
+        agent_name = getattr(llm_syscall, "agent_name", None) or ""
+        start = bisect.bisect(self.ring_keys, self.hash(agent_name)) % len(self.ring)
+
+        total = sum(self.stats[idx].outstanding for idx in candidates)
+        capacity = math.ceil(self.load_factor * (total + 1) / len(candidates))
+        first = None
+        for offset in range(len(self.ring)):
+            idx = self.ring[(start + offset) % len(self.ring)][1]
+            if idx not in candidates:
+                continue
+            if first is None:
+                first = idx
+            if self.stats[idx].outstanding + 1 <= capacity:
+                return idx
+
+        return first
+
+STRATEGIES = {
+    RouterStrategy.SIMPLE: SimpleStrategy,
+    RouterStrategy.LEAST_OUTSTANDING: LeastOutstandingStrategy,
+    RouterStrategy.LATENCY: LatencyStrategy,
+    RouterStrategy.THROUGHPUT: ThroughputStrategy,
+    RouterStrategy.CONSISTENT_HASH: ConsistentHashStrategy,
+}
@@ -0,0 +1,94 @@
+# Pooled HTTP transports for the backends that send requests to an LLM server,
+# like Ollama or a hosted vLLM. Opening a new TCP (and TLS) connection for each
+# request shows up in the latency of short requests, so every backend that
+# addresses the same host shares one client that keeps its connections alive.
+
+from litellm.llms.custom_httpx.http_handler import HTTPHandler
+
+from threading import Lock
+from urllib.parse import urlsplit
+
+import httpx
+import importlib.util
+
+class PooledTransport:
+    """
+    A keep-alive connection pool to one host, in the form litellm takes as
+    the client of a request.
+
+    Args:
+        max_connections (int, optional)           : Connections open at once.
+                                                    Defaults to 100.
+        max_keepalive_connections (int, optional) : Idle connections kept
+                                                    open. Defaults to 20.
+        keepalive_expiry (float, optional)        : Seconds an idle connection
+                                                    is kept. Defaults to 30.
+        connect_timeout (float, optional)         : Seconds to wait for a new
+                                                    connection. Defaults to 5.
+        timeout (float, optional)                 : Seconds to wait for a
+                                                    response. Defaults to 600.
+        http2 (bool, optional)                    : Whether to speak HTTP/2 to
+                                                    hosts that support it.
+                                                    Needs the h2 package.
+    """
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        connect_timeout: float = 5.0,
+        timeout: float | None = 600.0,
+        http2: bool = False,
+    ):
+        if http2 and importlib.util.find_spec("h2") is None:
+            print("HTTP/2 needs the h2 package, install it with "
+                  "`pip install httpx[http2]`. Falling back to HTTP/1.1")
+            http2 = False
+
+        self.client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            http2=http2,
+            follow_redirects=True,
+        )
+        self.handler = HTTPHandler(client=self.client)
+        # backends holding the transport, see get_transport
+        self.users = 0
+
+    def close(self):
+        self.client.close()
+
+_transports: dict[tuple, PooledTransport] = {}
+_transports_lock = Lock()
+
+def get_transport(hostname: str, **options) -> PooledTransport:
+    """
+    Return the transport to the host of the given URL, creating it on first
+    use. Backends asking for the same host with the same options share it.
+    """
+    url = urlsplit(hostname if "://" in hostname else "http://" + hostname)
+    key = (url.scheme, url.hostname, url.port, tuple(sorted(options.items())))
+    with _transports_lock:
+        if key not in _transports:
+            _transports[key] = PooledTransport(**options)
+        transport = _transports[key]
+        transport.users += 1
+        return transport
+
+def release_transport(transport: PooledTransport):
+    """
+    Give back a transport returned by get_transport. It is closed once none
+    of the backends that asked for it hold it any more.
+    """
+    with _transports_lock:
+        transport.users -= 1
+        if transport.users > 0:
+            return
+        for key, value in list(_transports.items()):
+            if value is transport:
+                del _transports[key]
+    transport.close()
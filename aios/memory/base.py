@@ -14,43 +14,83 @@ class MemoryRequest:
         self.operation_type = operation_type
 
 class Memory:
+    """
+    Arena of bytes managed by a buddy allocator. Allocations are rounded up
+    to a power of two of at least MIN_BLOCK_SIZE bytes. Each free list holds
+    the free blocks of one size, and a freed block is merged with its buddy
+    whenever the buddy is free too, so the arena does not fragment.
+    """
+    MIN_ORDER = 4  # 16 bytes
+
     def __init__(self, size=1024):
         self.size = size
         """ makes an array of bytes, typically how memory is organized """
         self.memory = (ctypes.c_ubyte * size)()
-        self.free_blocks = [(0, size - 1)]
+        self.view = memoryview(self.memory).cast("B")
+        self.free_lists = {}  # order -> addresses of the free blocks
+        self.allocated = {}   # address -> order of the allocated block
+        self.reset()
+
+    def reset(self):
+        """ free the whole arena """
+        self.free_lists = {order: set() for order in range(self.MIN_ORDER, self.size.bit_length() + 1)}
+        self.allocated.clear()
+
+        # an arena that is not a power of two is cut into power of two
+        # blocks from the largest down, which keeps every block aligned
+        address = 0
+        for order in range(self.size.bit_length(), self.MIN_ORDER - 1, -1):
+            if self.size - address >= 1 << order:
+                self.free_lists[order].add(address)
+                address += 1 << order
+
+    def order_of(self, size):
+        return max(self.MIN_ORDER, (max(size, 1) - 1).bit_length())
 
     # malloc(3) implementation
     def mem_alloc(self, size):
-        for i, (start, end) in enumerate(self.free_blocks):
-            block_size = end - start + 1
-            if block_size >= size:
-                allocated_start = start
-                allocated_end = start + size - 1
-                if allocated_end == end:
-                    self.free_blocks.pop(i)
-                else:
-                    self.free_blocks[i] = (allocated_end + 1, end)
-                return allocated_start
-        raise MemoryError("No sufficient memory available.")
-
-    def mem_clear(self, start, size):
-        allocated_end = start + size - 1
-        self.free_blocks.append((start, allocated_end))
-        self.free_blocks.sort()
+        order = self.order_of(size)
+        for current in range(order, len(self.free_lists) + self.MIN_ORDER):
+            if self.free_lists.get(current):
+                address = self.free_lists[current].pop()
+                break
+        else:
+            raise MemoryError("No sufficient memory available.")
+
+        """ split the block, keeping the upper halves free """
+        while current > order:
+            current -= 1
+            self.free_lists[current].add(address + (1 << current))
+
+        self.allocated[address] = order
+        return address
+
+    def mem_clear(self, start, size=None):
+        order = self.allocated.pop(start)
+        """ merge with the buddy as long as it is free """
+        while order < self.size.bit_length():
+            buddy = start ^ (1 << order)
+            if buddy not in self.free_lists[order]:
+                break
+            self.free_lists[order].remove(buddy)
+            start = min(start, buddy)
+            order += 1
+        self.free_lists[order].add(start)
+
+    def free_bytes(self):
+        return sum(len(blocks) << order for order, blocks in self.free_lists.items())
 
     # memcpy(3) implementation
     def mem_write(self, address, data):
         size = len(data)
         if address + size > self.size:
             raise MemoryError("Not enough space to write data.")
-        for i in range(size):
-            self.memory[address + i] = data[i]
+        self.view[address:address + size] = data
 
-    # similar to dereferencing pointers
+    # similar to dereferencing pointers, the view shares the arena's memory
+    # and is only valid until the block is freed
     def mem_read(self, address, size):
-        data = self.memory[address:address + size]
-        return data
+        return self.view[address:address + size]
 
 # abstract implementation of memory utilities for thread safe access
 class BaseMemoryManager:
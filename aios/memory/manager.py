@@ -1,4 +1,7 @@
 from .memory_classes.single_memory import SingleMemoryManager
+from .memory_classes.mmap_memory import MmapMemoryManager
+
+import os
 
 
 class MemoryManager:
@@ -8,15 +11,29 @@ class MemoryManager:
         eviction_k,
         storage_manager,
         log_mode: str = "console",
+        memory_backend: str = "single",
+        memory_path: str | None = None,
     ):
-        self.memory_manager = SingleMemoryManager(
-            memory_limit,
-            eviction_k,
-            storage_manager
-        )
+        # "mmap" keeps agent memory in a log file under the storage root, so
+        # that it survives kernel restarts
+        if memory_backend == "mmap":
+            self.memory_manager = MmapMemoryManager(
+                memory_path or os.path.join(storage_manager.root_dir, "memory.log")
+            )
+        else:
+            self.memory_manager = SingleMemoryManager(
+                memory_limit,
+                eviction_k,
+                storage_manager
+            )
 
     def address_request(
         self,
         agent_request,
     ) -> None:
         return self.memory_manager.address_request(agent_request)
+
+    def cleanup(self):
+        # write pending blocks to storage before the backend stops
+        self.memory_manager.flush()
+        self.memory_manager.stop()
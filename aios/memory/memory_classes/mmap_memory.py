@@ -0,0 +1,269 @@
+# This keeps agent memory in a memory-mapped, append-only log file, so that it
+# survives kernel restarts without being loaded into the heap. Every write
+# appends a record, and an in-memory index maps (aid, rid) to the offset of its
+# latest record, so a read is a single slice of the mapping.
+#
+# Layout of the log:
+#     header  : MAGIC, format version, generation id of the file
+#     records : crc32, key length, payload length, kind, key, payload
+# The key is the pickled (aid, rid) pair, or the aid of a clear record, and the
+# payload is the compressed pickle of the round. The crc covers everything
+# after it, so a record torn by a crash is detected and cut off on recovery.
+#
+# On close, the index is saved next to the log together with the log size it
+# covers, and startup only has to scan the records appended after that.
+
+from threading import Lock
+
+import mmap
+import os
+import pickle
+import struct
+import zlib
+
+MAGIC = b"AIOM"
+VERSION = 1
+FILE_HEADER = struct.Struct("<4sI8s")
+RECORD_HEADER = struct.Struct("<IIIB")
+
+PUT = 0
+CLEAR = 1
+
+class MmapMemoryManager:
+    """
+    Persistent agent memory backed by a memory-mapped log file.
+
+    Args:
+        path (str)                        : Log file, created if missing.
+        sync (bool, optional)             : Whether to fsync every write.
+                                            Defaults to False, which leaves
+                                            flushing to the OS.
+        compaction_ratio (float, optional): Share of the log taken by
+                                            overwritten or cleared records
+                                            that triggers a compaction.
+                                            Defaults to 0.5.
+        min_compaction_size (int, optional)
+                                          : Log size in bytes below which no
+                                            compaction is done. Defaults to
+                                            64MB.
+    """
+    def __init__(self,
+                 path,
+                 sync=False,
+                 compaction_ratio=0.5,
+                 min_compaction_size=64 * 1024 * 1024):
+        self.path = path
+        self.index_path = path + ".index"
+        self.sync = sync
+        self.compaction_ratio = compaction_ratio
+        self.min_compaction_size = min_compaction_size
+        self.lock = Lock()
+
+        self.index = dict()  # (aid, rid) -> (payload offset, payload length)
+        self.agent_rounds = dict()  # aid -> set of rids
+        self.dead_bytes = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, "a+b")
+        if os.fstat(self.file.fileno()).st_size == 0:
+            self._write_file_header(self.file)
+        self.map = None
+        self._remap()
+        self._recover()
+
+    def address_request(self, agent_request):
+        operation_type = agent_request.operation_type
+        if operation_type == "allocate":
+            self.mem_alloc(agent_request.agent_name)
+
+    def mem_alloc(self, aid):
+        with self.lock:
+            self.agent_rounds.setdefault(aid, set())
+
+    def mem_read(self, aid, rid):
+        with self.lock:
+            location = self.index.get((aid, rid))
+            if location is None:
+                return None
+            offset, length = location
+            if offset + length > len(self.map):
+                self._remap()
+            payload = self.map[offset:offset + length]
+        return pickle.loads(zlib.decompress(payload))
+
+    def mem_write(self, aid, rid, s):
+        payload = zlib.compress(pickle.dumps(s))
+        key = pickle.dumps((aid, rid))
+        with self.lock:
+            offset = self._append(PUT, key, payload)
+            previous = self.index.get((aid, rid))
+            if previous is not None:
+                self.dead_bytes += self._record_size(previous[1], len(key))
+            self.index[(aid, rid)] = (offset, len(payload))
+            self.agent_rounds.setdefault(aid, set()).add(rid)
+            self._maybe_compact()
+
+    def mem_clear(self, aid):
+        with self.lock:
+            key = pickle.dumps(aid)
+            self._append(CLEAR, key, b"")
+            # the clear record is only needed until the next compaction
+            self.dead_bytes += self._record_size(0, len(key))
+            for rid in self.agent_rounds.pop(aid, set()):
+                offset, length = self.index.pop((aid, rid))
+                self.dead_bytes += self._record_size(length, len(pickle.dumps((aid, rid))))
+            self._maybe_compact()
+
+    def memory_usage(self) -> dict:
+        with self.lock:
+            return {
+                "file_bytes": self._log_size(),
+                "dead_bytes": self.dead_bytes,
+                "agents": len(self.agent_rounds),
+                "blocks": len(self.index),
+            }
+
+    def flush(self):
+        """Make every write durable and save the index for a fast restart."""
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self._save_index()
+
+    def stop(self):
+        with self.lock:
+            self.file.flush()
+            self._save_index()
+            self.map.close()
+            self.file.close()
+
+    def compact(self):
+        """Rewrite the log with only the latest record of each live round."""
+        with self.lock:
+            self._compact()
+
+    def _record_size(self, payload_length, key_length):
+        return RECORD_HEADER.size + key_length + payload_length
+
+    def _log_size(self):
+        return os.fstat(self.file.fileno()).st_size
+
+    def _write_file_header(self, file):
+        file.write(FILE_HEADER.pack(MAGIC, VERSION, os.urandom(8)))
+        file.flush()
+
+    def _remap(self):
+        if self.map is not None:
+            self.map.close()
+        self.file.flush()
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _append(self, kind, key, payload):
+        """Append a record and return the offset of its payload."""
+        body = RECORD_HEADER.pack(0, len(key), len(payload), kind)[4:] + key + payload
+        record = struct.pack("<I", zlib.crc32(body)) + body
+        start = self._log_size()
+        self.file.write(record)
+        self.file.flush()
+        if self.sync:
+            os.fsync(self.file.fileno())
+        return start + RECORD_HEADER.size + len(key)
+
+    def _recover(self):
+        """Rebuild the index from the saved index and the records after it,
+        and cut off a record that was torn by a crash."""
+        magic, version, generation = FILE_HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.path} is not an agent memory log")
+        self.generation = generation
+
+        position = FILE_HEADER.size
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, "rb") as file:
+                    saved = pickle.load(file)
+                if saved["generation"] == generation and saved["size"] <= len(self.map):
+                    self.index = saved["index"]
+                    self.dead_bytes = saved["dead_bytes"]
+                    position = saved["size"]
+            except Exception:
+                # a damaged index is rebuilt from the log
+                self.index = dict()
+                self.dead_bytes = 0
+
+        end = len(self.map)
+        while position + RECORD_HEADER.size <= end:
+            crc, key_length, payload_length, kind = RECORD_HEADER.unpack_from(self.map, position)
+            record_end = position + RECORD_HEADER.size + key_length + payload_length
+            if record_end > end or zlib.crc32(self.map[position + 4:record_end]) != crc:
+                break
+
+            key = pickle.loads(self.map[position + RECORD_HEADER.size:record_end - payload_length])
+            if kind == PUT:
+                previous = self.index.get(key)
+                if previous is not None:
+                    self.dead_bytes += self._record_size(previous[1], key_length)
+                self.index[key] = (record_end - payload_length, payload_length)
+            else:
+                for stale in [k for k in self.index if k[0] == key]:
+                    self.dead_bytes += self._record_size(
+                        self.index.pop(stale)[1], len(pickle.dumps(stale))
+                    )
+                self.dead_bytes += record_end - position
+            position = record_end
+
+        if position < end:
+            print(f"Truncating {end - position} bytes of a torn record in {self.path}")
+            self.map.close()
+            self.file.truncate(position)
+            self.map = None
+            self._remap()
+
+        self.agent_rounds = dict()
+        for aid, rid in self.index:
+            self.agent_rounds.setdefault(aid, set()).add(rid)
+
+    def _save_index(self):
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "wb") as file:
+            pickle.dump({
+                "generation": self.generation,
+                "size": self._log_size(),
+                "index": self.index,
+                "dead_bytes": self.dead_bytes,
+            }, file)
+        os.replace(temp_path, self.index_path)
+
+    def _maybe_compact(self):
+        size = self._log_size()
+        if size >= self.min_compaction_size and self.dead_bytes > size * self.compaction_ratio:
+            self._compact()
+
+    def _compact(self):
+        """Copy the live records to a new log and swap it in. Call with the
+        lock held."""
+        self._remap()
+        temp_path = self.path + ".compact"
+        index = dict()
+        with open(temp_path, "wb") as file:
+            self._write_file_header(file)
+            for key, (offset, length) in self.index.items():
+                encoded_key = pickle.dumps(key)
+                body = RECORD_HEADER.pack(0, len(encoded_key), length, PUT)[4:] \
+                    + encoded_key + self.map[offset:offset + length]
+                record_start = file.tell()
+                file.write(struct.pack("<I", zlib.crc32(body)) + body)
+                index[key] = (record_start + RECORD_HEADER.size + len(encoded_key), length)
+            file.flush()
+            os.fsync(file.fileno())
+
+        self.map.close()
+        self.file.close()
+        os.replace(temp_path, self.path)
+        self.file = open(self.path, "a+b")
+        self.map = None
+        self._remap()
+        self.generation = FILE_HEADER.unpack_from(self.map, 0)[2]
+        self.index = index
+        self.dead_bytes = 0
+        self._save_index()
@@ -2,15 +2,34 @@ from aios.memory.base import (
     MemoryRequest,
     BaseMemoryManager
 )
+from aios.memory.lru_k_replacer import LRU_K_Replacer
 
 from typing import Dict, OrderedDict
 
+import heapq
 import pickle
 import zlib
 
-from threading import Thread
+from queue import Queue
+from threading import Lock, Thread
+
+# Put on the write-back queue to stop the writer thread.
+STOP_WRITEBACK = object()
 
 class SingleMemoryManager:
+    """
+    Memory of the agents, kept as compressed blocks, one per agent and round.
+
+    memory_limit is the number of compressed bytes held in memory by all
+    agents together. The total is updated as blocks come and go. When a
+    write goes over the limit, blocks of any agent are evicted in the order
+    chosen by an LRU-K replacer with K = eviction_k, so blocks that were
+    used only once go before the ones in steady use. Evicted blocks that
+    were written since they were last stored are written back to the
+    storage manager by a background thread. Reads of blocks that are not in
+    memory are served from storage and cached again as clean blocks, which
+    are dropped on eviction.
+    """
     def __init__(self,
                  memory_limit,
                  eviction_k,
@@ -20,6 +39,28 @@ class SingleMemoryManager:
         self.eviction_k = eviction_k
         self.storage_manager = storage_manager
 
+        # a block holds at least one byte, so there are never more blocks
+        # than bytes in the limit and recycled ids stay below it
+        self.replacer = LRU_K_Replacer(memory_limit, eviction_k)
+        self.block_ids: Dict[tuple, int] = dict()
+        self.block_keys: Dict[int, tuple] = dict()
+        self.free_block_ids = []
+        self.next_block_id = 0
+        self.used_bytes = 0
+        self.evictions = 0
+        # blocks written since they were last stored
+        self.dirty_blocks = set()
+        self.lock = Lock()
+
+        # evicted blocks waiting to be written to storage, which reads are
+        # served from until the write is done
+        self.writeback_pending: Dict[tuple, bytes] = dict()
+        self.writeback_queue = Queue()
+        # orders the writer's storage updates with the ones of mem_clear
+        self.storage_lock = Lock()
+        self.writer = Thread(target=self.run_writeback, daemon=True)
+        self.writer.start()
+
     def address_request(self, agent_request):
         operation_type = agent_request.operation_type
         if operation_type == "allocate":
@@ -31,36 +72,149 @@ class SingleMemoryManager:
             self.storage_manager.sto_create(aid)
 
     def mem_read(self, aid, rid):
-        if aid in self.memory_blocks and rid in self.memory_blocks[aid]:
-            compressed_data = self.memory_blocks[aid].pop(rid)
-            self.memory_blocks[aid][rid] = compressed_data
-            return pickle.loads(zlib.decompress(compressed_data))
-        else:
-            return self.storage_manager.sto_read(aid, rid)
+        with self.lock:
+            if aid in self.memory_blocks and rid in self.memory_blocks[aid]:
+                self.replacer.update_access_history(self.block_ids[(aid, rid)])
+                return pickle.loads(zlib.decompress(self.memory_blocks[aid][rid]))
+
+            compressed_data = self.writeback_pending.get((aid, rid))
+
+        if compressed_data is None:
+            data = self.storage_manager.sto_read(aid, aid=aid, rid=rid)
+            if data is None:
+                return None
+            compressed_data = zlib.compress(pickle.dumps(data))
+
+        with self.lock:
+            self.mem_alloc(aid)
+            if rid not in self.memory_blocks[aid]:
+                self._cache_block(aid, rid, compressed_data, dirty=False)
+        return pickle.loads(zlib.decompress(compressed_data))
 
     def mem_write(self, aid, rid, s):
-        self.mem_alloc(aid)
         serialized_data = pickle.dumps(s)
         compressed_data = zlib.compress(serialized_data)
 
-        if rid in self.memory_blocks[aid]:
-            self.memory_blocks[aid].pop(rid)
-        self.memory_blocks[aid][rid] = compressed_data
+        with self.lock:
+            self.mem_alloc(aid)
+            if rid in self.memory_blocks[aid]:
+                self._drop_block(aid, rid)
+            # an older version waiting for write-back is out of date
+            self.writeback_pending.pop((aid, rid), None)
+
+            if len(compressed_data) > self.memory_limit:
+                # a block larger than the whole memory goes straight to storage
+                self._write_back(aid, rid, compressed_data)
+                return
 
-        if self._total_memory_count() > self.memory_limit:
-            self._evict_memory(aid)
+            self._cache_block(aid, rid, compressed_data, dirty=True)
 
     def mem_clear(self, aid):
-        if aid in self.memory_blocks:
-            del self.memory_blocks[aid]
+        with self.lock:
+            blocks = self.memory_blocks.pop(aid, {})
+            for rid, compressed_data in blocks.items():
+                self._remove_block(aid, rid, compressed_data)
+            for key in [key for key in self.writeback_pending if key[0] == aid]:
+                del self.writeback_pending[key]
+
+        with self.storage_lock:
             self.storage_manager.sto_clear(aid)
 
-    def _total_memory_count(self):
-        return sum(len(blocks) for blocks in self.memory_blocks.values())
+    def memory_usage(self) -> dict:
+        with self.lock:
+            return {
+                "used_bytes": self.used_bytes,
+                "memory_limit": self.memory_limit,
+                "blocks": len(self.block_ids),
+                "evictions": self.evictions,
+                "pending_writebacks": len(self.writeback_pending),
+            }
+
+    def flush(self):
+        """Block until every evicted block has been written to storage."""
+        self.writeback_queue.join()
+
+    def stop(self):
+        self.writeback_queue.put(STOP_WRITEBACK)
+        self.writer.join()
+
+    def _cache_block(self, aid, rid, compressed_data, dirty):
+        """Put a block in memory and evict others if over the limit. Only
+        dirty blocks are written back when evicted. Call with the lock
+        held."""
+        if self.free_block_ids:
+            block_id = heapq.heappop(self.free_block_ids)
+        else:
+            block_id = self.next_block_id
+            self.next_block_id += 1
+
+        self.memory_blocks[aid][rid] = compressed_data
+        self.block_ids[(aid, rid)] = block_id
+        self.block_keys[block_id] = (aid, rid)
+        self.used_bytes += len(compressed_data)
+        if dirty:
+            self.dirty_blocks.add((aid, rid))
+        self.replacer.update_access_history(block_id)
+
+        # the new block itself is not a candidate
+        self.replacer.set_evictable(block_id, False)
+        while self.used_bytes > self.memory_limit:
+            victim = self.replacer.evict()
+            if victim is None:
+                break
+            victim_aid, victim_rid = self.block_keys[victim]
+            victim_data = self.memory_blocks[victim_aid].pop(victim_rid)
+            dirty = (victim_aid, victim_rid) in self.dirty_blocks
+            self._forget_block(victim_aid, victim_rid, len(victim_data))
+            if dirty:
+                self._write_back(victim_aid, victim_rid, victim_data)
+            self.evictions += 1
+        self.replacer.set_evictable(block_id, True)
+
+    def _drop_block(self, aid, rid):
+        """Remove a block from memory without writing it back. Call with the
+        lock held."""
+        self._remove_block(aid, rid, self.memory_blocks[aid].pop(rid))
+
+    def _remove_block(self, aid, rid, compressed_data):
+        self.replacer.remove(self.block_ids[(aid, rid)])
+        self._forget_block(aid, rid, len(compressed_data))
+
+    def _forget_block(self, aid, rid, size):
+        block_id = self.block_ids.pop((aid, rid))
+        del self.block_keys[block_id]
+        self.dirty_blocks.discard((aid, rid))
+        heapq.heappush(self.free_block_ids, block_id)
+        self.used_bytes -= size
+
+    def _write_back(self, aid, rid, compressed_data):
+        self.writeback_pending[(aid, rid)] = compressed_data
+        self.writeback_queue.put((aid, rid, compressed_data))
+
+    def run_writeback(self):
+        while True:
+            item = self.writeback_queue.get()
+            try:
+                if item is STOP_WRITEBACK:
+                    break
+
+                aid, rid, compressed_data = item
+                with self.storage_lock:
+                    with self.lock:
+                        # skip blocks that were written again or cleared since
+                        if self.writeback_pending.get((aid, rid)) is not compressed_data:
+                            continue
+
+                    # the new record of the round replaces the stored one
+                    self.storage_manager.sto_write(
+                        aid, pickle.loads(zlib.decompress(compressed_data)),
+                        aid=aid, rid=rid
+                    )
 
-    def _evict_memory(self, aid):
-        if aid in self.memory_blocks:
-            for _ in range(min(self.eviction_k,
-                           len(self.memory_blocks[aid]))):
-                rid, compressed_data = self.memory_blocks[aid].popitem(last=False)
-                self.storage_manager.sto_write(aid, rid, pickle.loads(zlib.decompress(compressed_data)))
+                with self.lock:
+                    if self.writeback_pending.get((aid, rid)) is compressed_data:
+                        del self.writeback_pending[(aid, rid)]
+            except Exception as e:
+                print(f"Failed to write memory block back to storage: {e}")
+            finally:
+                self.writeback_queue.task_done()
@@ -9,21 +9,25 @@ from aios.memory.base import (
 
 # allows for lists to be heapify'd so the blocks are in order
 import heapq
+import pickle
+import zlib
 
 # FIFO queue for whichever thread stops blocking first
 from queue import Queue, Empty
 
-from utils.compressor import (
-    ZLIBCompressor
-)
-
 from aios.memory.base import (
     Memory
 )
 
-from threading import Thread
+from threading import Lock, Thread
 
 class UniformedMemoryManager(BaseMemoryManager):
+    """
+    Memory manager that keeps each agent's rounds in a fixed pool of arenas.
+    An agent is given an arena of max_memory_block_size bytes on its first
+    write, and the compressed rounds are allocated in it by the arena's buddy
+    allocator. Clearing an agent returns its arena to the pool.
+    """
     def __init__(self, max_memory_block_size, memory_block_num):
         super().__init__(max_memory_block_size, memory_block_num)
         """ initiate the memory manager in a manner similar to malloc(3) """
@@ -32,6 +36,7 @@ class UniformedMemoryManager(BaseMemoryManager):
         ]
         self.free_memory_blocks = [i for i in range(0, memory_block_num)]
         self.thread = Thread(target=self.run)
+        self.lock = Lock()
 
         self.aid_to_memory = dict() # map agent id to memory block id, address, size
         # {
@@ -39,11 +44,11 @@ class UniformedMemoryManager(BaseMemoryManager):
         #       round_id: {"memory_block_id": int, "address": int, size: int}
         #    }
         # }
+        self.agent_blocks = dict() # map agent id to its memory block id
 
-        self.compressor = ZLIBCompressor() # used for compressing data
         """ maintain a min heap structure for free memory blocks """
         heapq.heapify(self.free_memory_blocks)
-        self.memory_operation_queue = Queue() # TODO add lock to ensure parallel
+        self.memory_operation_queue = Queue()
 
     def run(self):
         while self.active:
@@ -63,10 +68,12 @@ class UniformedMemoryManager(BaseMemoryManager):
         operation_type = memory_request.operation_type
         if operation_type == "write":
             self.mem_write(
-                agent_id=memory_request.agent_id, content=memory_request.content
+                agent_id=memory_request.agent_id,
+                round_id=memory_request.round_id,
+                content=memory_request.content
             )
         elif operation_type == "read":
-            self.mem_read(
+            return self.mem_read(
                 agent_id=memory_request.agent_id, round_id=memory_request.round_id
             )
 
@@ -75,34 +82,57 @@ class UniformedMemoryManager(BaseMemoryManager):
         self.active = False
         self.thread.join()
 
-    def mem_write(self, agent_id, round_id: str, content: str):
+    def mem_write(self, agent_id, round_id, content):
         """ write to memory given agent id """
-        compressed_content = self.compressor.compress(content)
+        compressed_content = zlib.compress(pickle.dumps(content))
         size = len(compressed_content)
-        address = self.memory_blocks[
-            self.aid_to_memory[agent_id][round_id]["memory_block_id"]
-        ].mem_alloc(size)
 
-        self.memory_blocks[
-            self.aid_to_memory[agent_id][round_id]["memory_block_id"]
-        ].mem_write(address, compressed_content)
+        with self.lock:
+            if agent_id not in self.agent_blocks:
+                self.mem_alloc(agent_id)
+            memory_block_id = self.agent_blocks[agent_id]
+            memory_block = self.memory_blocks[memory_block_id]
+
+            """ a round that is written again replaces its old allocation """
+            previous = self.aid_to_memory[agent_id].pop(round_id, None)
+            if previous is not None:
+                memory_block.mem_clear(previous["address"], previous["size"])
+
+            address = memory_block.mem_alloc(size)
+            memory_block.mem_write(address, compressed_content)
+            self.aid_to_memory[agent_id][round_id] = {
+                "memory_block_id": memory_block_id,
+                "address": address,
+                "size": size,
+            }
+
+    def mem_view(self, agent_id, round_id):
+        """ compressed bytes of a round, as a view into the arena without a
+        copy. It is only valid until the round is written again or cleared """
+        location = self.aid_to_memory[agent_id][round_id]
+        return self.memory_blocks[location["memory_block_id"]].mem_read(
+            location["address"], location["size"]
+        )
 
     def mem_read(self, agent_id, round_id):
         """ read memory given agent id """
-        memory_block_id = self.aid_to_memory[agent_id][round_id]
-        data = self.memory_blocks[memory_block_id].mem_read(
-            self.aid_to_memory[agent_id][round_id]["address"],
-            self.aid_to_memory[agent_id][round_id]["size"]
-        )
-        return data
+        with self.lock:
+            if round_id not in self.aid_to_memory.get(agent_id, {}):
+                return None
+            return pickle.loads(zlib.decompress(self.mem_view(agent_id, round_id)))
 
     def mem_alloc(self, agent_id):
+        if not self.free_memory_blocks:
+            raise MemoryError("No free memory block left for the agent.")
         memory_block_id = heapq.heappop(self.free_memory_blocks)
-        self.aid_to_memory[agent_id] = {
-            "memory_block_id": memory_block_id
-        }
+        self.agent_blocks[agent_id] = memory_block_id
+        self.aid_to_memory[agent_id] = dict()
 
     def mem_clear(self, agent_id):
-        memory_block = self.aid_to_memory.pop(agent_id)
-        memory_block_id = memory_block['memory_block_id']
-        heapq.heappush(self.free_memory_blocks, memory_block_id)
+        with self.lock:
+            if agent_id not in self.agent_blocks:
+                return
+            memory_block_id = self.agent_blocks.pop(agent_id)
+            self.aid_to_memory.pop(agent_id)
+            self.memory_blocks[memory_block_id].reset()
+            heapq.heappush(self.free_memory_blocks, memory_block_id)
@@ -0,0 +1,215 @@
+# This implements admission control of LLM syscalls with token buckets. Each
+# limit allows a number of requests and tokens per minute, globally, per agent
+# and per model. The dispatcher holds back syscalls that are over the global or
+# agent budget until the buckets have refilled, and the LLM router waits for
+# the budget of the model it picked, so syscalls wait instead of failing with
+# the rate limit errors of the providers.
+
+from litellm import token_counter
+
+from threading import Lock
+
+import time
+
+class TokenBucket:
+    """
+    Bucket holding up to a minute's worth of capacity, refilled continuously.
+    Taking more than it holds leaves it in debt, which delays later takers,
+    so the average rate stays within the limit.
+    """
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now) -> float:
+        """Seconds until amount can be taken, 0 if it can be taken now."""
+        self.refill(now)
+        # a request larger than the whole bucket goes through once it is full
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount, now):
+        self.refill(now)
+        self.tokens -= amount
+
+class RateLimit:
+    """Requests per minute and tokens per minute, either of which may be None."""
+    def __init__(self, rpm: float | None = None, tpm: float | None = None):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+
+    def wait_time(self, tokens, now, requests=1) -> float:
+        wait = 0.0
+        if self.requests is not None and requests:
+            wait = max(wait, self.requests.wait_time(requests, now))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        return wait
+
+    def take(self, requests, tokens, now):
+        if self.requests is not None and requests:
+            self.requests.take(requests, now)
+        if self.tokens is not None and tokens:
+            self.tokens.take(tokens, now)
+
+class AdmissionController:
+    """
+    Token bucket rate limits of LLM syscalls.
+
+    Args:
+        global_limit (dict, optional) : {"rpm": ..., "tpm": ...} shared by
+                                        all syscalls.
+        agent_limit (dict, optional)  : Limit applied to each agent on its
+                                        own.
+        agent_limits (dict, optional) : Limits of particular agents by name,
+                                        overriding agent_limit.
+        model_limits (dict, optional) : Limits of the endpoints by model
+                                        name, e.g. {"gpt-4o": {"rpm": 500}}.
+
+    The prompt tokens of a syscall are counted with the tokenizer of the model
+    when litellm knows it, and the generated tokens are charged once the
+    response arrives.
+    """
+    def __init__(
+        self,
+        global_limit: dict | None = None,
+        agent_limit: dict | None = None,
+        agent_limits: dict[str, dict] | None = None,
+        model_limits: dict[str, dict] | None = None,
+    ):
+        self.global_limit = RateLimit(**global_limit) if global_limit else None
+        self.agent_limit = agent_limit
+        self.agent_overrides = agent_limits or {}
+        self.model_overrides = model_limits or {}
+        self.agent_buckets: dict[str, RateLimit] = {}
+        self.model_buckets: dict[str, RateLimit] = {}
+        self.lock = Lock()
+
+        self.admitted = 0
+        self.throttled = 0
+        self.throttled_agents: dict[str, int] = {}
+        self.wait_time_total = 0.0
+        self.model_waits = 0
+
+    def count_tokens(self, messages=None, text=None, model=None) -> int:
+        try:
+            return token_counter(model=model or "", messages=messages, text=text)
+        except Exception:
+            # unknown tokenizer, fall back to four characters per token
+            return len(text if text is not None else str(messages)) // 4
+
+    def prompt_tokens(self, syscall) -> int:
+        """Estimated tokens of the syscall's prompt. The estimate is kept on
+        the syscall, so that the dispatcher and the router count it once."""
+        if syscall.prompt_tokens is None:
+            syscall.prompt_tokens = self.count_tokens(messages=syscall.query.messages)
+        return syscall.prompt_tokens
+
+    def agent_bucket(self, agent_name) -> RateLimit | None:
+        """Return the buckets of the agent. Call with the lock held."""
+        limit = self.agent_overrides.get(agent_name, self.agent_limit)
+        if not limit:
+            return None
+        if agent_name not in self.agent_buckets:
+            self.agent_buckets[agent_name] = RateLimit(**limit)
+        return self.agent_buckets[agent_name]
+
+    def model_bucket(self, model_name) -> RateLimit | None:
+        """Return the buckets of the model. Call with the lock held."""
+        # litellm names carry a provider prefix, e.g. "openai/gpt-4o"
+        limit = self.model_overrides.get(model_name) \
+            or self.model_overrides.get(model_name.split("/", 1)[-1])
+        if not limit:
+            return None
+        if model_name not in self.model_buckets:
+            self.model_buckets[model_name] = RateLimit(**limit)
+        return self.model_buckets[model_name]
+
+    def admit(self, agent_name, tokens) -> tuple[float, str | None]:
+        """
+        Take the budget of a syscall with the given prompt tokens from the
+        global and agent buckets.
+
+        Returns:
+            tuple: 0 if the syscall was admitted, otherwise the seconds until
+                   it may be admitted, in which case nothing is taken. And
+                   "global" or "agent", the limit that held it back.
+        """
+        now = time.monotonic()
+        with self.lock:
+            agent_bucket = self.agent_bucket(agent_name)
+            if self.global_limit is not None:
+                wait = self.global_limit.wait_time(tokens, now)
+                if wait > 0:
+                    return wait, "global"
+            if agent_bucket is not None:
+                wait = agent_bucket.wait_time(tokens, now)
+                if wait > 0:
+                    return wait, "agent"
+
+            for bucket in (self.global_limit, agent_bucket):
+                if bucket is not None:
+                    bucket.take(1, tokens, now)
+            self.admitted += 1
+            return 0.0, None
+
+    def record_throttle(self, agent_name, waited):
+        """Count a syscall that was held back for waited seconds."""
+        with self.lock:
+            self.throttled += 1
+            self.throttled_agents[agent_name] = self.throttled_agents.get(agent_name, 0) + 1
+            self.wait_time_total += waited
+
+    def model_wait_time(self, model_name, tokens) -> float:
+        """Seconds until the model has budget for a request, without taking it."""
+        with self.lock:
+            bucket = self.model_bucket(model_name)
+            return 0.0 if bucket is None else bucket.wait_time(tokens, time.monotonic())
+
+    def acquire_model(self, model_name, tokens, requests=1) -> float:
+        """
+        Take the budget of requests with the given prompt tokens in total
+        from the model's buckets if it has it.
+
+        Returns:
+            float: 0 if it was taken, otherwise the seconds to wait before
+                   trying again.
+        """
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.model_bucket(model_name)
+            if bucket is None:
+                return 0.0
+            wait = bucket.wait_time(tokens, now, requests)
+            if wait > 0:
+                self.model_waits += 1
+                return wait
+            bucket.take(requests, tokens, now)
+            return 0.0
+
+    def charge(self, agent_name, model_name, tokens):
+        """Charge the tokens generated for a syscall to its buckets."""
+        now = time.monotonic()
+        with self.lock:
+            for bucket in (self.global_limit, self.agent_bucket(agent_name),
+                           self.model_bucket(model_name)):
+                if bucket is not None:
+                    bucket.take(0, tokens, now)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "admitted": self.admitted,
+                "throttled": self.throttled,
+                "throttled_agents": dict(self.throttled_agents),
+                "throttle_wait_time": self.wait_time_total,
+                "model_waits": self.model_waits,
+            }
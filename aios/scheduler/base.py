@@ -2,13 +2,20 @@ from aios.hooks.types.llm import LLMRequestQueueGetMessage
 from aios.hooks.types.memory import MemoryRequestQueueGetMessage
 from aios.hooks.types.tool import ToolRequestQueueGetMessage
 from aios.hooks.types.storage import StorageRequestQueueGetMessage
+from aios.hooks.stores import queue as QueueStore
 
 from aios.utils.logger import SchedulerLogger
 
+from .admission import AdmissionController
+
 from abc import ABC, abstractmethod
 
+from queue import Queue, Empty
 from threading import Thread
 
+import asyncio
+import time
+
 from aios.memory.manager import MemoryManager
 from aios.storage.storage import StorageManager
 from aios.llm_core.adapter import LLMAdapter
@@ -26,6 +33,11 @@ class Scheduler:
         get_memory_syscall: MemoryRequestQueueGetMessage,
         get_storage_syscall: StorageRequestQueueGetMessage,
         get_tool_syscall: ToolRequestQueueGetMessage,
+        max_workers: int | dict[str, int] = 1,
+        async_llm: bool = False,
+        llm_batch_window: float = 0.0,
+        llm_max_batch_size: int = 8,
+        rate_limits: dict | None = None,
     ):
         # self.agent_process_queue = Queue()
         self.get_llm_syscall = get_llm_syscall
@@ -35,26 +47,90 @@ class Scheduler:
         self.active = False  # start/stop the scheduler
         self.log_mode = log_mode
         self.logger = self.setup_logger()
-        self.request_processors = {
-            "llm_syscall_processor": Thread(target=self.run_llm_syscall),
-            "mem_syscall_processor": Thread(target=self.run_memory_syscall),
-            "sto_syscall_processor": Thread(target=self.run_storage_syscall),
-            "tool_syscall_processor": Thread(target=self.run_tool_syscall),
+
+        # The dispatcher watches every request queue and hands each syscall to
+        # the processor of its resource class through these queues.
+        self.syscall_getters = {
+            "llm": self.get_llm_syscall,
+            "memory": self.get_memory_syscall,
+            "storage": self.get_storage_syscall,
+            "tool": self.get_tool_syscall,
         }
-        self.llm = llm
+        self.dispatch_queues = {
+            kind: self.make_dispatch_queue(kind) for kind in self.syscall_getters
+        }
+        self.dispatcher = Thread(target=self.run_dispatcher)
+
+        # each resource class is served by a pool of processors that share
+        # its dispatch queue
+        self.max_workers = self.resolve_max_workers(max_workers)
+
+        # with async_llm, LLM syscalls run as tasks on one event loop thread
+        # instead, at most max_workers["llm"] of them at a time
+        self.async_llm = async_llm
+        if self.async_llm:
+            self.llm_loop = asyncio.new_event_loop()
+            self.async_llm_queue = asyncio.Queue()
+
+        # an LLM processor that takes a syscall waits up to llm_batch_window
+        # seconds for more, and addresses them together on backends that
+        # generate in batches. A window of 0 turns batching off.
+        self.llm_batch_window = llm_batch_window
+        self.llm_max_batch_size = max(1, llm_max_batch_size)
+
+        # LLM syscalls over the rate limits are held back by the dispatcher,
+        # as (syscall, held since, prompt tokens), until their budget refills
+        self.admission = AdmissionController(**rate_limits) if rate_limits else None
+        self.throttled = []
+        self.throttle_retry_at = None
+
+        processors = {
+            "llm": ("llm_syscall_processor", self.run_llm_syscall),
+            "memory": ("mem_syscall_processor", self.run_memory_syscall),
+            "storage": ("sto_syscall_processor", self.run_storage_syscall),
+            "tool": ("tool_syscall_processor", self.run_tool_syscall),
+        }
+        if self.async_llm:
+            processors["llm"] = ("llm_event_loop", self.run_llm_event_loop)
+
+        self.request_processors = {}
+        for kind, (name, target) in processors.items():
+            for idx in range(self.processor_count(kind)):
+                self.request_processors[f"{name}_{idx}"] = Thread(target=target)
+
+        self.attach_llm(llm)
         self.memory_manager = memory_manager
         self.storage_manager = storage_manager
         self.tool_manager = tool_manager
 
+    def attach_llm(self, llm):
+        """Address the LLM syscalls with llm from now on, set up with the
+        scheduler's rate limits and number of LLM processors."""
+        # the router waits for the per-model limits of the endpoint it picks
+        llm.admission = self.admission
+        # hedged requests must not queue behind each other's threads
+        llm.size_hedge_pool(self.max_workers["llm"])
+        self.llm = llm
+
     def start(self):
         """start the scheduler"""
         self.active = True
         for name, thread_value in self.request_processors.items():
             thread_value.start()
+        self.dispatcher.start()
 
     def stop(self):
         """stop the scheduler"""
-        self.active = False
+        with QueueStore.REQUEST_SIGNAL:
+            self.active = False
+            QueueStore.REQUEST_SIGNAL.notify_all()
+        self.dispatcher.join()
+
+        # syscalls that were already dispatched are still run before the
+        # processors reach the stop signal, one signal for each processor
+        for kind in self.dispatch_queues:
+            for _ in range(self.processor_count(kind)):
+                self.dispatch_syscall(kind, QueueStore.STOP_SIGNAL)
         for name, thread_value in self.request_processors.items():
             thread_value.join()
 
@@ -62,10 +138,214 @@ class Scheduler:
         logger = SchedulerLogger("Scheduler", self.log_mode)
         return logger
 
+    def resolve_max_workers(self, max_workers):
+        """Number of processors to run for each resource class.
+
+        An int sizes the LLM pool, a dict sizes the classes it names. Classes
+        that are not given keep a single processor, since the memory, storage
+        and tool managers are not safe to call from several threads.
+        """
+        if isinstance(max_workers, int):
+            max_workers = {"llm": max_workers}
+
+        resolved = {}
+        for kind in self.syscall_getters:
+            resolved[kind] = max(1, int(max_workers.get(kind, 1)))
+        return resolved
+
+    def make_dispatch_queue(self, kind) -> Queue:
+        """Queue that holds dispatched syscalls until a processor is free.
+
+        Subclasses override this to change the order syscalls are run in.
+        """
+        return Queue()
+
+    def processor_count(self, kind):
+        if kind == "llm" and self.async_llm:
+            return 1
+        return self.max_workers[kind]
+
+    def collect_syscalls(self):
+        """Drain every request queue without blocking.
+
+        Returns:
+            list: (resource kind, syscall) pairs in the order they were taken.
+        """
+        syscalls = []
+        for kind, get_syscall in self.syscall_getters.items():
+            while True:
+                try:
+                    syscalls.append((kind, get_syscall(block=False)))
+                except Empty:
+                    break
+        return syscalls
+
+    def run_dispatcher(self):
+        """Wait for syscalls on all request queues and dispatch them.
+
+        The dispatcher sleeps on the shared request signal and is only woken
+        when a syscall is added to one of the queues or the scheduler stops.
+        """
+        while True:
+            with QueueStore.REQUEST_SIGNAL:
+                syscalls = self.collect_syscalls()
+                while not syscalls and self.active:
+                    # wake up when held back syscalls may be admitted
+                    timeout = None if self.throttle_retry_at is None \
+                        else self.throttle_retry_at - time.monotonic()
+                    if timeout is not None and timeout <= 0:
+                        break
+                    QueueStore.REQUEST_SIGNAL.wait(timeout)
+                    syscalls = self.collect_syscalls()
+
+            for kind, syscall in self.admit_syscalls(syscalls):
+                self.dispatch_syscall(kind, syscall)
+
+            if not self.active:
+                break
+
+        # syscalls still held back are run rather than left waiting
+        for llm_syscall, _, _ in self.throttled:
+            self.dispatch_syscall("llm", llm_syscall)
+        self.throttled = []
+
+    def admit_syscalls(self, syscalls):
+        """Pass the LLM syscalls through admission control.
+
+        Syscalls over budget are held back and retried, in order, on the next
+        round. Once a syscall of an agent is held back, so are the later ones
+        of that agent, and once the global limit is reached, all later ones.
+
+        Returns:
+            list: (resource kind, syscall) pairs that may be dispatched now.
+        """
+        if self.admission is None:
+            return syscalls
+
+        now = time.monotonic()
+        pending = self.throttled + [
+            (syscall, None, self.admission.prompt_tokens(syscall))
+            for kind, syscall in syscalls if kind == "llm"
+        ]
+        admitted = [(kind, syscall) for kind, syscall in syscalls if kind != "llm"]
+
+        self.throttled = []
+        self.throttle_retry_at = None
+        held_agents = set()
+        held_all = False
+        for llm_syscall, held_since, tokens in pending:
+            agent_name = llm_syscall.agent_name
+            if held_all or agent_name in held_agents:
+                self.throttled.append((llm_syscall, held_since or now, tokens))
+                continue
+
+            wait, scope = self.admission.admit(agent_name, tokens)
+            if wait > 0:
+                self.throttled.append((llm_syscall, held_since or now, tokens))
+                held_agents.add(agent_name)
+                held_all = scope == "global"
+                retry_at = now + wait
+                if self.throttle_retry_at is None or retry_at < self.throttle_retry_at:
+                    self.throttle_retry_at = retry_at
+                continue
+
+            if held_since is not None:
+                self.admission.record_throttle(agent_name, now - held_since)
+            admitted.append(("llm", llm_syscall))
+
+        return admitted
+
+    def get_metrics(self) -> dict:
+        """Queue depths and admission counters of the scheduler, and the
+        load and run times of the tools."""
+        queue_depth = {
+            kind: queue.qsize() for kind, queue in self.dispatch_queues.items()
+        }
+        if self.async_llm:
+            queue_depth["llm"] = self.async_llm_queue.qsize()
+
+        metrics = {
+            "queue_depth": queue_depth,
+            "throttled": len(self.throttled),
+        }
+        if self.admission is not None:
+            metrics["admission"] = self.admission.stats()
+        if self.tool_manager is not None:
+            metrics.update(self.tool_manager.get_metrics())
+        return metrics
+
+    def dispatch_syscall(self, kind, syscall):
+        if kind == "llm" and self.async_llm:
+            QueueStore.addAsyncMessage(self.async_llm_queue, syscall, self.llm_loop)
+            return
+
+        self.dispatch_queues[kind].put(syscall)
+
+    def get_dispatched_syscall(self, kind):
+        """Block until the dispatcher hands over a syscall of the given kind.
+
+        Returns QueueStore.STOP_SIGNAL once the scheduler is stopping.
+        """
+        return self.dispatch_queues[kind].get()
+
+    def get_dispatched_batch(self, kind, first_syscall, window, max_size):
+        """Collect the syscalls dispatched within window seconds of the first.
+
+        Returns:
+            tuple: the batch, starting with first_syscall, and whether the stop
+                   signal was taken from the queue while collecting it.
+        """
+        batch = [first_syscall]
+        deadline = time.monotonic() + window
+        while len(batch) < max_size:
+            try:
+                syscall = self.dispatch_queues[kind].get(
+                    timeout=max(0.0, deadline - time.monotonic())
+                )
+            except Empty:
+                break
+
+            if syscall is QueueStore.STOP_SIGNAL:
+                return batch, True
+            batch.append(syscall)
+
+        return batch, False
+
+    def run_llm_event_loop(self):
+        asyncio.set_event_loop(self.llm_loop)
+        try:
+            self.llm_loop.run_until_complete(self.run_llm_syscall_async())
+        finally:
+            self.llm_loop.close()
+
+    async def run_llm_syscall_async(self):
+        """Address LLM syscalls concurrently on the scheduler's event loop."""
+        limit = asyncio.Semaphore(self.max_workers["llm"])
+        tasks = set()
+
+        while True:
+            llm_syscall = await QueueStore.getAsyncMessage(self.async_llm_queue)
+            if llm_syscall is QueueStore.STOP_SIGNAL:
+                break
+
+            await limit.acquire()
+            task = asyncio.create_task(self.address_llm_syscall_async(llm_syscall))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            task.add_done_callback(lambda _: limit.release())
+
+        # let syscalls that are in flight finish before the loop closes
+        if tasks:
+            await asyncio.gather(*tasks)
+
     @abstractmethod
     def run_llm_syscall(self):
         pass
 
+    @abstractmethod
+    async def address_llm_syscall_async(self, llm_syscall):
+        pass
+
     @abstractmethod
     def run_memory_syscall(self):
         pass
@@ -1,6 +1,6 @@
 # This implements a (mostly) FIFO task queue using threads and queue, in a
-# similar fashion to the round robin scheduler. However, the timeout is 1 second
-# instead of 0.05 seconds.
+# similar fashion to the round robin scheduler. Each processor blocks until the
+# dispatcher hands it a syscall, and exits when it receives the stop signal.
 
 from aios.hooks.types.llm import LLMRequestQueueGetMessage
 from aios.hooks.types.memory import MemoryRequestQueueGetMessage
@@ -12,9 +12,9 @@ from aios.storage.storage import StorageManager
 from aios.llm_core.adapter import LLMAdapter
 from aios.tool.manager import ToolManager
 
-from .base import Scheduler
+from aios.hooks.stores import queue as QueueStore
 
-from queue import Empty
+from .base import Scheduler
 
 import traceback
 import time
@@ -31,6 +31,11 @@ class FIFOScheduler(Scheduler):
         get_memory_syscall: MemoryRequestQueueGetMessage,
         get_storage_syscall: StorageRequestQueueGetMessage,
         get_tool_syscall: ToolRequestQueueGetMessage,
+        max_workers: int | dict[str, int] = 1,
+        async_llm: bool = False,
+        llm_batch_window: float = 0.0,
+        llm_max_batch_size: int = 8,
+        rate_limits: dict | None = None,
     ):
         super().__init__(
             llm,
@@ -42,14 +47,29 @@ class FIFOScheduler(Scheduler):
             get_memory_syscall,
             get_storage_syscall,
             get_tool_syscall,
+            max_workers,
+            async_llm,
+            llm_batch_window,
+            llm_max_batch_size,
+            rate_limits,
         )
 
     def run_llm_syscall(self):
-        while self.active:
-            try:
-                # wait at a fixed time interval, if there is nothing received in the time interval, it will raise Empty
-                llm_syscall = self.get_llm_syscall()
+        while True:
+            llm_syscall = self.get_dispatched_syscall("llm")
+            if llm_syscall is QueueStore.STOP_SIGNAL:
+                break
+
+            if self.llm_batch_window > 0 and self.llm.supports_batching():
+                batch, stopping = self.get_dispatched_batch(
+                    "llm", llm_syscall, self.llm_batch_window, self.llm_max_batch_size
+                )
+                self.address_llm_batch(batch)
+                if stopping:
+                    break
+                continue
 
+            try:
                 llm_syscall.set_status("executing")
                 self.logger.log(
                     f"{llm_syscall.agent_name} is executing. \n", "execute"
@@ -57,24 +77,57 @@ class FIFOScheduler(Scheduler):
                 llm_syscall.set_start_time(time.time())
 
                 response = self.llm.address_syscall(llm_syscall)
-                llm_syscall.set_response(response)
+                llm_syscall.set_result(response)
 
-                llm_syscall.event.set()
-                llm_syscall.set_status("done")
-                llm_syscall.set_end_time(time.time())
-
-            except Empty:
-                pass
-
-            except Exception:
+            except Exception as e:
                 traceback.print_exc()
+                llm_syscall.set_exception(e)
+
+    def address_llm_batch(self, llm_syscalls):
+        for llm_syscall in llm_syscalls:
+            llm_syscall.set_status("executing")
+            self.logger.log(
+                f"{llm_syscall.agent_name} is executing. \n", "execute"
+            )
+            llm_syscall.set_start_time(time.time())
+
+        try:
+            responses = self.llm.address_syscall_batch(llm_syscalls)
+
+        except Exception as e:
+            traceback.print_exc()
+            for llm_syscall in llm_syscalls:
+                llm_syscall.set_exception(e)
+            return
+
+        for llm_syscall, response in zip(llm_syscalls, responses):
+            if isinstance(response, Exception):
+                llm_syscall.set_exception(response)
+            else:
+                llm_syscall.set_result(response)
+
+    async def address_llm_syscall_async(self, llm_syscall):
+        try:
+            llm_syscall.set_status("executing")
+            self.logger.log(
+                f"{llm_syscall.agent_name} is executing. \n", "execute"
+            )
+            llm_syscall.set_start_time(time.time())
+
+            response = await self.llm.address_syscall_async(llm_syscall)
+            llm_syscall.set_result(response)
+
+        except Exception as e:
+            traceback.print_exc()
+            llm_syscall.set_exception(e)
 
     def run_memory_syscall(self):
-        while self.active:
-            try:
-                # wait at a fixed time interval, if there is nothing received in the time interval, it will raise Empty
-                memory_syscall = self.get_memory_syscall()
+        while True:
+            memory_syscall = self.get_dispatched_syscall("memory")
+            if memory_syscall is QueueStore.STOP_SIGNAL:
+                break
 
+            try:
                 memory_syscall.set_status("executing")
                 self.logger.log(
                     f"{memory_syscall.agent_name} is executing. \n", "execute"
@@ -82,23 +135,19 @@ class FIFOScheduler(Scheduler):
                 memory_syscall.set_start_time(time.time())
 
                 response = self.memory_manager.address_request(memory_syscall)
-                memory_syscall.set_response(response)
-
-                memory_syscall.event.set()
-                memory_syscall.set_status("done")
-                memory_syscall.set_end_time(time.time())
+                memory_syscall.set_result(response)
 
-            except Empty:
-                pass
-
-            except Exception:
+            except Exception as e:
                 traceback.print_exc()
+                memory_syscall.set_exception(e)
 
     def run_storage_syscall(self):
-        while self.active:
-            try:
-                storage_syscall = self.get_storage_syscall()
+        while True:
+            storage_syscall = self.get_dispatched_syscall("storage")
+            if storage_syscall is QueueStore.STOP_SIGNAL:
+                break
 
+            try:
                 storage_syscall.set_status("executing")
                 self.logger.log(
                     f"{storage_syscall.agent_name} is executing. \n", "execute"
@@ -106,41 +155,31 @@ class FIFOScheduler(Scheduler):
                 storage_syscall.set_start_time(time.time())
 
                 response = self.storage_manager.address_request(storage_syscall)
-                storage_syscall.set_response(response)
-
-                storage_syscall.event.set()
-                storage_syscall.set_status("done")
-                storage_syscall.set_end_time(time.time())
+                storage_syscall.set_result(response)
 
                 self.logger.log(
-                    f"Current request of {storage_syscall.agent_name} is done. Thread ID is {storage_syscall.get_pid()}\n",
+                    f"Current request of {storage_syscall.agent_name} is done. Syscall ID is {storage_syscall.get_pid()}\n",
                     "done"
                 )
 
-            except Empty:
-                pass
-
-            except Exception:
+            except Exception as e:
                 traceback.print_exc()
+                storage_syscall.set_exception(e)
 
     def run_tool_syscall(self):
-        while self.active:
-            try:
-                tool_syscall = self.get_tool_syscall()
+        while True:
+            tool_syscall = self.get_dispatched_syscall("tool")
+            if tool_syscall is QueueStore.STOP_SIGNAL:
+                break
 
+            try:
                 tool_syscall.set_status("executing")
 
                 tool_syscall.set_start_time(time.time())
 
                 response = self.tool_manager.address_request(tool_syscall)
-                tool_syscall.set_response(response)
-
-                tool_syscall.event.set()
-                tool_syscall.set_status("done")
-                tool_syscall.set_end_time(time.time())
-
-            except Empty:
-                pass
+                tool_syscall.set_result(response)
 
-            except Exception:
+            except Exception as e:
                 traceback.print_exc()
+                tool_syscall.set_exception(e)
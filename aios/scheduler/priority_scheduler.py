@@ -0,0 +1,122 @@
+# This implements a priority and deadline aware scheduler. Syscalls are run in
+# the same way as in the FIFO scheduler, but each dispatch queue is a heap
+# ordered by deadline, so urgent syscalls overtake the ones already waiting.
+#
+# A syscall with a time limit has the deadline created_time + time_limit.
+# Every other syscall gets the virtual deadline
+# created_time + priority * aging_interval, where a lower priority value is
+# more urgent and 0 is the default. As the key is fixed when the syscall is
+# queued, a waiting syscall is only overtaken by syscalls with an earlier
+# deadline, so it ages towards the head of the queue and never starves.
+
+from aios.hooks.types.llm import LLMRequestQueueGetMessage
+from aios.hooks.types.memory import MemoryRequestQueueGetMessage
+from aios.hooks.types.tool import ToolRequestQueueGetMessage
+from aios.hooks.types.storage import StorageRequestQueueGetMessage
+
+from aios.memory.manager import MemoryManager
+from aios.storage.storage import StorageManager
+from aios.llm_core.adapter import LLMAdapter
+from aios.tool.manager import ToolManager
+
+from aios.hooks.stores import queue as QueueStore
+
+from .fifo_scheduler import FIFOScheduler
+
+from itertools import count
+from queue import PriorityQueue
+
+import heapq
+import math
+import time
+
+class SyscallPriorityQueue(PriorityQueue):
+    """
+    PriorityQueue of syscalls ordered by a key function. Ties are broken by
+    arrival order and the stop signal is always placed last, so dispatched
+    syscalls are still run when the scheduler stops.
+    """
+    def __init__(self, key):
+        super().__init__()
+        self.key = key
+        self.counter = count()
+
+    def _put(self, syscall):
+        key = math.inf if syscall is QueueStore.STOP_SIGNAL else self.key(syscall)
+        heapq.heappush(self.queue, (key, next(self.counter), syscall))
+
+    def _get(self):
+        return heapq.heappop(self.queue)[-1]
+
+class PriorityScheduler(FIFOScheduler):
+    """
+    Scheduler that runs the syscall with the earliest (virtual) deadline first.
+
+    Args:
+        agent_priorities (dict, optional) : Priority of each agent by name,
+                                            used for syscalls that do not set
+                                            their own priority.
+        aging_interval (float, optional)  : Seconds of waiting that make up
+                                            for one level of priority.
+                                            Defaults to 1.0.
+
+    With async_llm, LLM syscalls are started as soon as they arrive, so the
+    ordering only applies while they wait for a processor thread.
+    """
+    def __init__(
+        self,
+        llm: LLMAdapter,
+        memory_manager: MemoryManager,
+        storage_manager: StorageManager,
+        tool_manager: ToolManager,
+        log_mode,
+        get_llm_syscall: LLMRequestQueueGetMessage,
+        get_memory_syscall: MemoryRequestQueueGetMessage,
+        get_storage_syscall: StorageRequestQueueGetMessage,
+        get_tool_syscall: ToolRequestQueueGetMessage,
+        max_workers: int | dict[str, int] = 1,
+        async_llm: bool = False,
+        llm_batch_window: float = 0.0,
+        llm_max_batch_size: int = 8,
+        rate_limits: dict | None = None,
+        agent_priorities: dict[str, int] | None = None,
+        aging_interval: float = 1.0,
+    ):
+        self.agent_priorities = agent_priorities or {}
+        self.aging_interval = aging_interval
+        super().__init__(
+            llm,
+            memory_manager,
+            storage_manager,
+            tool_manager,
+            log_mode,
+            get_llm_syscall,
+            get_memory_syscall,
+            get_storage_syscall,
+            get_tool_syscall,
+            max_workers,
+            async_llm,
+            llm_batch_window,
+            llm_max_batch_size,
+            rate_limits,
+        )
+
+    def make_dispatch_queue(self, kind):
+        return SyscallPriorityQueue(key=self.syscall_deadline)
+
+    def syscall_priority(self, syscall):
+        priority = syscall.get_priority()
+        if priority is None:
+            priority = self.agent_priorities.get(syscall.agent_name, 0)
+        return priority
+
+    def syscall_deadline(self, syscall):
+        created_time = syscall.get_created_time()
+        if created_time is None:
+            created_time = time.time()
+
+        time_limit = syscall.get_time_limit()
+        if time_limit is not None:
+            return created_time + time_limit
+
+        return created_time + self.syscall_priority(syscall) * self.aging_interval
@@ -1,45 +1,69 @@
 # Implementing a round robin scheduler using threads
 # Allows multiple agents to run at the same time, with each getting a fixed
 # chunk of processor time
+#
+# An LLM syscall generates for at most time_limit seconds. If it has not
+# finished by then, its partial output is saved to the context manager and the
+# syscall goes to the back of the LLM dispatch queue. The next time it runs,
+# the saved output is restored and generation continues from there. Memory,
+# storage and tool syscalls run to completion as in the FIFO scheduler.
 
-from .base import BaseScheduler
-
+from aios.hooks.types.llm import LLMRequestQueueGetMessage
+from aios.hooks.types.memory import MemoryRequestQueueGetMessage
+from aios.hooks.types.tool import ToolRequestQueueGetMessage
+from aios.hooks.types.storage import StorageRequestQueueGetMessage
 
-# allows for memory to be shared safely between threads
-from queue import Queue, Empty
+from aios.memory.manager import MemoryManager
+from aios.storage.storage import StorageManager
+from aios.llm_core.adapter import LLMAdapter
+from aios.tool.manager import ToolManager
 
+from aios.hooks.stores import queue as QueueStore
 
 from ..context.simple_context import SimpleContextManager
 
-from aios.hooks.types.llm import LLMRequestQueueGetMessage
-from aios.hooks.types.memory import MemoryRequestQueueGetMessage
-from aios.hooks.types.tool import ToolRequestQueueGetMessage
-from aios.hooks.types.storage import StorageRequestQueueGetMessage
+from .fifo_scheduler import FIFOScheduler
 
-from queue import Queue, Empty
+from threading import Lock
 
 import traceback
 import time
-from aios.utils.logger import SchedulerLogger
-
-from threading import Thread
 
-from .base import Scheduler
+class RRScheduler(FIFOScheduler):
+    """
+    Scheduler that shares the LLM between syscalls in time slices.
 
+    Args:
+        time_limit (float, optional) : Seconds an LLM syscall may generate for
+                                       before it is preempted. Defaults to 0.5.
 
-class RRScheduler(Scheduler):
+    Preemption stops a streamed generation partway, so it applies to litellm
+    endpoints and to Ollama, vLLM and HF backends served by a server. Models
+    loaded into the kernel process run to completion. Each of the max_workers
+    LLM processors runs its own syscall in time slices, and syscalls are not
+    batched, so llm_batch_window has no effect.
+    """
     def __init__(
         self,
-        llm,
-        memory_manager,
-        storage_manager,
-        tool_manager,
+        llm: LLMAdapter,
+        memory_manager: MemoryManager,
+        storage_manager: StorageManager,
+        tool_manager: ToolManager,
         log_mode,
         get_llm_syscall: LLMRequestQueueGetMessage,
         get_memory_syscall: MemoryRequestQueueGetMessage,
         get_storage_syscall: StorageRequestQueueGetMessage,
         get_tool_syscall: ToolRequestQueueGetMessage,
+        max_workers: int | dict[str, int] = 1,
+        async_llm: bool = False,
+        llm_batch_window: float = 0.0,
+        llm_max_batch_size: int = 8,
+        rate_limits: dict | None = None,
+        time_limit: float = 0.5,
     ):
+        if async_llm:
+            raise ValueError("The round robin scheduler does not support async_llm")
+
         super().__init__(
             llm,
             memory_manager,
@@ -50,138 +74,68 @@ class RRScheduler(Scheduler):
             get_memory_syscall,
             get_storage_syscall,
             get_tool_syscall,
+            max_workers,
+            async_llm,
+            llm_batch_window,
+            llm_max_batch_size,
+            rate_limits,
         )
-        self.llm = llm
-        self.time_limit = 0.5
-        self.simple_context_manager = SimpleContextManager()
+        self.time_limit = time_limit
+        # held while requeueing, so that no syscall is put behind the stop
+        # signals of the LLM processors
+        self.requeue_lock = Lock()
+
+        if self.llm is not None and self.llm.context_manager is None:
+            self.llm.context_manager = SimpleContextManager()
+
+    def stop(self):
+        """stop the scheduler"""
+        with self.requeue_lock:
+            self.active = False
+        super().stop()
+
+    def run_llm_syscall(self):
+        while True:
+            llm_syscall = self.get_dispatched_syscall("llm")
+            if llm_syscall is QueueStore.STOP_SIGNAL:
+                break
 
-    def run_llm_request(self):
-        while self.active:
             try:
-                llm_syscall = self.get_llm_request()
-
                 llm_syscall.set_status("executing")
                 self.logger.log(
                     f"{llm_syscall.agent_name} is executing. \n", "execute"
                 )
-                llm_syscall.set_start_time(time.time())
-
-                response = self.llm.address_request(llm_syscall)
-                llm_syscall.set_response(response)
-
-                # self.llm.address_request(agent_request)
-
-                llm_syscall.event.set()
-                llm_syscall.set_status("done")
-                llm_syscall.set_end_time(time.time())
-
-                self.logger.log(
-                    f"Current request of {llm_syscall.agent_name} is done. Thread ID is {llm_syscall.get_pid()}\n",
-                    "done",
-                )
-                # wait at a fixed time interval, if there is nothing received in the time interval, it will raise Empty
-
-            except Empty:
-                pass
-
-            except Exception:
-                traceback.print_exc()
-
-    def run_memory_request(self):
-        while self.active:
-            try:
-                # wait at a fixed time interval, if there is nothing received in the time interval, it will raise Empty
-                agent_request = self.get_memory_request()
-
-                agent_request.set_status("executing")
-                self.logger.log(
-                    f"{agent_request.agent_name} is executing. \n", "execute"
-                )
-                agent_request.set_start_time(time.time())
+                if llm_syscall.get_start_time() is None:
+                    llm_syscall.set_start_time(time.time())
 
-                response = self.memory_manager.address_request(agent_request)
-                agent_request.set_response(response)
+                # once the scheduler is stopping, a syscall can no longer be
+                # requeued and runs to completion instead
+                with self.requeue_lock:
+                    time_limit = self.time_limit if self.active else None
 
-                # self.llm.address_request(agent_request)
-
-                agent_request.event.set()
-                agent_request.set_status("done")
-                agent_request.set_end_time(time.time())
-
-                self.logger.log(
-                    f"Current request of {agent_request.agent_name} is done. Thread ID is {agent_request.get_pid()}\n",
-                    "done",
-                )
-                # wait at a fixed time interval, if there is nothing received in the time interval, it will raise Empty
-
-            except Empty:
-                pass
-
-            except Exception:
-                traceback.print_exc()
-
-    def run_storage_request(self):
-        while self.active:
-            try:
-                # wait at a fixed time interval, if there is nothing received in the time interval, it will raise Empty
-                agent_request = self.get_memory_request()
-
-                agent_request.set_status("executing")
-                self.logger.log(
-                    f"{agent_request.agent_name} is executing. \n", "execute"
-                )
-                agent_request.set_start_time(time.time())
-
-                response = self.storage_manager.address_request(agent_request)
-                agent_request.set_response(response)
-
-                # self.llm.address_request(agent_request)
-
-                agent_request.event.set()
-                agent_request.set_status("done")
-                agent_request.set_end_time(time.time())
-
-                self.logger.log(
-                    f"Current request of {agent_request.agent_name} is done. Thread ID is {agent_request.get_pid()}\n",
-                    "done",
+                response = self.llm.address_syscall(
+                    llm_syscall, time_limit=time_limit
                 )
-                # wait at a fixed time interval, if there is nothing received in the time interval, it will raise Empty
 
-            except Empty:
-                pass
+                if response.finished:
+                    llm_syscall.set_result(response)
+                    continue
 
-            except Exception:
-                traceback.print_exc()
-
-    def run_tool_request(self):
-        while self.active:
-            try:
-                # wait at a fixed time interval, if there is nothing received in the time interval, it will raise Empty
-                agent_request = self.get_memory_request()
-
-                agent_request.set_status("executing")
+                llm_syscall.set_status("suspending")
                 self.logger.log(
-                    f"{agent_request.agent_name} is executing. \n", "execute"
+                    f"{llm_syscall.agent_name} is switched to suspending due to the reach of time limit ({self.time_limit}s). \n",
+                    "suspend",
                 )
-                agent_request.set_start_time(time.time())
-
-                response = self.tool_manager.address_request(agent_request)
-                agent_request.set_response(response)
-
-                # self.llm.address_request(agent_request)
 
-                agent_request.event.set()
-                agent_request.set_status("done")
-                agent_request.set_end_time(time.time())
-
-                self.logger.log(
-                    f"Current request of {agent_request.agent_name} is done. Thread ID is {agent_request.get_pid()}\n",
-                    "done",
-                )
-                # wait at a fixed time interval, if there is nothing received in the time interval, it will raise Empty
+                with self.requeue_lock:
+                    requeue = self.active
+                    if requeue:
+                        self.dispatch_syscall("llm", llm_syscall)
 
-            except Empty:
-                pass
+                if not requeue:
+                    response = self.llm.address_syscall(llm_syscall)
+                    llm_syscall.set_result(response)
 
-            except Exception:
+            except Exception as e:
                 traceback.print_exc()
+                llm_syscall.set_exception(e)
@@ -1,17 +1,48 @@
 import os
 
-import pickle
-
-import zlib
-
 from .storage_classes.db_storage import ChromaDB
+from .storage_classes.record_file import RecordFile
+
+from threading import Lock
 
 class StorageManager:
-    def __init__(self, root_dir, use_vector_db=False):
+    """
+    Storage of the agents, one record file per agent under root_dir.
+
+    Each write appends a record, stored under its round id rid when one is
+    given. Reads of a round seek straight to its latest record through the
+    index of the file, and a read without a round id returns the latest
+    record written without one. Files are compacted once replaced and
+    cleared records take compaction_ratio of them.
+
+    With use_vector_db, the files under the mount_dir of vector_db_config,
+    by default vector_db under root_dir, are indexed when the manager is set
+    up, and kept in sync from then on if its watch is set. The rest of
+    vector_db_config is passed on to ChromaDB.
+    """
+    def __init__(self,
+                 root_dir,
+                 use_vector_db=False,
+                 compaction_ratio=0.5,
+                 min_compaction_size=1024 * 1024,
+                 vector_db_config=None):
         self.root_dir = root_dir
+        self.use_vector_db = use_vector_db
+        self.compaction_ratio = compaction_ratio
+        self.min_compaction_size = min_compaction_size
+        self.files = dict()
+        self.lock = Lock()
         os.makedirs(self.root_dir, exist_ok=True)
         if use_vector_db:
-            self.vector_db = ChromaDB()
+            config = dict(vector_db_config or {})
+            mount_dir = config.pop("mount_dir", os.path.join(self.root_dir, "vector_db"))
+            watch = config.pop("watch", False)
+            poll_interval = config.pop("poll_interval", 2.0)
+            os.makedirs(mount_dir, exist_ok=True)
+            self.vector_db = ChromaDB(mount_dir, **config)
+            self.vector_db.build_database()
+            if watch:
+                self.vector_db.watch(poll_interval=poll_interval)
 
     def address_request(self, agent_request):
         operation_type = agent_request.operation_type
@@ -29,56 +60,97 @@ class StorageManager:
             )
 
     def sto_create(self, aname, aid=None, rid=None):
-        file_path = os.path.join(
-            self.storage_path, f"{aid}_{rid}.dat" if aid and rid else f"{aname}.dat"
-        )
-
-        if not os.path.exists(file_path):
-            with open(file_path, "wb") as file:
-                file.write(b"")
+        self.open_file(aname)
         if self.use_vector_db:
-            self.vector_db.create_collection(f"{aid}_{rid}" if aid and rid else aname)
+            self.vector_db.add_collection(aname)
 
     def sto_read(self, aname, aid=None, rid=None):
-        file_path = os.path.join(
-            self.storage_path, f"{aid}_{rid}.dat" if aid and rid else f"{aname}.dat"
-        )
-
-        if os.path.exists(file_path):
-            with open(file_path, "rb") as file:
-                compressed_data = file.read()
-                return (
-                    pickle.loads(zlib.decompress(compressed_data))
-                    if compressed_data
-                    else None
-                )
-        return None
+        record_file = self.open_file(aname, create=False)
+        if record_file is None:
+            return None
+        return record_file.read(rid)
+
+    def sto_iter(self, aname):
+        """Yields (rid, value) of the agent's records in the order they were written"""
+        record_file = self.open_file(aname, create=False)
+        if record_file is None:
+            return
+        yield from record_file.iterate()
 
     def sto_write(self, aname, s, aid=None, rid=None):
-        """Writes compressed data to a storage file and adds it to the vector database"""
-        file_path = os.path.join(
-            self.storage_path, f"{aid}_{rid}.dat" if aid and rid else f"{aname}.dat"
-        )
-
-        with open(file_path, "ab") as file:
-            compressed_data = zlib.compress(pickle.dumps(s))
-            file.write(compressed_data)
+        """Appends a record to the storage file and adds it to the vector database"""
+        self.open_file(aname).append(s, rid)
         if self.use_vector_db:
-            self.vector_db.add(f"{aid}_{rid}" if aid and rid else aname, s)
+            self.vector_db.add_documents(
+                aname, [str(s)], ids=[str(rid)] if rid is not None else None
+            )
 
     def sto_clear(self, aname, aid=None, rid=None):
-        file_path = os.path.join(
-            self.storage_path, f"{aid}_{rid}.dat" if aid and rid else f"{aname}.dat"
-        )
-
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        """Clears a round of the agent, or all of its storage if rid is None"""
+        if rid is not None:
+            record_file = self.open_file(aname, create=False)
+            if record_file is not None:
+                record_file.clear(rid)
+        else:
+            with self.lock:
+                record_file = self.files.pop(aname, None)
+                if record_file is not None:
+                    record_file.close()
+                path = self.file_path(aname)
+                for extension in (".dat", ".idx"):
+                    if os.path.exists(path + extension):
+                        os.remove(path + extension)
         if self.use_vector_db:
-            self.vector_db.delete(f"{aid}_{rid}" if aid and rid else aname)
+            if rid is not None:
+                self.vector_db.delete_documents(aname, [str(rid)])
+            else:
+                self.vector_db.delete_collection(aname)
 
-    def sto_retrieve(self, aname, query, aid=None, rid=None):
+    def sto_retrieve(self, aname, query, aid=None, rid=None, k=5):
+        """Returns the k records of the agent closest to the query, or to each
+        query if given a list of them, with their scores"""
         if self.use_vector_db:
-            return self.vector_db.retrieve(
-                f"{aid}_{rid}" if aid and rid else aname, query
-            )
+            return self.vector_db.retrieve(aname, k, query)
         return None
+
+    def sto_compact(self, aname=None):
+        """Compacts the file of the agent, or of every open agent if aname is None"""
+        if aname is not None:
+            record_file = self.open_file(aname, create=False)
+            record_files = [record_file] if record_file is not None else []
+        else:
+            with self.lock:
+                record_files = list(self.files.values())
+        for record_file in record_files:
+            record_file.compact()
+
+    def file_path(self, aname):
+        return os.path.join(self.root_dir, aname)
+
+    def open_file(self, aname, create=True):
+        with self.lock:
+            if aname not in self.files:
+                path = self.file_path(aname)
+                if not create and not os.path.exists(path + ".dat"):
+                    return None
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self.files[aname] = RecordFile(
+                    path,
+                    compaction_ratio=self.compaction_ratio,
+                    min_compaction_size=self.min_compaction_size,
+                )
+            return self.files[aname]
+
+    def storage_usage(self) -> dict:
+        with self.lock:
+            record_files = dict(self.files)
+        return {aname: record_file.stats() for aname, record_file in record_files.items()}
+
+    def cleanup(self):
+        if self.use_vector_db:
+            self.vector_db.stop_watching()
+        with self.lock:
+            for record_file in self.files.values():
+                record_file.flush()
+                record_file.close()
+            self.files = dict()
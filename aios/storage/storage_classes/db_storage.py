@@ -1,77 +1,461 @@
+import json
 import os
+import re
 
-import chromadb
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from threading import Event, Lock, Thread
 
+import chromadb
+from chromadb.utils import embedding_functions
 
 from llama_index.core import SimpleDirectoryReader
 
+# files read as they are, without a llama_index reader
+TEXT_EXTENSIONS = {
+    ".txt", ".md", ".rst", ".csv", ".json", ".jsonl", ".yaml", ".yml",
+    ".py", ".js", ".ts", ".html", ".xml", ".log",
+}
+
 class ChromaDB:
-    def __init__(self, mount_dir) -> None:
+    """
+    Vector database of the files under mount_dir and of the agents' records.
+
+    Files are read by a pool of num_workers threads and ingested in chunks:
+    while one chunk is embedded in batches of batch_size documents and
+    upserted, the next one is already being read. Retrieval embeds all its
+    queries in one batch and returns the top k documents of each with their
+    scores. build_database only re-embeds the files that changed since it
+    last ran, see DirectoryIndexer.
+
+    Args:
+        mount_dir (str)                   : Directory whose files are indexed
+                                            by build_database.
+        db_path (str, optional)           : Where the database is kept.
+                                            Defaults to .chroma in mount_dir.
+        embedding_function (optional)     : Chroma embedding function.
+                                            Defaults to Chroma's own.
+        batch_size (int, optional)        : Documents embedded per call.
+                                            Defaults to 256.
+        num_workers (int, optional)       : Threads reading files. Defaults
+                                            to 8.
+    """
+    def __init__(self,
+                 mount_dir,
+                 db_path=None,
+                 embedding_function=None,
+                 batch_size=256,
+                 num_workers=8) -> None:
         super().__init__()
         self.mount_dir = mount_dir
+        self.db_path = db_path or os.path.join(mount_dir, ".chroma")
+        self.batch_size = batch_size
+        self.num_workers = num_workers
         # self.build_database()
 
-        self.client = chromadb.PersistentClient(self.mount_dir)
+        self.client = chromadb.PersistentClient(self.db_path)
+        self.embedding_function = embedding_function or \
+            embedding_functions.DefaultEmbeddingFunction()
+        # largest number of records the client accepts in one upsert
+        self.max_upsert_size = self.client.get_max_batch_size()
+        self.collections = dict()
+        self.indexers = dict()
+
+    def collection_name(self, name):
+        """Map a name to one Chroma accepts: 3 to 512 characters of
+        [a-zA-Z0-9._-], starting and ending with a letter or digit."""
+        name = re.sub(r"[^a-zA-Z0-9._-]", "_", name).strip("._-")
+        return name.ljust(3, "0")[:512]
 
     def add_collection(self, collection_name):
-        collection_name = os.path.join(os.path.basename(self.mount_dir), collection_name)
-        self.client.get_or_create_collection(name=collection_name)
+        collection_name = self.collection_name(collection_name)
+        if collection_name not in self.collections:
+            self.collections[collection_name] = self.client.get_or_create_collection(
+                name=collection_name, embedding_function=self.embedding_function
+            )
+        return self.collections[collection_name]
+
+    def delete_collection(self, collection_name):
+        collection_name = self.collection_name(collection_name)
+        self.collections.pop(collection_name, None)
+        try:
+            self.client.delete_collection(name=collection_name)
+        except Exception:
+            # nothing was ever stored under this name
+            pass
 
     # add collection
-    def build_database(self):
-        for subdir, _, files in os.walk(self.mount_dir):
+    def build_database(self, collection_name="files", full=False):
+        """
+        Index the files under mount_dir, keyed by their path relative to it.
+
+        Only files that are new or changed since the last run are embedded
+        again, and the documents of removed files are deleted, unless full
+        is True, in which case the collection is rebuilt from scratch.
+
+        Returns:
+            dict: Number of files added, updated, removed and unchanged.
+        """
+        indexer = self.indexer(collection_name)
+        if full:
+            self.delete_collection(collection_name)
+            indexer.reset()
+        return indexer.reindex()
+
+    def watch(self, collection_name="files", poll_interval=2.0):
+        """Keep the collection in sync with mount_dir from a background
+        thread, until stop_watching is called."""
+        self.indexer(collection_name).start(poll_interval)
+
+    def stop_watching(self):
+        for indexer in self.indexers.values():
+            indexer.stop()
+
+    def indexer(self, collection_name):
+        if collection_name not in self.indexers:
+            self.indexers[collection_name] = DirectoryIndexer(self, collection_name)
+        return self.indexers[collection_name]
+
+    def is_indexable(self, file_path):
+        """Whether a path under mount_dir is indexed; hidden files and
+        directories, the database among them, are not."""
+        return not any(
+            part.startswith(".") for part in self.file_id(file_path).split(os.sep)
+        )
+
+    def list_files(self, directory=None):
+        file_paths = []
+        for subdir, dirs, files in os.walk(directory or self.mount_dir):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
             for f in files:
-                file_path = os.path.join(subdir, f)
-                file_name = os.path.splitext(f)[0]
-                if file_name == ".DS_Store":
+                if f.startswith("."):
                     continue
-                self.add_or_update_file_in_collection(file_path, file_name)
+                file_paths.append(os.path.join(subdir, f))
+        return file_paths
 
-    def add_or_update_file_in_collection(self, file_path, file_name):
+    def add_files(self, file_paths, collection_name="files"):
         """
-        Adds or updates the file's content in the specified collection.
-        - client: PersistentClient object
-        - collection_name: Name of the collection (filename without extension)
-        - file_path: Path to the file to be added or updated
+        Read, embed and upsert the files in chunks, reading the next chunk
+        while the current one is embedded.
+
+        Returns:
+            list: Ids of the files indexed. Files that cannot be read are
+                  skipped.
         """
-        documents = SimpleDirectoryReader(input_files=[file_path]).load_data()
-        content = " ".join([doc.text for doc in documents])
+        collection = self.add_collection(collection_name)
+        chunk_size = self.batch_size * self.num_workers
+        chunks = [file_paths[i:i + chunk_size] for i in range(0, len(file_paths), chunk_size)]
+        indexed = []
 
-        existing_docs = self.collection.get(ids=[file_name])
+        with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+            pending = [pool.submit(self.read_file, path) for path in chunks[0]] if chunks else []
+            for i in range(len(chunks)):
+                current = pending
+                pending = [pool.submit(self.read_file, path) for path in chunks[i + 1]] \
+                    if i + 1 < len(chunks) else []
 
-        if existing_docs["ids"]:
-            doc_id = existing_docs["ids"]
-            self.collection.update(
-                documents=[content],
-                ids=doc_id,
-                metadatas=[{"file_path": file_path, "file_name": file_name}],
-            )
-        else:
-            # doc_id = str(uuid.uuid4())
-            self.collection.add(
-                documents=[content],
-                ids=[file_name],
-                metadatas=[{"file_path": file_path, "file_name": file_name}],
+                ids, documents, metadatas = [], [], []
+                for path, future in zip(chunks[i], current):
+                    content = future.result()
+                    if content is None:
+                        continue
+                    ids.append(self.file_id(path))
+                    documents.append(content)
+                    metadatas.append({"file_path": path, "file_name": os.path.basename(path)})
+                self.upsert(collection, ids, documents, metadatas)
+                indexed.extend(ids)
+        return indexed
+
+    def file_id(self, file_path):
+        return os.path.relpath(file_path, self.mount_dir)
+
+    def read_file(self, file_path):
+        try:
+            if os.path.splitext(file_path)[1].lower() in TEXT_EXTENSIONS:
+                with open(file_path, encoding="utf-8", errors="ignore") as file:
+                    return file.read()
+            documents = SimpleDirectoryReader(input_files=[file_path]).load_data()
+        except Exception as e:
+            print(f"Skipping {file_path}: {e}")
+            return None
+        return " ".join([doc.text for doc in documents])
+
+    def upsert(self, collection, ids, documents, metadatas=None):
+        """Embed the documents in batches and upsert them in chunks as large
+        as the client takes."""
+        for start in range(0, len(ids), self.max_upsert_size):
+            end = start + self.max_upsert_size
+            chunk = documents[start:end]
+            embeddings = []
+            for batch_start in range(0, len(chunk), self.batch_size):
+                embeddings.extend(
+                    self.embedding_function(chunk[batch_start:batch_start + self.batch_size])
+                )
+            collection.upsert(
+                ids=ids[start:end],
+                documents=chunk,
+                embeddings=embeddings,
+                metadatas=metadatas[start:end] if metadatas else None,
             )
 
-    def delete_file_from_collection(self, client, collection_name, file_path):
+    def add_documents(self, collection_name, documents, ids=None, metadatas=None):
+        """Add documents to a collection, by default keyed by their content
+        so that the same document is only stored once."""
+        if ids is None:
+            ids = [sha256(document.encode()).hexdigest() for document in documents]
+        self.upsert(self.add_collection(collection_name), ids, documents, metadatas)
+
+    def add_or_update_file_in_collection(self, file_path, file_name, collection_name="files"):
+        """
+        Adds or updates the file's content in the specified collection.
+        - file_path: Path to the file to be added or updated
+        - file_name: Id of the file's document
+        - collection_name: Name of the collection
+        """
+        content = self.read_file(file_path)
+        if content is None:
+            return
+        self.upsert(
+            self.add_collection(collection_name),
+            [file_name],
+            [content],
+            [{"file_path": file_path, "file_name": file_name}],
+        )
+
+    def delete_file_from_collection(self, collection_name, file_id):
         """
         Removes the file's document from the specified collection.
-        - client: PersistentClient object
-        - collection_name: Name of the collection (filename without extension)
-        - file_path: Path to the file that was deleted
+        - collection_name: Name of the collection
+        - file_id: Id of the file's document, its path relative to mount_dir
         """
-        collection = client.get_or_create_collection(name=collection_name)
+        collection = self.add_collection(collection_name)
 
-        existing_docs = collection.get(ids=[file_path])
+        existing_docs = collection.get(ids=[file_id])
 
         if existing_docs["ids"]:
             # print(f"Deleting document for file: {file_path}")
-            collection.delete(ids=[file_path])
+            collection.delete(ids=[file_id])
         else:
-            print(f"No document found for deleted file: {file_path}")
+            print(f"No document found for deleted file: {file_id}")
+
+    def delete_documents(self, collection_name, ids):
+        self.add_collection(collection_name).delete(ids=ids)
 
     def retrieve(self, name, k, keywords):
-        results = self.collection.query(query_texts=[keywords], n_results=int(k))
-        print([doc[:500] for doc in results["documents"][0]])
-        print(results["metadatas"])
+        """
+        Return the k documents of the collection closest to each query.
+
+        Args:
+            name (str)                 : Name of the collection.
+            k (int)                    : Number of documents per query.
+            keywords (str | list[str]) : A query, or a list of queries that
+                                         are embedded in one batch.
+
+        Returns:
+            list: For a single query, a list of {"id", "document",
+                  "metadata", "distance", "score"} dicts, closest first,
+                  where score = 1 / (1 + distance). For a list of queries,
+                  one such list per query.
+        """
+        queries = [keywords] if isinstance(keywords, str) else list(keywords)
+        collection = self.add_collection(name)
+        count = collection.count()
+        if count == 0 or not queries:
+            results = [[] for _ in queries]
+            return results[0] if isinstance(keywords, str) else results
+
+        # models that embed queries differently from documents say so here
+        embed_query = getattr(self.embedding_function, "embed_query", self.embedding_function)
+        query_embeddings = []
+        for start in range(0, len(queries), self.batch_size):
+            query_embeddings.extend(embed_query(queries[start:start + self.batch_size]))
+        raw = collection.query(
+            query_embeddings=query_embeddings,
+            n_results=min(int(k), count),
+            include=["documents", "metadatas", "distances"],
+        )
+
+        results = []
+        for i in range(len(queries)):
+            results.append([
+                {
+                    "id": doc_id,
+                    "document": document,
+                    "metadata": metadata,
+                    "distance": distance,
+                    "score": 1.0 / (1.0 + distance),
+                }
+                for doc_id, document, metadata, distance in zip(
+                    raw["ids"][i], raw["documents"][i], raw["metadatas"][i], raw["distances"][i]
+                )
+            ])
+        return results[0] if isinstance(keywords, str) else results
+
+class DirectoryIndexer:
+    """
+    Incremental indexing of the files under the mount_dir of a ChromaDB.
+
+    A manifest next to the database records the modification time, size and
+    content hash of every indexed file. Files whose time and size did not
+    change are skipped without being read, files whose content did not change
+    are not embedded again, and the documents of removed files are deleted.
+    In watch mode, changes are picked up as they happen through inotify, or
+    by polling when the watchfiles package is not installed.
+    """
+    def __init__(self, db, collection_name):
+        self.db = db
+        self.collection_name = collection_name
+        self.manifest_path = os.path.join(
+            db.db_path, f"manifest_{db.collection_name(collection_name)}.json"
+        )
+        self.manifest = self.load_manifest()  # file id -> mtime_ns, size, hash
+        self.lock = Lock()
+        self.stop_event = Event()
+        self.thread = None
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return dict()
+
+    def save_manifest(self):
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w") as file:
+            json.dump(self.manifest, file)
+        os.replace(temp_path, self.manifest_path)
+
+    def reset(self):
+        with self.lock:
+            self.manifest = dict()
+            self.save_manifest()
+
+    def reindex(self):
+        """Bring the whole collection up to date with mount_dir."""
+        with self.lock:
+            file_paths = self.db.list_files()
+            present = {self.db.file_id(path) for path in file_paths}
+            removed = [file_id for file_id in self.manifest if file_id not in present]
+            return self.sync(file_paths, removed)
+
+    def update(self, paths):
+        """Bring the given files or directories up to date, whether they
+        were created, changed or removed."""
+        with self.lock:
+            file_paths, removed = [], []
+            for path in paths:
+                if os.path.isdir(path):
+                    file_paths.extend(self.db.list_files(path))
+                elif os.path.isfile(path):
+                    file_paths.append(path)
+                else:
+                    file_id = self.db.file_id(path)
+                    removed.extend(
+                        key for key in self.manifest
+                        if key == file_id or key.startswith(file_id + os.sep)
+                    )
+            return self.sync(file_paths, removed)
+
+    def sync(self, file_paths, removed):
+        """Index the changed files among file_paths and delete the removed
+        ones. Call with the lock held."""
+        stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+        candidates = []
+        for path in file_paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # removed since it was listed
+                continue
+            entry = self.manifest.get(self.db.file_id(path))
+            if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                stats["unchanged"] += 1
+            else:
+                candidates.append((path, stat))
+
+        with ThreadPoolExecutor(max_workers=self.db.num_workers) as pool:
+            digests = list(pool.map(self.hash_file, [path for path, _ in candidates]))
+
+        changed = dict()
+        touched = False
+        for (path, stat), digest in zip(candidates, digests):
+            if digest is None:
+                continue
+            file_id = self.db.file_id(path)
+            entry = self.manifest.get(file_id)
+            record = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "hash": digest}
+            if entry and entry["hash"] == digest:
+                # touched but not changed, only the manifest needs updating
+                self.manifest[file_id] = record
+                stats["unchanged"] += 1
+                touched = True
+            else:
+                changed[file_id] = (path, record, "updated" if entry else "added")
+
+        for file_id in self.db.add_files([path for path, _, _ in changed.values()],
+                                         self.collection_name):
+            _, record, kind = changed[file_id]
+            self.manifest[file_id] = record
+            stats[kind] += 1
+
+        for file_id in removed:
+            if self.manifest.pop(file_id, None) is not None:
+                self.db.delete_file_from_collection(self.collection_name, file_id)
+                stats["removed"] += 1
+
+        if touched or stats["added"] or stats["updated"] or stats["removed"]:
+            self.save_manifest()
+        return stats
+
+    def hash_file(self, file_path):
+        digest = sha256()
+        try:
+            with open(file_path, "rb") as file:
+                for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                    digest.update(chunk)
+        except OSError:
+            return None
+        return digest.hexdigest()
+
+    def start(self, poll_interval=2.0):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = Thread(target=self.run, args=(poll_interval,), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self, poll_interval):
+        # catch up with the changes made while nothing was watching
+        self.safe_call(self.reindex)
+        try:
+            from watchfiles import watch
+
+            for changes in watch(
+                self.db.mount_dir,
+                watch_filter=lambda change, path: self.db.is_indexable(path),
+                stop_event=self.stop_event,
+            ):
+                self.safe_call(self.update, {path for _, path in changes})
+            return
+        except ImportError:
+            print("Watching with inotify needs the watchfiles package, install it with "
+                  f"`pip install watchfiles`. Polling every {poll_interval}s instead")
+        except Exception as e:
+            print(f"Watching {self.db.mount_dir} failed: {e}. "
+                  f"Polling every {poll_interval}s instead")
+
+        while not self.stop_event.wait(poll_interval):
+            self.safe_call(self.reindex)
+
+    def safe_call(self, method, *args):
+        try:
+            return method(*args)
+        except Exception as e:
+            print(f"Failed to index {self.db.mount_dir}: {e}")
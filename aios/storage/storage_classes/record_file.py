@@ -0,0 +1,292 @@
+# This implements the on-disk format of the StorageManager. Each agent has a
+# data file of framed records and a sidecar index of where they are, so that a
+# round is read with a single seek instead of loading the whole file.
+#
+# Layout of the data file (<name>.dat):
+#     records : crc32, kind, rid length, payload length, rid, payload
+# The rid is pickled and the payload is the compressed pickle of the value, or
+# empty for a record that clears a round. The crc covers everything after it,
+# so a damaged record is detected when it is read.
+#
+# Layout of the index file (<name>.idx):
+#     entries : offset of the record, record length, kind, rid length, rid
+# one per record of the data file, in the same order, so opening a file only
+# reads its index. Records are appended to the data file before their entry,
+# so the index may miss the last records after a crash, which are then found
+# by scanning the data file from the end of the index, and a record torn by
+# the crash is cut off.
+
+from threading import Lock
+
+import os
+import pickle
+import struct
+import zlib
+
+RECORD_HEADER = struct.Struct("<IBHI")
+INDEX_ENTRY = struct.Struct("<QIBH")
+
+PUT = 0
+CLEAR = 1
+
+class RecordFile:
+    """
+    Append-only file of records, each stored under a round id.
+
+    Writing a round again appends a new record that replaces the old one, and
+    records written without a round id are kept as a log. Replaced and cleared
+    records stay in the file until it is compacted.
+
+    Args:
+        path (str)                        : Data file without the extension.
+        compaction_ratio (float, optional): Share of the file taken by
+                                            replaced or cleared records that
+                                            triggers a compaction. Defaults
+                                            to 0.5.
+        min_compaction_size (int, optional)
+                                          : File size in bytes below which no
+                                            compaction is done. Defaults to
+                                            1MB.
+    """
+    def __init__(self, path, compaction_ratio=0.5, min_compaction_size=1024 * 1024):
+        self.data_path = path + ".dat"
+        self.index_path = path + ".idx"
+        self.compaction_ratio = compaction_ratio
+        self.min_compaction_size = min_compaction_size
+        self.lock = Lock()
+
+        self.entries = []  # (rid, offset, length) of each record, None once dead
+        self.latest = dict()  # rid -> position of its latest record in entries
+        self.dead_bytes = 0
+
+        self.data = open(self.data_path, "a+b")
+        self.index = open(self.index_path, "a+b")
+        self._recover()
+
+    def append(self, value, rid=None):
+        payload = zlib.compress(pickle.dumps(value))
+        with self.lock:
+            self._append(PUT, rid, payload)
+            self._maybe_compact()
+
+    def read(self, rid=None):
+        """
+        Return the latest value of the round, or the latest record written
+        without a round id if rid is None. None if there is no such record.
+        """
+        with self.lock:
+            if rid is None:
+                position = next(
+                    (i for i in range(len(self.entries) - 1, -1, -1)
+                     if self.entries[i] is not None and self.entries[i][0] is None),
+                    None
+                )
+            else:
+                position = self.latest.get(rid)
+            if position is None:
+                return None
+            _, offset, length = self.entries[position]
+            payload = self._read_payload(offset, length)
+        return pickle.loads(zlib.decompress(payload))
+
+    def iterate(self):
+        """
+        Yield (rid, value) of the live records in the order they were
+        written, reading one record at a time.
+        """
+        with self.lock:
+            entries = [entry for entry in self.entries if entry is not None]
+            generation = self.generation
+        for rid, offset, length in entries:
+            with self.lock:
+                if self.generation != generation:
+                    raise RuntimeError(f"{self.data_path} was compacted during iteration")
+                payload = self._read_payload(offset, length)
+            yield rid, pickle.loads(zlib.decompress(payload))
+
+    def clear(self, rid):
+        with self.lock:
+            position = self.latest.pop(rid, None)
+            if position is None:
+                return
+            self._kill(position)
+            self._append(CLEAR, rid, b"")
+            self._maybe_compact()
+
+    def rounds(self):
+        with self.lock:
+            return list(self.latest)
+
+    def size(self):
+        return os.fstat(self.data.fileno()).st_size
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "file_bytes": self.size(),
+                "dead_bytes": self.dead_bytes,
+                "records": sum(entry is not None for entry in self.entries),
+            }
+
+    def flush(self):
+        with self.lock:
+            for file in (self.data, self.index):
+                file.flush()
+                os.fsync(file.fileno())
+
+    def close(self):
+        with self.lock:
+            self.data.close()
+            self.index.close()
+
+    def compact(self):
+        """Rewrite the file with only the live records."""
+        with self.lock:
+            self._compact()
+
+    def _append(self, kind, rid, payload):
+        """Append a record and its index entry. Call with the lock held."""
+        encoded_rid = pickle.dumps(rid)
+        body = RECORD_HEADER.pack(0, kind, len(encoded_rid), len(payload))[4:] \
+            + encoded_rid + payload
+        record = struct.pack("<I", zlib.crc32(body)) + body
+        offset = self.size()
+        self.data.write(record)
+        self.data.flush()
+        self.index.write(INDEX_ENTRY.pack(offset, len(record), kind, len(encoded_rid)) + encoded_rid)
+        self.index.flush()
+        self._add_entry(kind, rid, offset, len(record))
+
+    def _add_entry(self, kind, rid, offset, length):
+        self.entries.append((rid, offset, length))
+        if kind == CLEAR:
+            # the clear record is only needed until the next compaction
+            position = self.latest.pop(rid, None)
+            if position is not None:
+                self._kill(position)
+            self._kill(len(self.entries) - 1)
+        elif rid is not None:
+            previous = self.latest.get(rid)
+            if previous is not None:
+                self._kill(previous)
+            self.latest[rid] = len(self.entries) - 1
+
+    def _kill(self, position):
+        self.dead_bytes += self.entries[position][2]
+        self.entries[position] = None
+
+    def _read_header(self, offset, data_size):
+        """Return the kind, rid and length of the record at offset, or None if
+        it is torn or damaged."""
+        if offset + RECORD_HEADER.size > data_size:
+            return None
+        self.data.seek(offset)
+        crc, kind, rid_length, payload_length = RECORD_HEADER.unpack(
+            self.data.read(RECORD_HEADER.size)
+        )
+        length = RECORD_HEADER.size + rid_length + payload_length
+        if offset + length > data_size:
+            return None
+        body = self.data.read(length - RECORD_HEADER.size)
+        if zlib.crc32(RECORD_HEADER.pack(crc, kind, rid_length, payload_length)[4:] + body) != crc:
+            return None
+        return kind, pickle.loads(body[:rid_length]), length
+
+    def _read_payload(self, offset, length):
+        self.data.seek(offset)
+        record = self.data.read(length)
+        crc, _, rid_length, payload_length = RECORD_HEADER.unpack_from(record)
+        if len(record) != length or zlib.crc32(record[4:]) != crc:
+            raise ValueError(f"Damaged record at offset {offset} of {self.data_path}")
+        return record[RECORD_HEADER.size + rid_length:]
+
+    def _recover(self):
+        """Load the index, then scan the records appended after it and cut off
+        a record that was torn by a crash."""
+        data_size = self.size()
+        self.index.seek(0)
+        raw_index = self.index.read()
+        self.generation = 0
+
+        index_end = 0
+        position = 0
+        while index_end + INDEX_ENTRY.size <= len(raw_index):
+            offset, length, kind, rid_length = INDEX_ENTRY.unpack_from(raw_index, index_end)
+            entry_end = index_end + INDEX_ENTRY.size + rid_length
+            if offset != position or offset + length > data_size or entry_end > len(raw_index):
+                break
+            rid = pickle.loads(raw_index[index_end + INDEX_ENTRY.size:entry_end])
+            self._add_entry(kind, rid, offset, length)
+            index_end = entry_end
+            position = offset + length
+
+        last = next((entry for entry in reversed(self.entries) if entry is not None), None)
+        if last is not None and self._read_header(last[1], data_size) != (PUT, last[0], last[2]):
+            # the index is not the one of this data file, e.g. after a crash
+            # during a compaction, so it is rebuilt from the data file
+            self.entries = []
+            self.latest = dict()
+            self.dead_bytes = 0
+            index_end = 0
+            position = 0
+
+        if index_end < len(raw_index):
+            # entries of records that never made it to the data file
+            self.index.truncate(index_end)
+
+        while True:
+            header = self._read_header(position, data_size)
+            if header is None:
+                break
+            kind, rid, length = header
+            encoded_rid = pickle.dumps(rid)
+            self.index.write(INDEX_ENTRY.pack(position, length, kind, len(encoded_rid)) + encoded_rid)
+            self._add_entry(kind, rid, position, length)
+            position += length
+        self.index.flush()
+
+        if position < data_size:
+            print(f"Truncating {data_size - position} bytes of a torn record in {self.data_path}")
+            self.data.truncate(position)
+
+    def _maybe_compact(self):
+        size = self.size()
+        if size >= self.min_compaction_size and self.dead_bytes > size * self.compaction_ratio:
+            self._compact()
+
+    def _compact(self):
+        """Copy the live records to new files and swap them in. Call with the
+        lock held."""
+        entries = []
+        offset = 0
+        with open(self.data_path + ".compact", "wb") as data, \
+                open(self.index_path + ".compact", "wb") as index:
+            for entry in self.entries:
+                if entry is None:
+                    continue
+                rid, old_offset, length = entry
+                self.data.seek(old_offset)
+                data.write(self.data.read(length))
+                encoded_rid = pickle.dumps(rid)
+                index.write(INDEX_ENTRY.pack(offset, length, PUT, len(encoded_rid)) + encoded_rid)
+                entries.append((rid, offset, length))
+                offset += length
+            for file in (data, index):
+                file.flush()
+                os.fsync(file.fileno())
+
+        self.data.close()
+        self.index.close()
+        # the data file goes first, an index that does not match it is cut
+        # back and rebuilt from the data file on opening
+        os.replace(self.data_path + ".compact", self.data_path)
+        os.replace(self.index_path + ".compact", self.index_path)
+        self.data = open(self.data_path, "a+b")
+        self.index = open(self.index_path, "a+b")
+
+        self.entries = []
+        self.latest = dict()
+        self.dead_bytes = 0
+        self.generation += 1
+        for rid, offset, length in entries:
+            self._add_entry(PUT, rid, offset, length)
@@ -0,0 +1,121 @@
+# This memoizes the results of tools that are pure, such as calculators, unit
+# converters and static lookups, which agents call with the same parameters
+# over and over. Caching is opt-in per tool, and each tool has its own least
+# recently used cache with its own size and expiry.
+
+from collections import OrderedDict
+from threading import Lock
+
+import hashlib
+import json
+import time
+
+class ToolCacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def to_dict(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+class ToolResultCache:
+    """
+    Results of cacheable tools, keyed by their canonical parameters.
+
+    Args:
+        max_entries (int, optional) : Results kept of each tool, least
+                                      recently used first out, unless its
+                                      policy says otherwise. Defaults to 256.
+        ttl (float, optional)       : Seconds a result stays valid, unless
+                                      the tool's policy says otherwise.
+                                      Defaults to no expiry.
+
+    A policy is True to cache a tool with the defaults, or a dict that may set
+    "max_entries" and "ttl" for it.
+    """
+    def __init__(self, max_entries: int = 256, ttl: float | None = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.policies: dict[str, tuple[int, float | None]] = {}
+        self.entries: dict[str, OrderedDict] = {}
+        self.stats: dict[str, ToolCacheStats] = {}
+        self.lock = Lock()
+
+    @staticmethod
+    def make_key(params) -> str | None:
+        """Canonical hash of the parameters of a call, or None if they are
+        not plain JSON and the call cannot be cached."""
+        try:
+            canonical = json.dumps(params, sort_keys=True, separators=(",", ":"))
+        except (TypeError, ValueError):
+            return None
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def configure(self, tool_name, policy):
+        """Turn caching of the tool on with the given policy, or off if the
+        policy is falsy."""
+        with self.lock:
+            if not policy:
+                self.policies.pop(tool_name, None)
+                self.entries.pop(tool_name, None)
+                return
+            policy = policy if isinstance(policy, dict) else {}
+            self.policies[tool_name] = (
+                policy.get("max_entries", self.max_entries),
+                policy.get("ttl", self.ttl),
+            )
+            self.entries.setdefault(tool_name, OrderedDict())
+            self.stats.setdefault(tool_name, ToolCacheStats())
+
+    def is_cacheable(self, tool_name) -> bool:
+        with self.lock:
+            return tool_name in self.policies
+
+    def get(self, tool_name, key) -> tuple[bool, object]:
+        """Return whether the result of the call is cached, and the result."""
+        now = time.monotonic()
+        with self.lock:
+            entries = self.entries.get(tool_name)
+            if entries is None:
+                return False, None
+            entry = entries.get(key)
+            if entry is not None:
+                expires_at, result = entry
+                if expires_at is None or expires_at > now:
+                    entries.move_to_end(key)
+                    self.stats[tool_name].hits += 1
+                    return True, result
+                del entries[key]
+            self.stats[tool_name].misses += 1
+            return False, None
+
+    def put(self, tool_name, key, result):
+        with self.lock:
+            if tool_name not in self.policies:
+                return
+            max_entries, ttl = self.policies[tool_name]
+            entries = self.entries[tool_name]
+            entries[key] = (None if ttl is None else time.monotonic() + ttl, result)
+            entries.move_to_end(key)
+            while len(entries) > max_entries:
+                entries.popitem(last=False)
+                self.stats[tool_name].evictions += 1
+
+    def clear(self):
+        with self.lock:
+            for entries in self.entries.values():
+                entries.clear()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                tool_name: {**stats.to_dict(), "entries": len(self.entries.get(tool_name, ()))}
+                for tool_name, stats in self.stats.items()
+            }
@@ -0,0 +1,119 @@
+# This limits how many calls of each tool run at the same time. Calls over the
+# limit wait their turn in arrival order instead of failing, and the time they
+# waited is reported with their syscall.
+
+from collections import deque
+from threading import Lock
+
+import time
+
+class FifoSemaphore:
+    """
+    Semaphore that lets its waiters through in the order they arrived. A
+    release hands the permit straight to the first waiter, so a newcomer can
+    never take it first.
+    """
+    def __init__(self, value=1):
+        self.value = value
+        self.waiters = deque()
+        self.lock = Lock()
+
+    def acquire(self, timeout=None) -> bool:
+        with self.lock:
+            if self.value > 0 and not self.waiters:
+                self.value -= 1
+                return True
+            waiter = Lock()
+            waiter.acquire()
+            self.waiters.append(waiter)
+
+        if waiter.acquire(timeout=-1 if timeout is None else max(0.0, timeout)):
+            return True
+        with self.lock:
+            try:
+                self.waiters.remove(waiter)
+                return False
+            except ValueError:
+                # the permit was handed over just as the wait timed out
+                return True
+
+    def release(self):
+        with self.lock:
+            if self.waiters:
+                self.waiters.popleft().release()
+            else:
+                self.value += 1
+
+    def queued(self) -> int:
+        with self.lock:
+            return len(self.waiters)
+
+class ToolLimiter:
+    """
+    Per tool limits on the calls running at the same time.
+
+    Args:
+        max_parallel (int, optional)      : Calls of a tool that may run at
+                                            the same time. Defaults to 1.
+        tool_max_parallel (dict, optional): Limits of particular tools by
+                                            name, overriding max_parallel.
+    """
+    def __init__(self, max_parallel=1, tool_max_parallel=None):
+        self.max_parallel = max(1, max_parallel)
+        self.tool_max_parallel = tool_max_parallel or {}
+        self.semaphores = dict()
+        self.lock = Lock()
+
+        self.waits = dict()  # tool -> number of calls that had to wait
+        self.wait_time = dict()  # tool -> seconds waited in total
+        self.max_wait = dict()  # tool -> longest wait in seconds
+
+    def semaphore(self, tool_name) -> FifoSemaphore:
+        with self.lock:
+            if tool_name not in self.semaphores:
+                limit = self.tool_max_parallel.get(tool_name, self.max_parallel)
+                self.semaphores[tool_name] = FifoSemaphore(max(1, limit))
+            return self.semaphores[tool_name]
+
+    def acquire(self, tool_name, timeout=None) -> float | None:
+        """
+        Wait for a turn to run the tool.
+
+        Returns:
+            float: Seconds waited, or None if the timeout passed first, in
+                   which case nothing was acquired.
+        """
+        start = time.monotonic()
+        if not self.semaphore(tool_name).acquire(timeout):
+            self.record_wait(tool_name, time.monotonic() - start)
+            return None
+        waited = time.monotonic() - start
+        self.record_wait(tool_name, waited)
+        return waited
+
+    def release(self, tool_name):
+        self.semaphore(tool_name).release()
+
+    def record_wait(self, tool_name, waited):
+        # calls that got their turn at once are not counted as waits
+        if waited < 1e-3:
+            return
+        with self.lock:
+            self.waits[tool_name] = self.waits.get(tool_name, 0) + 1
+            self.wait_time[tool_name] = self.wait_time.get(tool_name, 0.0) + waited
+            self.max_wait[tool_name] = max(self.max_wait.get(tool_name, 0.0), waited)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            semaphores = dict(self.semaphores)
+            stats = {
+                tool_name: {
+                    "waits": self.waits.get(tool_name, 0),
+                    "wait_time": self.wait_time.get(tool_name, 0.0),
+                    "max_wait": self.max_wait.get(tool_name, 0.0),
+                }
+                for tool_name in semaphores
+            }
+        for tool_name, semaphore in semaphores.items():
+            stats[tool_name]["queued"] = semaphore.queued()
+        return stats
@@ -3,39 +3,199 @@ import importlib
 from cerebrum.llm.communication import Response
 from cerebrum.interface import AutoTool
 
+from .cache import ToolResultCache
+from .limiter import ToolLimiter
+from .pool import ToolInstancePool
+from .process_executor import ToolProcessExecutor
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+
+import json
+import time
+
 class ToolManager:
+    """
+    Runs the tool calls of tool syscalls.
+
+    The calls of a syscall run concurrently on a pool of max_workers threads,
+    so independent tools overlap, and their results are returned in the order
+    of the calls. A call that takes longer than its timeout is reported as
+    failed, so a hung tool does not hold up the syscall or the scheduler's
+    tool processor. Python threads cannot be stopped, so the tool keeps its
+    pool thread until it returns.
+
+    Loaded tools are kept in a ToolInstancePool and reused by later calls,
+    and the tools an agent is allowed to use can be loaded ahead with
+    warm_up.
+
+    A ToolLimiter bounds the calls of each tool that run at the same time.
+    Calls over the limit wait in arrival order, and the longest wait of the
+    calls of a syscall is added to its waiting time.
+
+    CPU-bound tools listed in process_tools run in a ToolProcessExecutor
+    instead, out of the kernel process, where a call past its timeout is
+    killed and its CPU time can be limited.
+
+    Results of pure tools are memoized in a ToolResultCache, keyed by the
+    tool and its canonical parameters, and repeated calls are answered from
+    it without running the tool. Caching is opt-in: a tool is cached if it is
+    listed in cacheable_tools, or if it declares a "cache" policy in its
+    config.json or as a cache attribute of its class. A policy is True, or a
+    dict that may set "ttl" and "max_entries" for the tool. Only calls that
+    succeeded are cached.
+
+    Args:
+        log_mode (str, optional)         : Logging mode. Defaults to "console".
+        max_workers (int, optional)      : Tool calls run at the same time,
+                                           over all syscalls. Defaults to 8.
+        timeout (float, optional)        : Seconds a tool call may take,
+                                           None for no limit.
+        tool_timeouts (dict, optional)   : Timeouts of particular tools by
+                                           name, overriding timeout.
+        max_instances (int, optional)    : Loaded instances kept of each
+                                           tool. Defaults to 4.
+        idle_timeout (float, optional)   : Seconds a loaded instance may go
+                                           unused before it is dropped, None
+                                           to keep it. Defaults to 600.
+        max_parallel (int, optional)     : Calls of a tool that may run at
+                                           the same time. Defaults to 1.
+        tool_max_parallel (dict, optional)
+                                         : Limits of particular tools by
+                                           name, overriding max_parallel.
+        process_tools (list, optional)   : Tools run in worker processes.
+        process_workers (int, optional)  : Worker processes for them.
+                                           Defaults to 2.
+        cpu_limit (float, optional)      : Seconds of CPU time a call of
+                                           those tools may use, None for no
+                                           limit.
+        tool_cpu_limits (dict, optional) : CPU time limits of particular
+                                           tools by name, overriding
+                                           cpu_limit.
+        cacheable_tools (dict, optional) : Cache policies of particular tools
+                                           by name, overriding what the tools
+                                           declare. False turns caching of a
+                                           tool off.
+        cache_size (int, optional)       : Results cached of each tool unless
+                                           its policy says otherwise.
+                                           Defaults to 256.
+        cache_ttl (float, optional)      : Seconds a cached result stays
+                                           valid unless its policy says
+                                           otherwise, None for no expiry.
+    """
     def __init__(
         self,
         log_mode: str = "console",
+        max_workers: int = 8,
+        timeout: float | None = None,
+        tool_timeouts: dict[str, float] | None = None,
+        max_instances: int = 4,
+        idle_timeout: float | None = 600.0,
+        max_parallel: int = 1,
+        tool_max_parallel: dict[str, int] | None = None,
+        process_tools: list[str] | None = None,
+        process_workers: int = 2,
+        cpu_limit: float | None = None,
+        tool_cpu_limits: dict[str, float] | None = None,
+        cacheable_tools: dict[str, bool | dict] | None = None,
+        cache_size: int = 256,
+        cache_ttl: float | None = None,
     ):
         self.log_mode = log_mode
-        self.tool_conflict_map = {}
+        self.limiter = ToolLimiter(max_parallel, tool_max_parallel)
+        self.timeout = timeout
+        self.tool_timeouts = tool_timeouts or {}
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, max_workers), thread_name_prefix="tool_call"
+        )
+        self.instance_pool = ToolInstancePool(
+            lambda tool_org_and_name: self.load_tool_instance(tool_org_and_name),
+            max_instances=max_instances,
+            idle_timeout=idle_timeout,
+        )
+        self.process_tools = set(process_tools or [])
+        self.cpu_limit = cpu_limit
+        self.tool_cpu_limits = tool_cpu_limits or {}
+        self.process_executor = ToolProcessExecutor(
+            num_workers=process_workers, preload=process_tools
+        ) if self.process_tools else None
+        self.cache = ToolResultCache(max_entries=cache_size, ttl=cache_ttl)
+        self.cacheable_tools = cacheable_tools or {}
+        self.cache_policies = dict()  # tool -> policy it was given, None if none
+        self.cache_lock = Lock()
 
-    def address_request(self, syscall) -> None:
+    def address_request(self, syscall) -> Response:
+        """
+        Run the tool calls of the syscall concurrently.
 
+        Returns:
+            Response: With a single call, its result as response_message.
+                      With several, the results one per line, prefixed by
+                      the tool name. tool_calls holds the calls with their
+                      "result" and whether they "succeeded".
+        """
         tool_calls = syscall.tool_calls
+        # a ToolQuery carries its calls, an LLM response gives them directly
+        tool_calls = getattr(tool_calls, "tool_calls", tool_calls)
 
         try:
-            for tool_call in tool_calls:
-                tool_org_and_name, tool_params = (
-                    tool_call["name"],
-                    tool_call["parameters"],
-                )
-                # org, tool_name = tool_org_and_name.split("/")
-
-                if tool_org_and_name not in self.tool_conflict_map.keys():
-                    self.tool_conflict_map[tool_org_and_name] = 1
-                    tool = self.load_tool_instance(tool_org_and_name)
+            started = time.monotonic()
+            # seconds each call waited for its turn, None until it has one
+            waits = [None] * len(tool_calls)
+            futures = []
+            for idx, tool_call in enumerate(tool_calls):
+                self.resolve_cache_policy(tool_call["name"])
+                cache_key = None
+                if self.cache.is_cacheable(tool_call["name"]):
+                    cache_key = self.cache.make_key(tool_call["parameters"])
+                if cache_key is not None:
+                    hit, result = self.cache.get(tool_call["name"], cache_key)
+                    if hit:
+                        future = Future()
+                        future.set_result(result)
+                        futures.append(future)
+                        waits[idx] = 0.0
+                        continue
 
-                    # tool = tool_class()
-                    tool_result = tool.run(params=tool_params)
+                timeout = self.get_timeout(tool_call["name"])
+                futures.append(self.executor.submit(
+                    self.run_tool_call, tool_call["name"], tool_call["parameters"],
+                    None if timeout is None else started + timeout, waits, idx,
+                    cache_key
+                ))
 
-                    self.tool_conflict_map.pop(tool_org_and_name)
+            results = []
+            for tool_call, future in zip(tool_calls, futures):
+                timeout = self.get_timeout(tool_call["name"])
+                try:
+                    # the calls ran in parallel, so the time waited for
+                    # earlier ones counts against this one too
+                    remaining = None if timeout is None \
+                        else max(0.0, timeout - (time.monotonic() - started))
+                    result, succeeded = future.result(timeout=remaining), True
+                except TimeoutError as e:
+                    if future.done():
+                        # raised by the tool itself
+                        result = f"Tool calling error: {e}"
+                    else:
+                        result = f"Tool calling error: {tool_call['name']} timed out after {timeout}s"
+                    succeeded = False
+                except Exception as e:
+                    result, succeeded = f"Tool calling error: {e}", False
+                results.append({
+                    "name": tool_call["name"],
+                    "parameters": tool_call["parameters"],
+                    "result": result,
+                    "succeeded": succeeded,
+                })
 
-                    return Response(
-                        response_message=tool_result,
-                        finished=True
-                    )
+            # the calls waited side by side, so the syscall waited for the
+            # longest of them; calls that never got a turn waited throughout
+            waited = [
+                time.monotonic() - started if wait is None else wait for wait in waits
+            ]
+            if waited:
+                syscall.add_resource_waiting_time(max(waited))
 
         except Exception as e:
             return Response(
@@ -43,7 +203,136 @@ class ToolManager:
                 finished=True
             )
 
+        if len(results) == 1:
+            response_message = results[0]["result"]
+        else:
+            response_message = "\n".join(
+                f"{result['name']}: {result['result']}" for result in results
+            )
+        return Response(
+            response_message=None if response_message is None else str(response_message),
+            tool_calls=results,
+            finished=True
+        )
+
+    def run_tool_call(
+        self, tool_org_and_name, tool_params, deadline=None, waits=None, idx=None, cache_key=None
+    ):
+        result = self.execute_tool_call(tool_org_and_name, tool_params, deadline, waits, idx)
+        if cache_key is not None:
+            self.cache.put(tool_org_and_name, cache_key, result)
+        return result
+
+    def execute_tool_call(self, tool_org_and_name, tool_params, deadline=None, waits=None, idx=None):
+        # org, tool_name = tool_org_and_name.split("/")
+        waited = self.limiter.acquire(
+            tool_org_and_name,
+            timeout=None if deadline is None else deadline - time.monotonic()
+        )
+        if waited is None:
+            raise TimeoutError(f"{tool_org_and_name} was busy until the call timed out")
+        if waits is not None:
+            waits[idx] = waited
+
+        try:
+            if tool_org_and_name in self.process_tools:
+                return self.process_executor.run(
+                    tool_org_and_name,
+                    tool_params,
+                    timeout=None if deadline is None else deadline - time.monotonic(),
+                    cpu_limit=self.tool_cpu_limits.get(tool_org_and_name, self.cpu_limit),
+                )
+
+            tool = self.instance_pool.acquire(tool_org_and_name)
+            start = time.monotonic()
+            try:
+                # tool = tool_class()
+                return tool.run(params=tool_params)
+            finally:
+                self.instance_pool.release(
+                    tool_org_and_name, tool, run_time=time.monotonic() - start
+                )
+        finally:
+            self.limiter.release(tool_org_and_name)
+
+    def get_timeout(self, tool_org_and_name):
+        return self.tool_timeouts.get(tool_org_and_name, self.timeout)
+
     def load_tool_instance(self, tool_org_and_name):
 
         tool_instance = AutoTool.from_preloaded(tool_org_and_name)
+        policy = getattr(tool_instance, "cache", None)
+        if policy and self.cache_policies.get(tool_org_and_name) is None:
+            # declared by the tool class, which is only known once loaded
+            self.cache_policies[tool_org_and_name] = policy
+            self.cache.configure(tool_org_and_name, policy)
         return tool_instance
+
+    def resolve_cache_policy(self, tool_org_and_name):
+        """Turn caching of the tool on if it is configured or declared in
+        its config.json. Done once, the first time the tool is called."""
+        with self.cache_lock:
+            if tool_org_and_name in self.cache_policies:
+                return
+            self.cache_policies[tool_org_and_name] = None
+        if tool_org_and_name in self.cacheable_tools:
+            policy = self.cacheable_tools[tool_org_and_name]
+        else:
+            policy = self.declared_cache_policy(tool_org_and_name)
+        if policy is not None:
+            self.cache_policies[tool_org_and_name] = policy
+            self.cache.configure(tool_org_and_name, policy)
+
+    def declared_cache_policy(self, tool_org_and_name):
+        """The "cache" entry of the config.json of a local tool, if any."""
+        name = tool_org_and_name.split("/")[-1]
+        config_path = AutoTool.TOOL_MANAGER.local_tools_dir / name / "config.json"
+        try:
+            with open(config_path) as f:
+                return json.load(f).get("cache")
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    def warm_up(self, tool_names, instances=1):
+        """Load instances of the tools ahead of their first calls. Tools that
+        fail to load are reported and loaded again when called."""
+        for tool_org_and_name in tool_names:
+            if tool_org_and_name in self.process_tools:
+                # loaded by the worker processes as they start
+                continue
+            try:
+                self.instance_pool.warm_up(tool_org_and_name, instances)
+            except Exception as e:
+                print(f"Failed to warm up tool {tool_org_and_name}: {e}")
+
+    def get_metrics(self) -> dict:
+        """Instances, load time, run time, waits and cache hits of each tool
+        that was used."""
+        tools = self.instance_pool.get_stats()
+        for tool_org_and_name, stats in self.limiter.get_stats().items():
+            tools.setdefault(tool_org_and_name, {}).update(stats)
+        cache_stats = self.cache.get_stats()
+        for tool_org_and_name, stats in cache_stats.items():
+            tools.setdefault(tool_org_and_name, {})["cache"] = stats
+        hits = sum(stats["hits"] for stats in cache_stats.values())
+        lookups = hits + sum(stats["misses"] for stats in cache_stats.values())
+        metrics = {
+            "tools": tools,
+            "tool_cache": {
+                "hits": hits,
+                "misses": lookups - hits,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "entries": sum(stats["entries"] for stats in cache_stats.values()),
+            },
+        }
+        if self.process_executor is not None:
+            metrics["tool_workers"] = self.process_executor.get_stats()
+        return metrics
+
+    def cleanup(self):
+        # calls that are still running are left to finish on their own
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.instance_pool.clear()
+        self.cache.clear()
+        if self.process_executor is not None:
+            self.process_executor.shutdown()
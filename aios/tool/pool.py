@@ -0,0 +1,131 @@
+# This keeps loaded tool instances around between calls. Loading a tool
+# resolves and imports its module and builds whatever clients it holds, which
+# often costs more than running it, so each tool has a pool of instances that
+# calls borrow and give back. An instance serves one call at a time, the pool
+# of a tool is bounded, and instances that sat idle for too long are dropped.
+
+from threading import Condition
+
+import time
+
+class ToolStats:
+    def __init__(self):
+        self.loads = 0
+        self.load_time = 0.0
+        self.runs = 0
+        self.run_time = 0.0
+        self.reuses = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "loads": self.loads,
+            "load_time": self.load_time,
+            "runs": self.runs,
+            "run_time": self.run_time,
+            "reuses": self.reuses,
+        }
+
+class ToolInstancePool:
+    """
+    Bounded pools of loaded instances, one pool per tool.
+
+    Args:
+        loader (callable)                 : Loads an instance of a tool given
+                                            its name.
+        max_instances (int, optional)     : Instances kept of each tool.
+                                            Calls beyond it wait for one to be
+                                            given back. Defaults to 4.
+        idle_timeout (float, optional)    : Seconds an instance may sit
+                                            unused before it is dropped, None
+                                            to keep instances forever.
+                                            Defaults to 600.
+    """
+    def __init__(self, loader, max_instances=4, idle_timeout=600.0):
+        self.loader = loader
+        self.max_instances = max(1, max_instances)
+        self.idle_timeout = idle_timeout
+        self.idle = dict()  # tool -> list of (instance, time it was given back)
+        self.instances = dict()  # tool -> number of instances, idle or in use
+        self.stats = dict()  # tool -> ToolStats
+        self.condition = Condition()
+
+    def acquire(self, tool_name):
+        """Borrow an instance of the tool, loading one if none is idle."""
+        with self.condition:
+            self.evict_idle()
+            stats = self.stats.setdefault(tool_name, ToolStats())
+            while True:
+                idle = self.idle.get(tool_name)
+                if idle:
+                    stats.reuses += 1
+                    # the most recently used instance is the warmest
+                    return idle.pop()[0]
+                if self.instances.get(tool_name, 0) < self.max_instances:
+                    # the slot is taken before loading, outside the lock
+                    self.instances[tool_name] = self.instances.get(tool_name, 0) + 1
+                    break
+                self.condition.wait()
+
+        start = time.monotonic()
+        try:
+            instance = self.loader(tool_name)
+        except Exception:
+            with self.condition:
+                self.instances[tool_name] -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            stats.loads += 1
+            stats.load_time += time.monotonic() - start
+        return instance
+
+    def release(self, tool_name, instance, run_time=None):
+        """Give an instance back, with the time the call ran for."""
+        with self.condition:
+            if run_time is not None:
+                stats = self.stats[tool_name]
+                stats.runs += 1
+                stats.run_time += run_time
+            self.idle.setdefault(tool_name, []).append((instance, time.monotonic()))
+            self.condition.notify()
+
+    def warm_up(self, tool_name, count=1):
+        """Load instances of the tool ahead of its first call."""
+        instances = []
+        try:
+            for _ in range(min(count, self.max_instances)):
+                instances.append(self.acquire(tool_name))
+        finally:
+            for instance in instances:
+                self.release(tool_name, instance)
+
+    def evict_idle(self):
+        """Drop the instances that have been idle for longer than
+        idle_timeout. Call with the condition held."""
+        if self.idle_timeout is None:
+            return
+        deadline = time.monotonic() - self.idle_timeout
+        for tool_name, idle in self.idle.items():
+            kept = [(instance, since) for instance, since in idle if since >= deadline]
+            if len(kept) < len(idle):
+                self.instances[tool_name] -= len(idle) - len(kept)
+                idle[:] = kept
+                # the freed slots can be taken by calls waiting for one
+                self.condition.notify_all()
+
+    def clear(self):
+        with self.condition:
+            for tool_name, idle in self.idle.items():
+                self.instances[tool_name] -= len(idle)
+            self.idle = dict()
+
+    def get_stats(self) -> dict:
+        with self.condition:
+            return {
+                tool_name: {
+                    "instances": self.instances.get(tool_name, 0),
+                    "idle": len(self.idle.get(tool_name, [])),
+                    **stats.to_dict(),
+                }
+                for tool_name, stats in self.stats.items()
+            }
@@ -0,0 +1,269 @@
+# This runs tools in a pool of worker processes, so that a CPU-bound tool does
+# not hold the kernel's GIL and slow down the scheduler and the API. Workers
+# are started ahead with the tools they serve already loaded, and keep the
+# instances they load for later calls.
+#
+# Arguments and results are pickled with protocol 5. Large bytes, bytearrays
+# and other buffers (e.g. numpy arrays) are taken out of the pickle stream and
+# sent over the pipe as they are, without being copied into it.
+#
+# A call that runs past its wall-clock limit gets its worker killed and
+# replaced. The CPU time of a call is limited with RLIMIT_CPU in the worker,
+# which kills it with SIGXCPU once the limit is used up.
+
+from cerebrum.interface import AutoTool
+
+from multiprocessing.connection import wait
+from queue import Queue, Empty
+from threading import Lock
+
+import io
+import math
+import multiprocessing
+import pickle
+import signal
+import time
+
+try:
+    import resource
+except ImportError:
+    # not on Windows, where CPU limits are not applied
+    resource = None
+
+# buffers at least this large are sent out of the pickle stream
+OUT_OF_BAND_THRESHOLD = 64 * 1024
+
+def load_tool(tool_org_and_name):
+    return AutoTool.from_preloaded(tool_org_and_name)
+
+class OutOfBandPickler(pickle.Pickler):
+    """Pickler that sends large bytes and bytearrays out of band too, which
+    protocol 5 only does by itself for objects such as numpy arrays."""
+    def reducer_override(self, obj):
+        if type(obj) in (bytes, bytearray) and len(obj) >= OUT_OF_BAND_THRESHOLD:
+            return type(obj), (pickle.PickleBuffer(obj),)
+        return NotImplemented
+
+def send_object(conn, header, obj):
+    """Send a header tuple followed by obj and its out-of-band buffers."""
+    buffers = []
+    def buffer_callback(buffer):
+        try:
+            size = buffer.raw().nbytes
+        except BufferError:
+            # not contiguous, so it cannot be sent as it is
+            return True
+        if size < OUT_OF_BAND_THRESHOLD:
+            # small buffers are cheaper to keep in the stream
+            return True
+        buffers.append(buffer)
+        return False
+
+    stream = io.BytesIO()
+    OutOfBandPickler(stream, protocol=5, buffer_callback=buffer_callback).dump(obj)
+    conn.send((header, len(buffers)))
+    conn.send_bytes(stream.getbuffer())
+    for buffer in buffers:
+        conn.send_bytes(buffer.raw())
+
+def recv_object(conn):
+    """Receive what send_object sent, as (header, obj)."""
+    header, buffer_count = conn.recv()
+    data = conn.recv_bytes()
+    buffers = [conn.recv_bytes() for _ in range(buffer_count)]
+    return header, pickle.loads(data, buffers=buffers)
+
+def worker_main(conn, loader, preload):
+    # the kernel handles Ctrl-C and stops its workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    tools = dict()
+    for tool_org_and_name in preload:
+        try:
+            tools[tool_org_and_name] = loader(tool_org_and_name)
+        except Exception as e:
+            print(f"Tool worker failed to preload {tool_org_and_name}: {e}")
+
+    while True:
+        try:
+            (tool_org_and_name, cpu_limit), params = recv_object(conn)
+        except EOFError:
+            break
+        if tool_org_and_name is None:
+            break
+
+        if cpu_limit is not None and resource is not None:
+            used = resource.getrusage(resource.RUSAGE_SELF)
+            _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+            # the limit is counted in whole seconds of the process' CPU time
+            resource.setrlimit(
+                resource.RLIMIT_CPU,
+                (math.ceil(used.ru_utime + used.ru_stime + cpu_limit), hard)
+            )
+        try:
+            if tool_org_and_name not in tools:
+                tools[tool_org_and_name] = loader(tool_org_and_name)
+            header, result = (True, None), tools[tool_org_and_name].run(params=params)
+        except Exception as e:
+            header, result = (False, f"{type(e).__name__}: {e}"), None
+        finally:
+            if cpu_limit is not None and resource is not None:
+                _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+                resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+
+        try:
+            send_object(conn, header, result)
+        except Exception as e:
+            # the result could not be pickled
+            send_object(conn, (False, f"Tool result cannot be sent back: {e}"), None)
+
+class ToolWorker:
+    def __init__(self, context, loader, preload):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=worker_main, args=(child_conn, loader, preload), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self, timeout=1.0):
+        try:
+            send_object(self.conn, (None, None), None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+class ToolProcessExecutor:
+    """
+    Pool of worker processes that run tools.
+
+    Args:
+        num_workers (int, optional)      : Worker processes. Defaults to 2.
+        preload (list, optional)         : Tools every worker loads when it
+                                           starts.
+        loader (callable, optional)      : Module level function that loads
+                                           a tool instance given its name.
+                                           Defaults to AutoTool.from_preloaded.
+        start_method (str, optional)     : multiprocessing start method.
+                                           Defaults to "spawn", since forking
+                                           the kernel with its threads
+                                           running is not safe.
+    """
+    def __init__(self, num_workers=2, preload=None, loader=load_tool, start_method="spawn"):
+        self.context = multiprocessing.get_context(start_method)
+        self.loader = loader
+        self.preload = list(preload or [])
+        self.idle = Queue()
+        self.lock = Lock()
+        self.workers = []
+        self.restarts = 0
+        self.calls = 0
+        self.stopped = False
+        for _ in range(max(1, num_workers)):
+            worker = self.start_worker()
+            self.idle.put(worker)
+
+    def start_worker(self) -> ToolWorker:
+        worker = ToolWorker(self.context, self.loader, self.preload)
+        with self.lock:
+            self.workers.append(worker)
+        return worker
+
+    def replace_worker(self, worker, kill=True):
+        if kill:
+            worker.kill()
+        else:
+            worker.process.join()
+            worker.conn.close()
+        with self.lock:
+            self.workers.remove(worker)
+            self.restarts += 1
+            stopped = self.stopped
+        if not stopped:
+            self.idle.put(self.start_worker())
+
+    def run(self, tool_org_and_name, params, timeout=None, cpu_limit=None):
+        """
+        Run a tool in a worker and return its result.
+
+        Raises:
+            TimeoutError: If no worker was free or the call did not finish
+                          within timeout seconds. The worker running it is
+                          killed and replaced.
+            RuntimeError: If the tool raised, used up its cpu_limit seconds
+                          of CPU time, or its params or result could not
+                          be pickled.
+        """
+        if timeout is not None:
+            timeout = max(0.0, timeout)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            worker = self.idle.get(timeout=timeout)
+        except Empty:
+            raise TimeoutError(f"No tool worker was free to run {tool_org_and_name}")
+
+        with self.lock:
+            self.calls += 1
+        try:
+            send_object(worker.conn, (tool_org_and_name, cpu_limit), params)
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            finished = bool(wait([worker.conn, worker.process.sentinel], remaining))
+            if finished:
+                (succeeded, error), result = recv_object(worker.conn)
+        except (EOFError, OSError):
+            # the worker died during the call
+            self.replace_worker(worker, kill=False)
+            if worker.process.exitcode == -signal.SIGXCPU:
+                raise RuntimeError(
+                    f"{tool_org_and_name} exceeded its CPU time limit of {cpu_limit}s"
+                )
+            raise RuntimeError(
+                f"Tool worker died running {tool_org_and_name} "
+                f"with exit code {worker.process.exitcode}"
+            )
+        except Exception as e:
+            # the params could not be pickled, in which case nothing was
+            # sent, or the result could not be unpickled after it was read
+            # whole, so the worker is still in step with the pipe
+            self.idle.put(worker)
+            raise RuntimeError(
+                f"Failed to pass {tool_org_and_name} to or from its worker: "
+                f"{type(e).__name__}: {e}"
+            ) from e
+        except BaseException:
+            # interrupted halfway through a message
+            self.replace_worker(worker)
+            raise
+
+        if not finished:
+            self.replace_worker(worker)
+            raise TimeoutError(f"{tool_org_and_name} timed out after {timeout:.1f}s")
+
+        self.idle.put(worker)
+        if not succeeded:
+            raise RuntimeError(error)
+        return result
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "workers": len(self.workers),
+                "idle_workers": self.idle.qsize(),
+                "calls": self.calls,
+                "restarts": self.restarts,
+            }
+
+    def shutdown(self):
+        with self.lock:
+            self.stopped = True
+            workers = list(self.workers)
+        for worker in workers:
+            worker.stop()
@@ -1,8 +1,10 @@
 from typing_extensions import Literal
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
 from dotenv import load_dotenv
+import asyncio
 import traceback
 import json
 import logging
@@ -13,7 +15,9 @@ from aios.hooks.modules.storage import useStorageManager
 from aios.hooks.modules.tool import useToolManager
 from aios.hooks.modules.agent import useFactory
 from aios.hooks.modules.scheduler import fifo_scheduler_nonblock as fifo_scheduler
-from aios.hooks.syscall import useSysCall
+from aios.hooks.modules.scheduler import priority_scheduler_nonblock as priority_scheduler
+from aios.hooks.modules.scheduler import rr_scheduler_nonblock as rr_scheduler
+from aios.hooks.syscall import useSysCall, useAsyncSysCall
 from aios.config.config_manager import config
 
 from cerebrum.llm.communication import LLMQuery
@@ -46,6 +50,7 @@ active_components = {
 }
 
 send_request, SysCallWrapper = useSysCall()
+async_send_request, AsyncSysCallWrapper = useAsyncSysCall()
 
 # Configure the root logger
 logging.basicConfig(
@@ -65,35 +70,94 @@ class LLMConfig(BaseModel):
     max_new_tokens: int = 2048
     log_mode: str = "INFO"
     llm_backend: str = "default"
+    hostname: str | None = None
     api_key: str | None = None
+    max_concurrency: int | None = None
+    strategy: Literal[
+        "simple", "least_outstanding", "latency", "throughput", "consistent_hash"
+    ] = "simple"
+    max_attempts: int = 3
+    hedge_after: float | None = None
+    request_timeout: float | None = None
+    failure_threshold: int = 5
+    cooldown: float = 30.0
+    pool_size: int = 100
+    pool_keepalive: int = 20
+    keepalive_expiry: float = 30.0
+    connect_timeout: float = 5.0
+    http2: bool = False
+    prefix_cache_mb: int = 0
+    use_cache: bool = False
+    cache_size: int = 1024
+    cache_ttl: float | None = None
+    cache_path: str | None = None
+    cache_disk_size: int = 100000
 
 
 class StorageConfig(BaseModel):
     root_dir: str = "root"
     use_vector_db: bool = False
     vector_db_config: Optional[Dict[str, Any]] = None
+    compaction_ratio: float = 0.5
+    min_compaction_size: int = 1048576  # 1MB in bytes
 
 
 class MemoryConfig(BaseModel):
     memory_limit: int = 104857600  # 100MB in bytes
     eviction_k: int = 10
     custom_eviction_policy: Optional[str] = None
+    # "single" keeps memory in the heap, "mmap" in a file that survives restarts
+    memory_backend: Literal["single", "mmap"] = "single"
+    memory_path: Optional[str] = None
 
 
 class ToolManagerConfig(BaseModel):
     allowed_tools: Optional[list[str]] = None
     custom_tools: Optional[Dict[str, Any]] = None
+    # tool calls run at the same time, over all syscalls
+    max_workers: int = 8
+    # seconds a tool call may take, per tool in tool_timeouts
+    timeout: Optional[float] = None
+    tool_timeouts: Optional[Dict[str, float]] = None
+    # loaded instances kept of each tool, dropped after idle_timeout seconds
+    max_instances: int = 4
+    idle_timeout: Optional[float] = 600.0
+    # calls of a tool that run at the same time, the others wait their turn
+    max_parallel: int = 1
+    tool_max_parallel: Optional[Dict[str, int]] = None
+    # CPU-bound tools run in worker processes, with a limit on their CPU time
+    process_tools: Optional[list[str]] = None
+    process_workers: int = 2
+    cpu_limit: Optional[float] = None
+    tool_cpu_limits: Optional[Dict[str, float]] = None
+    # results of pure tools are memoized, per tool with a policy such as
+    # {"ttl": 3600, "max_entries": 100}, or True for the defaults below
+    cacheable_tools: Optional[Dict[str, Any]] = None
+    cache_size: int = 256
+    cache_ttl: Optional[float] = None
 
 
 class SchedulerConfig(BaseModel):
     log_mode: str = "INFO"
+    scheduler: Literal["fifo", "priority", "rr"] = "fifo"
     max_workers: int = 64
-    custom_syscalls: Optional[Dict[str, Any]] = None
-
-
-class SchedulerConfig(BaseModel):
-    log_mode: str = "INFO"
-    max_workers: int = 64
+    # overrides the number of processors per resource class, e.g. {"tool": 4}
+    syscall_workers: Optional[Dict[str, int]] = None
+    # run LLM syscalls as asyncio tasks, up to max_workers at a time
+    async_llm: bool = False
+    # wait this many seconds to batch LLM syscalls on local models, 0 is off
+    llm_batch_window: float = 0.0
+    llm_max_batch_size: int = 8
+    # priority scheduler only: lower values run first, 0 is the default
+    agent_priorities: Optional[Dict[str, int]] = None
+    aging_interval: float = 1.0
+    # rr scheduler only: seconds an LLM syscall runs before it is preempted
+    time_limit: float = 0.5
+    # requests and tokens per minute of LLM syscalls, e.g.
+    # {"global_limit": {"rpm": 600, "tpm": 200000},
+    #  "agent_limit": {"rpm": 60},
+    #  "model_limits": {"gpt-4o": {"rpm": 500, "tpm": 30000}}}
+    rate_limits: Optional[Dict[str, Any]] = None
     custom_syscalls: Optional[Dict[str, Any]] = None
 
 
@@ -106,6 +170,8 @@ class QueryRequest(BaseModel):
     agent_name: str
     query_type: Literal["llm", "tool", "storage", "memory"]
     query_data: LLMQuery
+    # deliver the response as server-sent events while it is generated
+    stream: bool = False
 
 
 def restart_kernel():
@@ -120,14 +186,38 @@ def restart_kernel():
             llm = useCore(
                 llm_name=llm_config.get("default_model", "gpt-4"),
                 llm_backend=llm_config.get("backend", "openai"),
+                hostname=llm_config.get("hostname"),
                 max_gpu_memory=llm_config.get("max_gpu_memory"),
                 eval_device=llm_config.get("eval_device", "cuda:0"),
                 max_new_tokens=llm_config.get("max_new_tokens", 256),
                 log_mode=llm_config.get("log_mode", "console"),
+                max_concurrency=llm_config.get("max_concurrency"),
+                strategy=llm_config.get("strategy", "simple"),
+                max_attempts=llm_config.get("max_attempts", 3),
+                hedge_after=llm_config.get("hedge_after"),
+                request_timeout=llm_config.get("request_timeout"),
+                failure_threshold=llm_config.get("failure_threshold", 5),
+                cooldown=llm_config.get("cooldown", 30.0),
+                pool_size=llm_config.get("pool_size", 100),
+                pool_keepalive=llm_config.get("pool_keepalive", 20),
+                keepalive_expiry=llm_config.get("keepalive_expiry", 30.0),
+                connect_timeout=llm_config.get("connect_timeout", 5.0),
+                http2=llm_config.get("http2", False),
+                prefix_cache_mb=llm_config.get("prefix_cache_mb", 0),
+                use_cache=llm_config.get("use_cache", False),
+                cache_size=llm_config.get("cache_size", 1024),
+                cache_ttl=llm_config.get("cache_ttl"),
+                cache_path=llm_config.get("cache_path"),
+                cache_disk_size=llm_config.get("cache_disk_size", 100000),
             )
 
             # Update components
             if llm:
+                # a running scheduler switches to the new LLM, with its rate
+                # limits and hedge pool set up as at scheduler setup
+                if active_components.get("scheduler"):
+                    active_components["scheduler"].attach_llm(llm)
+
                 # Clean up existing LLM instance if it exists
                 if active_components["llm"]:
                     if hasattr(active_components["llm"], "cleanup"):
@@ -177,10 +267,29 @@ async def setup_llm(config: LLMConfig):
         llm = useCore(
             llm_name=config.llm_name,
             llm_backend=config.llm_backend,
+            hostname=config.hostname,
             max_gpu_memory=config.max_gpu_memory,
             eval_device=config.eval_device,
             max_new_tokens=config.max_new_tokens,
             log_mode=config.log_mode,
+            max_concurrency=config.max_concurrency,
+            strategy=config.strategy,
+            max_attempts=config.max_attempts,
+            hedge_after=config.hedge_after,
+            request_timeout=config.request_timeout,
+            failure_threshold=config.failure_threshold,
+            cooldown=config.cooldown,
+            pool_size=config.pool_size,
+            pool_keepalive=config.pool_keepalive,
+            keepalive_expiry=config.keepalive_expiry,
+            connect_timeout=config.connect_timeout,
+            http2=config.http2,
+            prefix_cache_mb=config.prefix_cache_mb,
+            use_cache=config.use_cache,
+            cache_size=config.cache_size,
+            cache_ttl=config.cache_ttl,
+            cache_path=config.cache_path,
+            cache_disk_size=config.cache_disk_size,
         )
         active_components["llm"] = llm
         return {"status": "success", "message": "LLM core initialized"}
@@ -199,7 +308,9 @@ async def setup_storage(config: StorageConfig):
         storage_manager = useStorageManager(
             root_dir=config.root_dir,
             use_vector_db=config.use_vector_db,
-            **(config.vector_db_config or {}),
+            compaction_ratio=config.compaction_ratio,
+            min_compaction_size=config.min_compaction_size,
+            vector_db_config=config.vector_db_config,
         )
         active_components["storage"] = storage_manager
         return {"status": "success", "message": "Storage manager initialized"}
@@ -223,6 +334,8 @@ async def setup_memory(config: MemoryConfig):
             memory_limit=config.memory_limit,
             eviction_k=config.eviction_k,
             storage_manager=active_components["storage"],
+            memory_backend=config.memory_backend,
+            memory_path=config.memory_path,
         )
         active_components["memory"] = memory_manager
         return {"status": "success", "message": "Memory manager initialized"}
@@ -238,7 +351,25 @@ async def setup_tool_manager(config: ToolManagerConfig):
     """Set up the tool manager component."""
     try:
         print(f"\n[DEBUG] ===== Setting up Tool Manager =====")
-        tool_manager = useToolManager()
+        tool_manager = useToolManager(
+            max_workers=config.max_workers,
+            timeout=config.timeout,
+            tool_timeouts=config.tool_timeouts,
+            max_instances=config.max_instances,
+            idle_timeout=config.idle_timeout,
+            max_parallel=config.max_parallel,
+            tool_max_parallel=config.tool_max_parallel,
+            process_tools=config.process_tools,
+            process_workers=config.process_workers,
+            cpu_limit=config.cpu_limit,
+            tool_cpu_limits=config.tool_cpu_limits,
+            cacheable_tools=config.cacheable_tools,
+            cache_size=config.cache_size,
+            cache_ttl=config.cache_ttl,
+        )
+        # load the allowed tools now rather than on their first calls
+        if config.allowed_tools:
+            tool_manager.warm_up(config.allowed_tools)
         active_components["tool"] = tool_manager
         return {"status": "success", "message": "Tool manager initialized"}
     except Exception as e:
@@ -292,7 +423,7 @@ async def setup_agent_factory(config: SchedulerConfig):
 
 @app.post("/core/scheduler/setup")
 async def setup_scheduler(config: SchedulerConfig):
-    """Set up the FIFO scheduler with all components."""
+    """Set up the FIFO, priority or round robin scheduler with all components."""
     required_components = ["llm", "memory", "storage", "tool"]
     missing_components = [
         comp for comp in required_components if not active_components[comp]
@@ -306,7 +437,7 @@ async def setup_scheduler(config: SchedulerConfig):
 
     try:
         # Set up the scheduler with all components
-        scheduler = fifo_scheduler(
+        scheduler_params = dict(
             llm=active_components["llm"],
             memory_manager=active_components["memory"],
             storage_manager=active_components["storage"],
@@ -316,8 +447,30 @@ async def setup_scheduler(config: SchedulerConfig):
             get_memory_syscall=None,
             get_storage_syscall=None,
             get_tool_syscall=None,
+            max_workers={
+                "llm": config.max_workers,
+                **(config.syscall_workers or {}),
+            },
+            async_llm=config.async_llm,
+            llm_batch_window=config.llm_batch_window,
+            llm_max_batch_size=config.llm_max_batch_size,
+            rate_limits=config.rate_limits,
         )
 
+        if config.scheduler == "priority":
+            scheduler = priority_scheduler(
+                **scheduler_params,
+                agent_priorities=config.agent_priorities,
+                aging_interval=config.aging_interval,
+            )
+        elif config.scheduler == "rr":
+            scheduler = rr_scheduler(
+                **scheduler_params,
+                time_limit=config.time_limit,
+            )
+        else:
+            scheduler = fifo_scheduler(**scheduler_params)
+
         active_components["scheduler"] = scheduler
 
         scheduler.start()
@@ -339,6 +492,37 @@ async def get_status():
     }
 
 
+@app.get("/core/llm/endpoints")
+async def get_llm_endpoint_stats():
+    """Get the live statistics the router keeps for each LLM endpoint."""
+    llm = active_components["llm"]
+    if not llm:
+        raise HTTPException(status_code=404, detail="LLM core is not initialized")
+
+    return llm.strategy.get_stats()
+
+
+@app.get("/core/llm/cache")
+async def get_llm_cache_stats():
+    """Get the hit and miss counters of the LLM response cache."""
+    llm = active_components["llm"]
+    if not llm or llm.cache is None:
+        raise HTTPException(status_code=404, detail="LLM response cache is not enabled")
+
+    return llm.cache.stats()
+
+
+@app.get("/core/metrics")
+async def get_scheduler_metrics():
+    """Get the queue depths and rate limit counters of the scheduler and the
+    load and run times and cache hit rates of the tools."""
+    scheduler = active_components["scheduler"]
+    if not scheduler:
+        raise HTTPException(status_code=404, detail="Scheduler is not initialized")
+
+    return scheduler.get_metrics()
+
+
 @app.post("/agents/submit")
 async def submit_agent(config: AgentSubmit):
     """Submit an agent for execution using the agent factory."""
@@ -386,7 +570,8 @@ async def get_agent_status(execution_id: int):
 
         await_execution = active_components["factory"]["await"]
         try:
-            result = await_execution(int(execution_id))
+            # waiting for the agent must not block the event loop
+            result = await asyncio.to_thread(await_execution, int(execution_id))
         except FileNotFoundError as e:
             raise HTTPException(status_code=404, detail=str(e))
 
@@ -442,6 +627,19 @@ async def cleanup_components():
         )
 
 
+async def stream_llm_syscall(llm_syscall):
+    """Server-sent events with a chunk event per piece of generated text and
+    a final response or error event."""
+    try:
+        async for chunk in llm_syscall:
+            yield f"event: chunk\ndata: {json.dumps({'content': chunk})}\n\n"
+
+        response = await llm_syscall
+        yield f"event: response\ndata: {response.model_dump_json()}\n\n"
+    except Exception as e:
+        yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
+
 @app.post("/query")
 async def handle_query(request: QueryRequest):
     try:
@@ -452,6 +650,12 @@ async def handle_query(request: QueryRequest):
                 action_type=request.query_data.action_type,
                 message_return_type=request.query_data.message_return_type,
             )
-            return send_request(request.agent_name, query)
+            if request.stream and query.action_type == "chat":
+                llm_syscall = AsyncSysCallWrapper.llm_stream(request.agent_name, query)
+                return StreamingResponse(
+                    stream_llm_syscall(llm_syscall),
+                    media_type="text/event-stream",
+                )
+            return await async_send_request(request.agent_name, query)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
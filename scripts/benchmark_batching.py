@@ -0,0 +1,121 @@
+# Benchmark of LLM syscall batching on a local Hugging Face model. Several
+# agents submit chat syscalls at once, and the scheduler either addresses them
+# one at a time or collects them within a batching window and generates for
+# all of them in one batch. The default model is tiny, so this runs on a CPU.
+#
+# Usage: python -m scripts.benchmark_batching [--model sshleifer/tiny-gpt2]
+#            [--agents 32] [--new-tokens 32] [--window 0.05] [--batch-size 16]
+
+from aios.core.syscall.llm import LLMSyscall
+from aios.hooks.stores import queue as QueueStore
+from aios.llm_core.local import HfLocalBackend
+from aios.scheduler.fifo_scheduler import FIFOScheduler
+
+from cerebrum.llm.communication import Response
+
+from functools import partial
+from queue import Queue
+from types import SimpleNamespace
+
+import argparse
+import time
+
+class LocalLLM:
+    """ stands in for the LLMAdapter with a single in-process backend """
+    def __init__(self, backend):
+        self.backend = backend
+
+    def supports_batching(self, model=None):
+        return True
+
+    def size_hedge_pool(self, llm_workers):
+        pass
+
+    def address_syscall(self, syscall, temperature=0.0):
+        res = self.backend(messages=syscall.query.messages, temperature=temperature)
+        return Response(response_message=res, finished=True)
+
+    def address_syscall_batch(self, syscalls, temperature=0.0):
+        outputs = self.backend.generate_batch(
+            [syscall.query.messages for syscall in syscalls], temperature
+        )
+        return [Response(response_message=res, finished=True) for res in outputs]
+
+def make_scheduler(llm, queues, window, batch_size):
+    scheduler = FIFOScheduler(
+        llm=llm,
+        memory_manager=None,
+        storage_manager=None,
+        tool_manager=None,
+        log_mode="console",
+        get_llm_syscall=partial(QueueStore.getMessage, queues["llm"]),
+        get_memory_syscall=partial(QueueStore.getMessage, queues["memory"]),
+        get_storage_syscall=partial(QueueStore.getMessage, queues["storage"]),
+        get_tool_syscall=partial(QueueStore.getMessage, queues["tool"]),
+        llm_batch_window=window,
+        llm_max_batch_size=batch_size,
+    )
+    # keep console logging out of the measurement
+    scheduler.logger.log = lambda *args, **kwargs: None
+    return scheduler
+
+def measure(backend, n_agents, window, batch_size):
+    queues = {kind: Queue() for kind in ["llm", "memory", "storage", "tool"]}
+    scheduler = make_scheduler(LocalLLM(backend), queues, window, batch_size)
+    scheduler.start()
+
+    start = time.perf_counter()
+    syscalls = []
+    for idx in range(n_agents):
+        query = SimpleNamespace(
+            messages=[{"role": "user", "content": f"Agent {idx} asks: what is an operating system?"}],
+            tools=None,
+            message_return_type="text",
+        )
+        syscall = LLMSyscall(agent_name=f"agent_{idx}", query=query)
+        syscall.set_created_time(time.time())
+        QueueStore.addMessage(queues["llm"], syscall)
+        syscalls.append(syscall)
+
+    responses = [syscall.wait() for syscall in syscalls]
+    elapsed = time.perf_counter() - start
+    scheduler.stop()
+
+    tokens = sum(
+        len(backend.tokenizer(response.response_message)["input_ids"])
+        for response in responses
+    )
+    turnaround = sorted(s.get_end_time() - s.get_created_time() for s in syscalls)
+    return {
+        "seconds": elapsed,
+        "tokens_per_second": tokens / elapsed,
+        "p50_turnaround_s": turnaround[len(turnaround) // 2],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark LLM syscall batching")
+    parser.add_argument("--model", default="sshleifer/tiny-gpt2")
+    parser.add_argument("--agents", type=int, default=32)
+    parser.add_argument("--new-tokens", type=int, default=32)
+    parser.add_argument("--window", type=float, default=0.05)
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    backend = HfLocalBackend(args.model, device="cpu", max_new_tokens=args.new_tokens)
+
+    results = {
+        "one at a time": measure(backend, args.agents, 0.0, args.batch_size),
+        f"batched (window={args.window}s)": measure(
+            backend, args.agents, args.window, args.batch_size
+        ),
+    }
+
+    print(f"{'llm syscalls':<28}{'seconds':>10}{'tokens/s':>12}{'p50 turnaround s':>18}")
+    for name, result in results.items():
+        print(
+            f"{name:<28}{result['seconds']:>10.2f}{result['tokens_per_second']:>12.1f}"
+            f"{result['p50_turnaround_s']:>18.2f}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# Micro-benchmark of syscall dispatch in the scheduler. It compares the
+# event-driven dispatcher of FIFOScheduler with the previous design, where each
+# processor thread polled its request queue with a 0.1 second timeout.
+#
+# Usage: python -m scripts.benchmark_dispatch [--syscalls 200] [--idle 2.0]
+
+from aios.core.syscall.llm import LLMSyscall
+from aios.hooks.stores import queue as QueueStore
+from aios.scheduler.fifo_scheduler import FIFOScheduler
+
+from cerebrum.llm.communication import Response
+
+from functools import partial
+from queue import Queue, Empty
+from threading import Thread
+
+import argparse
+import statistics
+import time
+
+class InstantLLM:
+    """ stands in for the LLM so that only dispatch overhead is measured """
+    def address_syscall(self, syscall):
+        return Response(response_message="", finished=True)
+
+    def size_hedge_pool(self, llm_workers):
+        pass
+
+class PollingScheduler:
+    """ the dispatch loop used before the event-driven dispatcher """
+    def __init__(self, llm, queues):
+        self.llm = llm
+        self.queues = queues
+        self.active = False
+        self.threads = [
+            Thread(target=self.run, args=(q,)) for q in self.queues.values()
+        ]
+
+    def start(self):
+        self.active = True
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.active = False
+        for thread in self.threads:
+            thread.join()
+
+    def run(self, q):
+        while self.active:
+            try:
+                syscall = q.get(block=True, timeout=0.1)
+                syscall.set_status("executing")
+                syscall.set_start_time(time.time())
+                syscall.set_result(self.llm.address_syscall(syscall))
+            except Empty:
+                pass
+
+def make_queues():
+    return {kind: Queue() for kind in ["llm", "memory", "storage", "tool"]}
+
+def make_polling(queues):
+    return PollingScheduler(InstantLLM(), queues)
+
+def make_event_driven(queues):
+    scheduler = FIFOScheduler(
+        llm=InstantLLM(),
+        memory_manager=None,
+        storage_manager=None,
+        tool_manager=None,
+        log_mode="console",
+        get_llm_syscall=partial(QueueStore.getMessage, queues["llm"]),
+        get_memory_syscall=partial(QueueStore.getMessage, queues["memory"]),
+        get_storage_syscall=partial(QueueStore.getMessage, queues["storage"]),
+        get_tool_syscall=partial(QueueStore.getMessage, queues["tool"]),
+    )
+    # keep console logging out of the measurement
+    scheduler.logger.log = lambda *args, **kwargs: None
+    return scheduler
+
+def measure(make_scheduler, n_syscalls, idle_seconds):
+    queues = make_queues()
+    scheduler = make_scheduler(queues)
+    scheduler.start()
+
+    # idle CPU: nothing is submitted, so any CPU time is spent on wakeups
+    cpu_start = time.process_time()
+    time.sleep(idle_seconds)
+    idle_cpu = (time.process_time() - cpu_start) / idle_seconds
+
+    # enqueue-to-start latency, one syscall in flight at a time
+    latencies = []
+    for _ in range(n_syscalls):
+        syscall = LLMSyscall(agent_name="benchmark", query=None)
+        syscall.set_created_time(time.time())
+        QueueStore.addMessage(queues["llm"], syscall)
+        syscall.wait()
+        latencies.append(syscall.get_start_time() - syscall.get_created_time())
+
+    stop_start = time.perf_counter()
+    scheduler.stop()
+    stop_time = time.perf_counter() - stop_start
+
+    latencies.sort()
+    return {
+        "p50_latency_ms": statistics.median(latencies) * 1000,
+        "p99_latency_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "idle_cpu_percent": idle_cpu * 100,
+        "stop_ms": stop_time * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark syscall dispatch")
+    parser.add_argument("--syscalls", type=int, default=200)
+    parser.add_argument("--idle", type=float, default=2.0)
+    args = parser.parse_args()
+
+    results = {
+        "polling (timeout=0.1)": measure(make_polling, args.syscalls, args.idle),
+        "event-driven": measure(make_event_driven, args.syscalls, args.idle),
+    }
+
+    print(f"{'dispatch':<24}{'p50 ms':>10}{'p99 ms':>10}{'idle cpu %':>12}{'stop ms':>10}")
+    for name, result in results.items():
+        print(
+            f"{name:<24}{result['p50_latency_ms']:>10.3f}{result['p99_latency_ms']:>10.3f}"
+            f"{result['idle_cpu_percent']:>12.3f}{result['stop_ms']:>10.1f}"
+        )
+
+if __name__ == "__main__":
+    main()
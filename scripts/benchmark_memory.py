@@ -0,0 +1,115 @@
+# Benchmark of agent memory. Several agents write and then read back rounds of
+# memory, once with the arena based UniformedMemoryManager and once with the
+# dict of compressed pickles in SingleMemoryManager. Both compress the rounds
+# the same way, so the difference is in how the bytes are stored and found.
+# The memory limit is large enough that nothing is evicted to storage.
+#
+# Usage: python -m scripts.benchmark_memory [--agents 8] [--rounds 500]
+#            [--payload 2048]
+
+from aios.memory.base import Memory
+from aios.memory.memory_classes.single_memory import SingleMemoryManager
+from aios.memory.single_memory import UniformedMemoryManager
+
+import argparse
+import os
+import time
+
+class NullStorage:
+    """ stands in for the StorageManager, which is never reached here """
+    def sto_create(self, aname, aid=None, rid=None):
+        pass
+
+    def sto_read(self, aname, aid=None, rid=None):
+        return None
+
+    def sto_write(self, aname, s, aid=None, rid=None):
+        pass
+
+    def sto_clear(self, aname, aid=None, rid=None):
+        pass
+
+def make_rounds(agents, rounds, payload):
+    # half random bytes so that compression leaves something to store
+    return {
+        agent: [
+            {"round": rid, "content": os.urandom(payload // 2).hex()[:payload // 2]
+                                      + "x" * (payload // 2)}
+            for rid in range(rounds)
+        ]
+        for agent in [f"agent_{idx}" for idx in range(agents)]
+    }
+
+def run(write, read, data):
+    start = time.perf_counter()
+    for agent, rounds in data.items():
+        for rid, content in enumerate(rounds):
+            write(agent, rid, content)
+    written = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for agent, rounds in data.items():
+        for rid, content in enumerate(rounds):
+            assert read(agent, rid) == content
+    read_time = time.perf_counter() - start
+
+    return written, read_time
+
+def bench_copy(size, repeat=200):
+    """ the arena's bulk copy against the byte by byte loop it replaced """
+    memory = Memory(size)
+    data = os.urandom(size)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        memory.mem_write(0, data)
+    bulk = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for i in range(size):
+        memory.memory[i] = data[i]
+    loop = time.perf_counter() - start
+
+    return bulk, loop
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark agent memory managers")
+    parser.add_argument("--agents", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=500)
+    parser.add_argument("--payload", type=int, default=2048)
+    args = parser.parse_args()
+
+    data = make_rounds(args.agents, args.rounds, args.payload)
+    operations = args.agents * args.rounds
+
+    arena = UniformedMemoryManager(
+        max_memory_block_size=4 * args.rounds * args.payload,
+        memory_block_num=args.agents,
+    )
+    single = SingleMemoryManager(
+        memory_limit=64 * operations * args.payload,
+        eviction_k=2,
+        storage_manager=NullStorage(),
+    )
+
+    results = {
+        "UniformedMemoryManager": run(arena.mem_write, arena.mem_read, data),
+        "SingleMemoryManager": run(single.mem_write, single.mem_read, data),
+    }
+    single.stop()
+
+    print(f"{operations} rounds of {args.payload} bytes from {args.agents} agents")
+    for name, (written, read_time) in results.items():
+        print(
+            f"{name:24s} write {operations / written:10.0f} ops/s"
+            f"    read {operations / read_time:10.0f} ops/s"
+        )
+
+    bulk, loop = bench_copy(args.payload * 16)
+    print(
+        f"copy of {args.payload * 16} bytes: bulk {bulk * 1e6:.1f} us,"
+        f" byte loop {loop * 1e6:.1f} us"
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# Tests of the buddy allocator of the memory arenas: blocks are split down to
+# the size asked for and merged back with their buddies once freed.
+
+from aios.memory.base import Memory
+from aios.memory.single_memory import UniformedMemoryManager
+
+import random
+
+import pytest
+
+def free_blocks(memory):
+    return {order: sorted(blocks) for order, blocks in memory.free_lists.items() if blocks}
+
+def test_allocation_splits_the_smallest_block_that_fits():
+    memory = Memory(1024)
+
+    assert memory.mem_alloc(10) == 0
+    # the upper half of each split is left free, down to the 16 byte block
+    assert free_blocks(memory) == {
+        4: [16], 5: [32], 6: [64], 7: [128], 8: [256], 9: [512]
+    }
+    assert memory.free_bytes() == 1024 - 16
+
+    # the next block of that size is the buddy, without a further split
+    assert memory.mem_alloc(16) == 16
+    assert 4 not in free_blocks(memory)
+
+def test_blocks_are_aligned_to_their_size():
+    memory = Memory(4096)
+    for size in (17, 100, 16, 300, 33, 1000, 64):
+        address = memory.mem_alloc(size)
+        block_size = 1 << memory.allocated[address]
+        assert block_size >= size
+        assert address % block_size == 0
+
+def test_freed_buddies_merge_back_into_the_whole_arena():
+    memory = Memory(1024)
+    addresses = [memory.mem_alloc(size) for size in (16, 16, 32, 64, 200, 16)]
+
+    random.Random(0).shuffle(addresses)
+    for address in addresses:
+        memory.mem_clear(address)
+
+    assert free_blocks(memory) == {10: [0]}
+    assert memory.free_bytes() == 1024
+    assert memory.allocated == {}
+
+def test_block_is_not_merged_while_its_buddy_is_allocated():
+    memory = Memory(1024)
+    first = memory.mem_alloc(16)
+    second = memory.mem_alloc(16)
+
+    memory.mem_clear(first)
+    assert free_blocks(memory)[4] == [first]
+
+    memory.mem_clear(second)
+    assert free_blocks(memory) == {10: [0]}
+
+def test_arena_not_a_power_of_two_is_cut_into_aligned_blocks():
+    memory = Memory(1000)
+    layout = free_blocks(memory)
+    assert layout == {9: [0], 8: [512], 7: [768], 6: [896], 5: [960]}
+
+    addresses = [memory.mem_alloc(16) for _ in range(memory.free_bytes() // 16)]
+    with pytest.raises(MemoryError):
+        memory.mem_alloc(16)
+
+    for address in addresses:
+        memory.mem_clear(address)
+    # blocks merge up to the sizes they were cut into, but not across them
+    assert free_blocks(memory) == layout
+
+def test_exhausted_arena_raises_memory_error():
+    memory = Memory(256)
+    memory.mem_alloc(200)
+    with pytest.raises(MemoryError):
+        memory.mem_alloc(200)
+
+def test_rewritten_round_frees_its_old_allocation():
+    manager = UniformedMemoryManager(1024, 2)
+    manager.mem_write("agent", 0, "x" * 10)
+    arena = manager.memory_blocks[manager.agent_blocks["agent"]]
+    free_after_first = arena.free_bytes()
+
+    for _ in range(100):
+        manager.mem_write("agent", 0, "y" * 10)
+
+    assert arena.free_bytes() == free_after_first
+    assert manager.mem_read("agent", 0) == "y" * 10
+
+    manager.mem_clear("agent")
+    assert arena.free_bytes() == 1024
+    assert sorted(manager.free_memory_blocks) == [0, 1]
@@ -0,0 +1,168 @@
+# Tests of the LLM router's failover, circuit breaker and hedging against
+# local fake endpoints: small HTTP servers that speak the Ollama API, so the
+# requests go through litellm and the pooled transports like real ones.
+
+from aios.core.syscall.llm import LLMSyscall
+from aios.llm_core.adapter import LLMAdapter
+
+from cerebrum.llm.communication import LLMQuery
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+import asyncio
+import json
+import time
+
+import pytest
+
+class FakeOllama:
+    """
+    Local Ollama server that answers every generate request with reply,
+    after delay seconds, or fails it with status.
+    """
+    def __init__(self, reply, status=200, delay=0.0):
+        self.reply = reply
+        self.status = status
+        self.delay = delay
+        self.requests = 0
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path.endswith("/api/generate"):
+                    fake.requests += 1
+                    time.sleep(fake.delay)
+                if fake.status != 200:
+                    self.send_error(fake.status)
+                    return
+                body = json.dumps({
+                    "model": "fake",
+                    "created_at": "2024-01-01T00:00:00Z",
+                    "response": fake.reply,
+                    "done": True,
+                    "prompt_eval_count": 1,
+                    "eval_count": 1,
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def endpoints():
+    servers = []
+
+    def start(*args, **kwargs):
+        servers.append(FakeOllama(*args, **kwargs))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.close()
+
+def make_adapter(servers, **options):
+    return LLMAdapter(
+        llm_name=[f"fake-{idx}" for idx in range(len(servers))],
+        llm_backend=["ollama"] * len(servers),
+        hostname=[server.url for server in servers],
+        **options,
+    )
+
+def make_syscall():
+    return LLMSyscall(
+        "test_agent", LLMQuery(messages=[{"role": "user", "content": "hello"}])
+    )
+
+def endpoint_stats(adapter, idx):
+    return adapter.strategy.get_stats()[idx]
+
+def test_failover_to_next_endpoint(endpoints):
+    failing = endpoints("unused", status=500)
+    healthy = endpoints("from healthy")
+    adapter = make_adapter([failing, healthy])
+
+    response = adapter.address_syscall(make_syscall())
+
+    assert response.response_message == "from healthy"
+    assert failing.requests >= 1
+    assert endpoint_stats(adapter, 0)["errors"] == 1
+    assert endpoint_stats(adapter, 1)["completed"] == 1
+
+def test_circuit_breaker_opens_half_opens_and_closes(endpoints):
+    flaky = endpoints("from flaky", status=500)
+    healthy = endpoints("from healthy")
+    adapter = make_adapter([flaky, healthy], failure_threshold=1, cooldown=0.5)
+
+    # a failure opens the circuit of the flaky endpoint
+    assert adapter.address_syscall(make_syscall()).response_message == "from healthy"
+    assert endpoint_stats(adapter, 0)["state"] == "open"
+
+    # while it is open, no request is sent to it
+    requests = flaky.requests
+    for _ in range(3):
+        assert adapter.address_syscall(make_syscall()).response_message == "from healthy"
+    assert flaky.requests == requests
+
+    # after the cooldown a single probe is let through
+    flaky.status = 200
+    time.sleep(0.6)
+    stats = adapter.strategy.stats[0]
+    assert stats.available(time.monotonic())
+    assert stats.state == "half_open"
+
+    # which closes the circuit once it succeeds
+    assert adapter.address_syscall(make_syscall()).response_message == "from flaky"
+    assert flaky.requests == requests + 1
+    assert endpoint_stats(adapter, 0)["state"] == "closed"
+
+def test_hedged_request_wins(endpoints):
+    slow = endpoints("from slow", delay=3.0)
+    fast = endpoints("from fast")
+    adapter = make_adapter([slow, fast], hedge_after=0.2)
+
+    started = time.monotonic()
+    response = adapter.address_syscall(make_syscall())
+
+    assert response.response_message == "from fast"
+    assert time.monotonic() - started < 2.0
+    assert slow.requests == 1 and fast.requests == 1
+
+def test_hedged_request_cancels_the_loser(endpoints):
+    slow = endpoints("from slow", delay=3.0)
+    fast = endpoints("from fast")
+    adapter = make_adapter([slow, fast], hedge_after=0.2)
+
+    async def address():
+        # timed in the loop, since asyncio.run waits for the thread the
+        # cancelled backend call still runs in before it returns
+        started = time.monotonic()
+        response = await adapter.address_syscall_async(make_syscall())
+        return response, time.monotonic() - started
+
+    response, elapsed = asyncio.run(address())
+
+    assert response.response_message == "from fast"
+    assert elapsed < 2.0
+    # the slower request was cancelled, which counts neither as a success
+    # nor as a failure of its endpoint
+    stats = endpoint_stats(adapter, 0)
+    assert stats["outstanding"] == 0
+    assert stats["completed"] == 0 and stats["errors"] == 0
+    assert stats["state"] == "closed"
+    assert endpoint_stats(adapter, 1)["completed"] == 1
@@ -0,0 +1,54 @@
+# Tests of the in-process LLM backends, with the model replaced by a fake so
+# that no weights are loaded.
+
+from aios.llm_core.local import HfLocalBackend
+
+import time
+
+import pytest
+
+class FakeTokenizer:
+    def decode(self, token_ids, **kwargs):
+        return "".join(str(token_id) for token_id in token_ids)
+
+def make_backend(generate_single, stream_timeout=5.0):
+    backend = HfLocalBackend.__new__(HfLocalBackend)
+    backend.model_name = "fake"
+    backend.tokenizer = FakeTokenizer()
+    backend.stream_timeout = stream_timeout
+    backend.generate_single = generate_single
+    return backend
+
+def test_stream_yields_the_generated_chunks():
+    def generate_single(messages, temperature, agent_name, streamer):
+        streamer.on_finalized_text("hello ")
+        streamer.on_finalized_text("world")
+        streamer.end()
+
+    backend = make_backend(generate_single)
+
+    assert "".join(backend.generate_stream([], 0.0)) == "hello world"
+
+def test_stream_raises_when_generate_fails_midway():
+    def generate_single(messages, temperature, agent_name, streamer):
+        streamer.on_finalized_text("hello ")
+        raise RuntimeError("out of memory")
+
+    backend = make_backend(generate_single)
+    chunks = []
+
+    with pytest.raises(RuntimeError, match="out of memory"):
+        for chunk in backend.generate_stream([], 0.0):
+            chunks.append(chunk)
+    # the chunks generated before the failure were still delivered
+    assert chunks == ["hello "]
+
+def test_stream_times_out_when_generate_stalls():
+    def generate_single(messages, temperature, agent_name, streamer):
+        # neither produces output nor returns within the stream timeout
+        time.sleep(1.0)
+
+    backend = make_backend(generate_single, stream_timeout=0.2)
+
+    with pytest.raises(TimeoutError):
+        list(backend.generate_stream([], 0.0))
@@ -0,0 +1,77 @@
+# Tests of the memory managers' eviction and write-back, over a real
+# storage manager in a temporary directory.
+
+from aios.memory.memory_classes.single_memory import SingleMemoryManager
+from aios.storage.storage import StorageManager
+
+import os
+
+import pytest
+
+class CountingStorage(StorageManager):
+    """Storage manager that counts the records written to it."""
+    def __init__(self, root_dir):
+        super().__init__(root_dir)
+        self.writes = []
+
+    def sto_write(self, aname, s, aid=None, rid=None):
+        self.writes.append((aid, rid))
+        return super().sto_write(aname, s, aid=aid, rid=rid)
+
+@pytest.fixture
+def memory(tmp_path):
+    storage = CountingStorage(str(tmp_path))
+    # room for two blocks of about 220 compressed bytes
+    manager = SingleMemoryManager(500, 2, storage)
+    yield manager, storage
+    manager.stop()
+    storage.cleanup()
+
+def block(seed):
+    # random bytes do not compress, so every block has the same size
+    return os.urandom(200) + bytes([seed])
+
+def test_evicted_dirty_blocks_are_written_back(memory):
+    manager, storage = memory
+    data = {rid: block(rid) for rid in range(4)}
+    for rid, value in data.items():
+        manager.mem_write("agent", rid, value)
+    manager.flush()
+
+    assert manager.memory_usage()["evictions"] >= 2
+    assert sorted(rid for _, rid in storage.writes) == [0, 1]
+    for rid, value in data.items():
+        assert manager.mem_read("agent", rid) == value
+
+def test_clean_blocks_are_not_written_back(memory):
+    manager, storage = memory
+    for rid in range(4):
+        manager.mem_write("agent", rid, block(rid))
+
+    # reading the blocks in turn evicts them over and over, but each is
+    # written back only once, the first time it leaves memory after its write
+    for _ in range(10):
+        for rid in range(4):
+            manager.mem_read("agent", rid)
+    manager.flush()
+
+    assert manager.memory_usage()["evictions"] >= 40
+    assert sorted(rid for _, rid in storage.writes) == [0, 1, 2, 3]
+    assert manager.memory_usage()["pending_writebacks"] == 0
+
+def test_rewritten_block_is_written_back_again(memory):
+    manager, storage = memory
+    for rid in range(3):
+        manager.mem_write("agent", rid, block(rid))
+    manager.flush()
+
+    # a block read back from storage and then changed is dirty again
+    manager.mem_read("agent", 0)
+    changed = block(9)
+    manager.mem_write("agent", 0, changed)
+    for rid in range(1, 3):
+        manager.mem_read("agent", rid)
+    manager.flush()
+
+    assert storage.writes.count(("agent", 0)) == 2
+    assert manager.mem_read("agent", 0) == changed
@@ -0,0 +1,109 @@
+# Tests of the recovery of the memory-mapped agent memory log after a crash:
+# records after the saved index are scanned again, and a record torn by the
+# crash is cut off.
+
+from aios.memory.memory_classes.mmap_memory import MmapMemoryManager
+
+import os
+
+import pytest
+
+@pytest.fixture
+def log_path(tmp_path):
+    return str(tmp_path / "memory.log")
+
+def crash(manager):
+    """Close the log like a killed process would, without saving the index."""
+    manager.file.flush()
+    manager.map.close()
+    manager.file.close()
+
+def test_rounds_survive_a_restart(log_path):
+    manager = MmapMemoryManager(log_path)
+    manager.mem_write("agent", 0, "first")
+    manager.mem_write("agent", 1, {"content": "second"})
+    manager.stop()
+
+    manager = MmapMemoryManager(log_path)
+    assert manager.mem_read("agent", 0) == "first"
+    assert manager.mem_read("agent", 1) == {"content": "second"}
+    manager.stop()
+
+def test_records_after_the_saved_index_are_recovered(log_path):
+    manager = MmapMemoryManager(log_path)
+    manager.mem_write("agent", 0, "saved")
+    manager.flush()
+    manager.mem_write("agent", 1, "after the index")
+    manager.mem_write("agent", 0, "replaced")
+    manager.mem_clear("other")
+    crash(manager)
+
+    manager = MmapMemoryManager(log_path)
+    assert manager.mem_read("agent", 0) == "replaced"
+    assert manager.mem_read("agent", 1) == "after the index"
+    assert manager.memory_usage()["blocks"] == 2
+    manager.stop()
+
+def test_torn_record_is_cut_off(log_path):
+    manager = MmapMemoryManager(log_path)
+    manager.mem_write("agent", 0, "complete")
+    intact_size = os.path.getsize(log_path)
+    manager.mem_write("agent", 1, "torn" * 100)
+    crash(manager)
+
+    # the crash left only part of the last record on disk
+    with open(log_path, "r+b") as file:
+        file.truncate(os.path.getsize(log_path) - 10)
+
+    manager = MmapMemoryManager(log_path)
+    assert manager.mem_read("agent", 0) == "complete"
+    assert manager.mem_read("agent", 1) is None
+    assert os.path.getsize(log_path) == intact_size
+
+    # the log is appended to after the cut as before
+    manager.mem_write("agent", 1, "rewritten")
+    crash(manager)
+    manager = MmapMemoryManager(log_path)
+    assert manager.mem_read("agent", 1) == "rewritten"
+    manager.stop()
+
+def test_damaged_record_is_cut_off(log_path):
+    manager = MmapMemoryManager(log_path)
+    manager.mem_write("agent", 0, "complete")
+    intact_size = os.path.getsize(log_path)
+    manager.mem_write("agent", 1, "damaged")
+    crash(manager)
+
+    # the record is whole but its last byte did not make it to disk
+    with open(log_path, "r+b") as file:
+        file.seek(-1, os.SEEK_END)
+        last = file.read(1)
+        file.seek(-1, os.SEEK_END)
+        file.write(bytes([last[0] ^ 0xFF]))
+
+    manager = MmapMemoryManager(log_path)
+    assert manager.mem_read("agent", 0) == "complete"
+    assert manager.mem_read("agent", 1) is None
+    assert os.path.getsize(log_path) == intact_size
+    manager.stop()
+
+def test_stale_index_of_a_compacted_log_is_ignored(log_path):
+    manager = MmapMemoryManager(log_path)
+    for rid in range(5):
+        manager.mem_write("agent", rid, f"round {rid}")
+    manager.flush()
+    with open(log_path + ".index", "rb") as file:
+        stale_index = file.read()
+    manager.mem_clear("agent")
+    manager.mem_write("agent", 9, "after compaction")
+    manager.compact()
+    manager.stop()
+
+    # an index saved before the compaction has another generation
+    with open(log_path + ".index", "wb") as file:
+        file.write(stale_index)
+
+    manager = MmapMemoryManager(log_path)
+    assert manager.mem_read("agent", 0) is None
+    assert manager.mem_read("agent", 9) == "after compaction"
+    manager.stop()
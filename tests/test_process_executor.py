@@ -0,0 +1,106 @@
+# Tests of the worker processes that run CPU-bound tools: results and errors
+# come back over the pipe, and a worker that runs over its time or CPU limit is
+# killed and replaced. The tools are fakes loaded by load_fake_tool, which the
+# spawned workers import from this module.
+
+from aios.tool.process_executor import ToolProcessExecutor, resource
+
+from threading import Lock
+
+import os
+import time
+
+import pytest
+
+class EchoTool:
+    def run(self, params):
+        return {"pid": os.getpid(), **params}
+
+class FailingTool:
+    def run(self, params):
+        raise ValueError("bad input")
+
+class SpinTool:
+    """Busy loop for the seconds it is given."""
+    def run(self, params):
+        deadline = time.monotonic() + params["seconds"]
+        while time.monotonic() < deadline:
+            pass
+        return "done"
+
+class SleepTool:
+    def run(self, params):
+        time.sleep(params["seconds"])
+        return "done"
+
+FAKE_TOOLS = {
+    "test/echo": EchoTool,
+    "test/fail": FailingTool,
+    "test/spin": SpinTool,
+    "test/sleep": SleepTool,
+}
+
+def load_fake_tool(tool_org_and_name):
+    return FAKE_TOOLS[tool_org_and_name]()
+
+@pytest.fixture(scope="module")
+def executor():
+    executor = ToolProcessExecutor(num_workers=1, loader=load_fake_tool)
+    yield executor
+    executor.shutdown()
+
+def test_result_comes_back_from_the_worker(executor):
+    result = executor.run("test/echo", {"value": 1})
+
+    assert result["value"] == 1
+    assert result["pid"] != os.getpid()
+
+def test_large_buffers_round_trip(executor):
+    payload = os.urandom(1024 * 1024)
+
+    result = executor.run("test/echo", {"payload": payload, "array": bytearray(payload)})
+
+    assert result["payload"] == payload
+    assert result["array"] == bytearray(payload)
+
+def test_tool_error_is_raised_and_the_worker_kept(executor):
+    restarts = executor.get_stats()["restarts"]
+
+    with pytest.raises(RuntimeError, match="ValueError: bad input"):
+        executor.run("test/fail", {})
+
+    assert executor.get_stats()["restarts"] == restarts
+    assert executor.run("test/echo", {"value": 2})["value"] == 2
+
+def test_unpicklable_params_keep_the_worker(executor):
+    pid = executor.run("test/echo", {})["pid"]
+
+    with pytest.raises(RuntimeError, match="Failed to pass"):
+        executor.run("test/echo", {"lock": Lock()})
+
+    # the same worker is still in step with its pipe
+    assert executor.run("test/echo", {})["pid"] == pid
+    assert executor.get_stats()["idle_workers"] == 1
+
+def test_call_past_its_timeout_replaces_the_worker(executor):
+    pid = executor.run("test/echo", {})["pid"]
+    restarts = executor.get_stats()["restarts"]
+
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        executor.run("test/sleep", {"seconds": 10}, timeout=0.5)
+    assert time.monotonic() - started < 5.0
+
+    assert executor.get_stats()["restarts"] == restarts + 1
+    assert executor.run("test/echo", {}, timeout=30)["pid"] != pid
+
+@pytest.mark.skipif(resource is None, reason="CPU limits need the resource module")
+def test_call_over_its_cpu_limit_is_killed(executor):
+    restarts = executor.get_stats()["restarts"]
+
+    with pytest.raises(RuntimeError, match="CPU time limit"):
+        executor.run("test/spin", {"seconds": 10}, timeout=30, cpu_limit=1)
+
+    assert executor.get_stats()["restarts"] == restarts + 1
+    # the limit only applied to that call
+    assert executor.run("test/spin", {"seconds": 1.5}, timeout=30, cpu_limit=None) == "done"
@@ -0,0 +1,112 @@
+# Tests of the recovery of the storage record files after a crash: records the
+# index missed are found by scanning the data file, and a record torn by the
+# crash is cut off.
+
+from aios.storage.storage_classes.record_file import RecordFile, INDEX_ENTRY
+
+import os
+import pickle
+
+import pytest
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "agent")
+
+def test_records_survive_reopening(path):
+    records = RecordFile(path)
+    records.append("first", rid=0)
+    records.append("log entry")
+    records.append("replaced", rid=0)
+    records.close()
+
+    records = RecordFile(path)
+    assert records.read(0) == "replaced"
+    assert records.read() == "log entry"
+    assert records.stats()["records"] == 2
+    records.close()
+
+def test_torn_record_is_cut_off(path):
+    records = RecordFile(path)
+    records.append("complete", rid=0)
+    intact_size = records.size()
+    records.append("torn" * 100, rid=1)
+    records.close()
+
+    # the crash left only part of the last record on disk
+    with open(path + ".dat", "r+b") as file:
+        file.truncate(os.path.getsize(path + ".dat") - 10)
+
+    records = RecordFile(path)
+    assert records.read(0) == "complete"
+    assert records.read(1) is None
+    assert records.size() == intact_size
+
+    # the file is appended to after the cut as before
+    records.append("rewritten", rid=1)
+    records.close()
+    records = RecordFile(path)
+    assert records.read(1) == "rewritten"
+    assert records.rounds() == [0, 1]
+    records.close()
+
+def test_damaged_record_is_cut_off(path):
+    records = RecordFile(path)
+    records.append("complete", rid=0)
+    intact_size = records.size()
+    records.append("damaged", rid=1)
+    records.close()
+
+    # the record is whole but its last byte did not make it to disk
+    with open(path + ".dat", "r+b") as file:
+        file.seek(-1, os.SEEK_END)
+        last = file.read(1)
+        file.seek(-1, os.SEEK_END)
+        file.write(bytes([last[0] ^ 0xFF]))
+
+    records = RecordFile(path)
+    assert records.read(0) == "complete"
+    assert records.read(1) is None
+    assert records.size() == intact_size
+    records.close()
+
+def test_records_missing_from_the_index_are_recovered(path):
+    records = RecordFile(path)
+    records.append("indexed", rid=0)
+    index_size = os.path.getsize(path + ".idx")
+    records.append("not indexed", rid=1)
+    records.clear(0)
+    records.close()
+
+    # the crash came after the records were written but before their entries
+    with open(path + ".idx", "r+b") as file:
+        file.truncate(index_size)
+
+    records = RecordFile(path)
+    assert records.read(0) is None
+    assert records.read(1) == "not indexed"
+    records.close()
+
+    # the index was completed, so the next opening does not scan again
+    entry = INDEX_ENTRY.size + len(pickle.dumps(0))
+    assert os.path.getsize(path + ".idx") == index_size + 2 * entry
+
+def test_index_of_another_data_file_is_rebuilt(path):
+    records = RecordFile(path, min_compaction_size=0)
+    for rid in range(5):
+        records.append(f"round {rid}", rid=rid)
+    with open(path + ".idx", "rb") as file:
+        stale_index = file.read()
+    for rid in range(4):
+        records.clear(rid)
+    records.compact()
+    records.close()
+
+    # a crash during compaction can leave the old index next to the new data
+    with open(path + ".idx", "wb") as file:
+        file.write(stale_index)
+
+    records = RecordFile(path)
+    assert records.rounds() == [4]
+    assert records.read(4) == "round 4"
+    records.close()
@@ -0,0 +1,96 @@
+# Tests of the memoized results of cacheable tools: entries expire after their
+# ttl, the least recently used are evicted past the size of a tool's cache, and
+# the tool manager answers repeated calls from it without running the tool.
+
+from aios.core.syscall.tool import ToolSyscall
+from aios.tool.cache import ToolResultCache
+from aios.tool.manager import ToolManager
+
+import time
+
+def test_keys_are_canonical():
+    assert ToolResultCache.make_key({"a": 1, "b": [1, 2]}) \
+        == ToolResultCache.make_key({"b": [1, 2], "a": 1})
+    assert ToolResultCache.make_key({"a": 1}) != ToolResultCache.make_key({"a": 2})
+    # parameters that are not plain JSON are not cached
+    assert ToolResultCache.make_key({"a": object()}) is None
+
+def test_only_configured_tools_are_cached():
+    cache = ToolResultCache()
+    cache.configure("cached", True)
+    key = cache.make_key({})
+
+    cache.put("cached", key, "result")
+    cache.put("uncached", key, "result")
+
+    assert cache.get("cached", key) == (True, "result")
+    assert cache.get("uncached", key) == (False, None)
+    assert not cache.is_cacheable("uncached")
+
+    cache.configure("cached", False)
+    assert cache.get("cached", key) == (False, None)
+
+def test_entries_expire_after_their_ttl():
+    cache = ToolResultCache(ttl=0.1)
+    cache.configure("default_ttl", True)
+    cache.configure("long_ttl", {"ttl": 60})
+    key = cache.make_key({"x": 1})
+    cache.put("default_ttl", key, 1)
+    cache.put("long_ttl", key, 1)
+
+    assert cache.get("default_ttl", key) == (True, 1)
+    time.sleep(0.15)
+
+    assert cache.get("default_ttl", key) == (False, None)
+    assert cache.get("long_ttl", key) == (True, 1)
+    stats = cache.get_stats()["default_ttl"]
+    assert stats["hits"] == 1 and stats["misses"] == 1 and stats["entries"] == 0
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ToolResultCache(max_entries=256)
+    cache.configure("tool", {"max_entries": 2})
+    first, second, third = (cache.make_key({"x": x}) for x in range(3))
+
+    cache.put("tool", first, 1)
+    cache.put("tool", second, 2)
+    # a hit makes the first entry the most recently used
+    assert cache.get("tool", first) == (True, 1)
+    cache.put("tool", third, 3)
+
+    assert cache.get("tool", second) == (False, None)
+    assert cache.get("tool", first) == (True, 1)
+    assert cache.get("tool", third) == (True, 3)
+    stats = cache.get_stats()["tool"]
+    assert stats["evictions"] == 1 and stats["entries"] == 2
+
+class CountingTool:
+    runs = 0
+
+    def run(self, params):
+        CountingTool.runs += 1
+        if params.get("fail"):
+            raise ValueError("bad input")
+        return params["x"] * 2
+
+def test_manager_answers_repeated_calls_from_the_cache():
+    manager = ToolManager(cacheable_tools={"test/double": True})
+    manager.load_tool_instance = lambda tool_org_and_name: CountingTool()
+    CountingTool.runs = 0
+
+    def call(**parameters):
+        syscall = ToolSyscall("agent", [{"name": "test/double", "parameters": parameters}])
+        return manager.address_request(syscall).tool_calls[0]
+
+    try:
+        assert call(x=2)["result"] == 4
+        assert call(x=2)["result"] == 4
+        assert CountingTool.runs == 1
+
+        # failed calls are not cached
+        assert call(x=2, fail=True)["succeeded"] is False
+        assert call(x=2, fail=True)["succeeded"] is False
+        assert CountingTool.runs == 3
+
+        assert manager.get_metrics()["tool_cache"]["hits"] == 1
+    finally:
+        manager.cleanup()
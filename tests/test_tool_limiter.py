@@ -0,0 +1,127 @@
+# Tests of the per tool concurrency limits: waiters get their turn in the order
+# they arrived, a permit is never lost when a wait times out as it is handed
+# over, and waits are counted in the limiter's stats.
+
+import aios.tool.limiter as limiter_module
+from aios.tool.limiter import FifoSemaphore, ToolLimiter
+
+from threading import Lock, Thread
+
+import time
+
+def start_waiters(semaphore, count, order):
+    """Start waiters one after another, so that they queue in that order.
+    Each records its turn and passes the permit on."""
+    threads = []
+    for idx in range(count):
+        def wait(idx=idx):
+            if semaphore.acquire():
+                order.append(idx)
+                semaphore.release()
+        threads.append(Thread(target=wait))
+        threads[-1].start()
+        while semaphore.queued() < idx + 1:
+            time.sleep(0.001)
+    return threads
+
+def test_waiters_get_the_permit_in_arrival_order():
+    semaphore = FifoSemaphore(1)
+    assert semaphore.acquire()
+    order = []
+    threads = start_waiters(semaphore, 5, order)
+
+    semaphore.release()
+    for thread in threads:
+        thread.join(timeout=1.0)
+
+    assert order == [0, 1, 2, 3, 4]
+    assert semaphore.value == 1
+
+def test_newcomer_does_not_overtake_a_waiter():
+    semaphore = FifoSemaphore(1)
+    assert semaphore.acquire()
+    waiter_done = Lock()
+    waiter_done.acquire()
+
+    def wait():
+        semaphore.acquire()
+        waiter_done.acquire()
+        semaphore.release()
+
+    thread = Thread(target=wait)
+    thread.start()
+    while semaphore.queued() < 1:
+        time.sleep(0.001)
+
+    semaphore.release()
+    # the permit went straight to the waiter, not back to the semaphore
+    assert not semaphore.acquire(timeout=0)
+
+    waiter_done.release()
+    thread.join(timeout=1.0)
+    assert semaphore.acquire(timeout=0)
+
+def test_timed_out_waiter_leaves_the_queue():
+    semaphore = FifoSemaphore(1)
+    assert semaphore.acquire()
+
+    started = time.monotonic()
+    assert not semaphore.acquire(timeout=0.1)
+    assert time.monotonic() - started >= 0.1
+    assert semaphore.queued() == 0
+
+    # the permit released later is not handed to the waiter that gave up
+    semaphore.release()
+    assert semaphore.acquire(timeout=0)
+
+def test_permit_handed_over_as_the_wait_times_out_is_kept(monkeypatch):
+    semaphore = FifoSemaphore(1)
+    assert semaphore.acquire()
+
+    class HandOverOnTimeout:
+        """Waiter lock whose timed wait fails just after the permit was
+        handed to it, the race that acquire has to settle."""
+        def __init__(self):
+            self.lock = Lock()
+
+        def acquire(self, timeout=-1):
+            if timeout == -1:
+                return self.lock.acquire()
+            semaphore.release()
+            return False
+
+        def release(self):
+            self.lock.release()
+
+    # only the waiter lock is created after the semaphore
+    monkeypatch.setattr(limiter_module, "Lock", HandOverOnTimeout)
+
+    # the waiter holds the permit it was handed, and none was made up
+    assert semaphore.acquire(timeout=0.1)
+    assert semaphore.queued() == 0
+    assert semaphore.value == 0
+
+def test_limiter_applies_per_tool_limits_and_counts_waits():
+    limiter = ToolLimiter(max_parallel=1, tool_max_parallel={"wide": 2})
+
+    assert limiter.acquire("narrow") is not None
+    assert limiter.acquire("wide") is not None
+    assert limiter.acquire("wide") is not None
+    assert limiter.acquire("wide", timeout=0.05) is None
+
+    def release_later():
+        time.sleep(0.2)
+        limiter.release("narrow")
+
+    releaser = Thread(target=release_later)
+    releaser.start()
+    waited = limiter.acquire("narrow", timeout=1.0)
+    releaser.join()
+
+    assert waited >= 0.2
+    stats = limiter.get_stats()
+    assert stats["narrow"]["waits"] == 1
+    assert stats["narrow"]["max_wait"] >= 0.2
+    assert stats["narrow"]["queued"] == 0
+    # the call that gave up waiting is counted too
+    assert stats["wide"]["waits"] == 1
@@ -0,0 +1,89 @@
+# Tests of how the tool manager runs the calls of a tool syscall: side by side,
+# with their results in the order of the calls, and with a timeout per call.
+# The tools are fakes handed to the manager in place of loaded ones.
+
+from aios.core.syscall.tool import ToolSyscall
+from aios.tool.manager import ToolManager
+
+import time
+
+import pytest
+
+class SleepTool:
+    """Tool that sleeps for the seconds it is given and returns them."""
+    def run(self, params):
+        time.sleep(params["seconds"])
+        return params["seconds"]
+
+class FailingTool:
+    def run(self, params):
+        raise ValueError("bad input")
+
+TOOLS = {
+    "test/sleep": SleepTool,
+    "test/sleep_other": SleepTool,
+    "test/fail": FailingTool,
+}
+
+@pytest.fixture
+def manager():
+    manager = ToolManager(max_workers=4, max_parallel=4)
+    manager.load_tool_instance = lambda tool_org_and_name: TOOLS[tool_org_and_name]()
+    yield manager
+    manager.cleanup()
+
+def call(name, **parameters):
+    return {"name": name, "parameters": parameters}
+
+def test_calls_run_side_by_side(manager):
+    syscall = ToolSyscall("agent", [
+        call("test/sleep", seconds=0.5),
+        call("test/sleep_other", seconds=0.5),
+        call("test/sleep", seconds=0.5),
+    ])
+
+    started = time.monotonic()
+    response = manager.address_request(syscall)
+
+    assert time.monotonic() - started < 1.0
+    assert [result["succeeded"] for result in response.tool_calls] == [True] * 3
+
+def test_results_follow_the_order_of_the_calls(manager):
+    syscall = ToolSyscall("agent", [
+        call("test/sleep", seconds=0.3),
+        call("test/sleep", seconds=0.0),
+        call("test/fail"),
+    ])
+
+    response = manager.address_request(syscall)
+
+    assert [result["result"] for result in response.tool_calls[:2]] == [0.3, 0.0]
+    assert response.tool_calls[2]["succeeded"] is False
+    assert "bad input" in response.tool_calls[2]["result"]
+    assert response.response_message.splitlines() == [
+        "test/sleep: 0.3",
+        "test/sleep: 0.0",
+        "test/fail: Tool calling error: bad input",
+    ]
+
+def test_single_call_returns_its_result(manager):
+    response = manager.address_request(
+        ToolSyscall("agent", [call("test/sleep", seconds=0.0)])
+    )
+
+    assert response.response_message == "0.0"
+
+def test_slow_call_times_out_without_holding_up_the_others(manager):
+    manager.tool_timeouts = {"test/sleep": 0.3}
+    syscall = ToolSyscall("agent", [
+        call("test/sleep", seconds=2.0),
+        call("test/sleep_other", seconds=0.1),
+    ])
+
+    started = time.monotonic()
+    response = manager.address_request(syscall)
+
+    assert time.monotonic() - started < 1.0
+    slow, fast = response.tool_calls
+    assert slow["succeeded"] is False and "timed out" in slow["result"]
+    assert fast["succeeded"] is True and fast["result"] == 0.1
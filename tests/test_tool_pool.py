@@ -0,0 +1,96 @@
+# Tests of the pool of loaded tool instances: instances are reused between
+# calls, each tool has a bounded number of them, and idle ones are dropped.
+
+from aios.tool.pool import ToolInstancePool
+
+from threading import Thread
+
+import time
+
+import pytest
+
+class CountingLoader:
+    """Loader that counts the instances it loads of each tool."""
+    def __init__(self, fail=()):
+        self.loads = []
+        self.fail = set(fail)
+
+    def __call__(self, tool_name):
+        if tool_name in self.fail:
+            raise ImportError(f"cannot load {tool_name}")
+        self.loads.append(tool_name)
+        return object()
+
+def test_released_instance_is_reused():
+    loader = CountingLoader()
+    pool = ToolInstancePool(loader)
+
+    first = pool.acquire("tool")
+    pool.release("tool", first, run_time=0.1)
+    second = pool.acquire("tool")
+
+    assert second is first
+    assert loader.loads == ["tool"]
+    stats = pool.get_stats()["tool"]
+    assert stats["loads"] == 1 and stats["reuses"] == 1 and stats["runs"] == 1
+
+def test_concurrent_calls_get_instances_of_their_own():
+    loader = CountingLoader()
+    pool = ToolInstancePool(loader, max_instances=2)
+
+    first = pool.acquire("tool")
+    second = pool.acquire("tool")
+
+    assert first is not second
+    assert loader.loads == ["tool", "tool"]
+
+def test_calls_beyond_the_bound_wait_for_an_instance():
+    pool = ToolInstancePool(CountingLoader(), max_instances=1)
+    instance = pool.acquire("tool")
+    acquired = []
+
+    waiter = Thread(target=lambda: acquired.append(pool.acquire("tool")))
+    waiter.start()
+    time.sleep(0.2)
+    assert acquired == []
+
+    pool.release("tool", instance)
+    waiter.join(timeout=1.0)
+    assert acquired == [instance]
+    assert pool.get_stats()["tool"]["instances"] == 1
+
+def test_failed_load_frees_its_slot():
+    loader = CountingLoader(fail={"tool"})
+    pool = ToolInstancePool(loader, max_instances=1)
+
+    with pytest.raises(ImportError):
+        pool.acquire("tool")
+
+    loader.fail.clear()
+    # would wait forever if the failed load had kept the only slot
+    pool.acquire("tool")
+    assert pool.get_stats()["tool"]["instances"] == 1
+
+def test_idle_instances_are_dropped():
+    loader = CountingLoader()
+    pool = ToolInstancePool(loader, idle_timeout=0.1)
+    pool.release("tool", pool.acquire("tool"))
+
+    time.sleep(0.2)
+    pool.acquire("other")
+
+    assert pool.get_stats()["tool"]["instances"] == 0
+    pool.acquire("tool")
+    assert loader.loads == ["tool", "other", "tool"]
+
+def test_warm_up_loads_instances_ahead():
+    loader = CountingLoader()
+    pool = ToolInstancePool(loader, max_instances=2)
+
+    pool.warm_up("tool", count=3)
+
+    # no more than the bound are loaded
+    assert loader.loads == ["tool", "tool"]
+    assert pool.get_stats()["tool"]["idle"] == 2
+    pool.acquire("tool")
+    assert len(loader.loads) == 2